@@ -6,3 +6,12 @@ workers = 2
 threads = 2
 max_requests = 500
 max_requests_jitter = 40
+
+
+def when_ready(server):
+    # Runs in the master once the app is preloaded, before workers are forked
+    from project.utils.warmup import format_report, warm_up
+
+    server.log.info("Warming up modules before forking workers")
+    for line in format_report(warm_up()):
+        server.log.info(line)
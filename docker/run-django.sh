@@ -3,6 +3,9 @@ if [ "$1" = "pytest" ]; then
     shift
     /wait-for-it.sh --host=db --port=5432
     exec pytest "$@"
+elif [ "$1" = "gunicorn" ]; then
+    shift
+    exec /venv/bin/gunicorn -c /app/bin/gunicorn.conf.py -b 0.0.0.0:${RUNSERVER_PORT-8000} "$@"
 else
     exec /venv/bin/python /app/manage.py runserver 0.0.0.0:${RUNSERVER_PORT-8000}
 fi
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class RouteDBConfig(AppConfig):
     name = "project.routedb"
+
+    def ready(self):
+        from project.routedb import signals  # noqa: F401
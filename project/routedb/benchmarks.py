@@ -0,0 +1,442 @@
+import struct
+import time
+from unittest import mock
+
+import numpy as np
+
+from project.routedb.models import Route
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    def decorator(func):
+        BENCHMARKS[name] = func
+        return func
+
+    return decorator
+
+
+def timed(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - t0)
+    return timings
+
+
+def summarize(label, timings):
+    timings_ms = np.array(timings) * 1000
+    return (
+        f"{label}: median {np.median(timings_ms):.2f}ms, "
+        f"min {timings_ms.min():.2f}ms, max {timings_ms.max():.2f}ms "
+        f"({len(timings_ms)} runs)"
+    )
+
+
+def synthetic_route(n_points, lat=61.45, lon=24.19, start=1577836800, seed=0):
+    rng = np.random.default_rng(seed)
+    lats = lat + np.cumsum(rng.normal(0, 2e-5, n_points))
+    lons = lon + np.cumsum(rng.normal(0, 4e-5, n_points))
+    times = start + np.arange(n_points, dtype=np.float64)
+    return [
+        {"time": t, "latlon": [round(la, 6), round(lo, 6)]}
+        for t, la, lo in zip(times.tolist(), lats.tolist(), lons.tolist())
+    ]
+
+
+def _fit_crc_table():
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+        table.append(crc)
+    return table
+
+
+FIT_CRC_TABLE = _fit_crc_table()
+
+
+def fit_crc(data, crc=0):
+    for byte in data:
+        crc = (crc >> 8) ^ FIT_CRC_TABLE[(crc ^ byte) & 0xFF]
+    return crc
+
+
+def synthetic_fit(
+    route, big_endian=False, compressed_timestamps=False, developer_fields=False
+):
+    """
+    FIT activity file of a list of {"time": ..., "latlon": [lat, lon]} points,
+    as record messages with altitude and heart rate, and an event message
+    every 100 points
+    """
+    from project.utils.route_files import FIT_EPOCH, SEMICIRCLES_TO_DEGREES
+
+    endian = ">" if big_endian else "<"
+    messages = []
+
+    def define(local_type, global_number, fields, developer=()):
+        header = 0x40 | local_type | (0x20 if developer else 0)
+        message = struct.pack(
+            endian + "BBBHB", header, 0, int(big_endian), global_number, len(fields)
+        )
+        message += b"".join(struct.pack("BBB", *field) for field in fields)
+        if developer:
+            message += bytes([len(developer)])
+            message += b"".join(struct.pack("BBB", *field) for field in developer)
+        messages.append(message)
+
+    def fit_time(point):
+        if point["time"] is None:
+            return 0xFFFFFFFF
+        return int(point["time"]) - FIT_EPOCH
+
+    developer = [(0, 1, 0)] if developer_fields else []
+    position_fields = [(0, 4, 0x85), (1, 4, 0x85), (2, 2, 0x84), (3, 1, 0x02)]
+    define(0, 0, [(0, 1, 0x00), (1, 2, 0x84), (4, 4, 0x86)])
+    messages.append(struct.pack(endian + "BBHI", 0, 4, 255, fit_time(route[0])))
+    define(1, 20, [(253, 4, 0x86)] + position_fields, developer)
+    define(2, 21, [(253, 4, 0x86), (0, 1, 0x00), (1, 1, 0x00)])
+    define(3, 20, position_fields, developer)
+    last_time = None
+    for i, point in enumerate(route):
+        lat, lon = (round(value / SEMICIRCLES_TO_DEGREES) for value in point["latlon"])
+        time = fit_time(point)
+        values = struct.pack(endian + "iiHB", lat, lon, 2500, 150) + b"\0" * len(
+            developer
+        )
+        if (
+            compressed_timestamps
+            and time != 0xFFFFFFFF
+            and last_time is not None
+            and 0 <= time - last_time < 32
+        ):
+            messages.append(bytes([0x80 | 3 << 5 | time & 0x1F]) + values)
+        else:
+            messages.append(bytes([1]) + struct.pack(endian + "I", time) + values)
+        if time != 0xFFFFFFFF:
+            last_time = time
+        if i % 100 == 99:
+            messages.append(struct.pack(endian + "BIBB", 2, time, 0, 3))
+    data = b"".join(messages)
+    header = struct.pack("<BBHI4s", 14, 0x20, 2132, len(data), b".FIT")
+    header += struct.pack("<H", fit_crc(header))
+    return header + data + struct.pack("<H", fit_crc(data, fit_crc(header)))
+
+
+def _legacy_tz_at_coords(lat, lng):
+    from timezonefinder import TimezoneFinder
+
+    return TimezoneFinder().timezone_at(lng=lng, lat=lat)
+
+
+def _legacy_country_at_coords(lat, lng):
+    import reverse_geocoder
+
+    return reverse_geocoder.search((lat, lng))[0].get("cc")
+
+
+@benchmark("route_save")
+def route_save_benchmark(repeat=20, points=5000, **kwargs):
+    """Time spent computing a route extras on save, with the legacy per call
+    lookups and with the process wide geo lookup service"""
+    from project.utils.geo import geo_lookup
+
+    route = Route(name="benchmark")
+    route.route = synthetic_route(points)
+    results = []
+    with (
+        mock.patch("project.routedb.models.tz_at_coords", _legacy_tz_at_coords),
+        mock.patch(
+            "project.routedb.models.country_at_coords", _legacy_country_at_coords
+        ),
+    ):
+        route.prefetch_route_extras()
+        results.append(
+            summarize("legacy lookups", timed(route.prefetch_route_extras, repeat))
+        )
+    geo_lookup.warm()
+    geo_lookup.clear()
+    results.append(
+        summarize(
+            "geo lookup service, cold cache", timed(route.prefetch_route_extras, 1)
+        )
+    )
+    results.append(
+        summarize(
+            "geo lookup service, warm cache", timed(route.prefetch_route_extras, repeat)
+        )
+    )
+    return results
+
+
+def throughput(label, timings, points):
+    return (
+        f"{summarize(label, timings)}, "
+        f"{points / np.median(timings) / 1e6:.2f}M points/s"
+    )
+
+
+@benchmark("route_file_parse")
+def route_file_parse_benchmark(repeat=20, points=5000, **kwargs):
+    """Reading the points of an uploaded GPX file, compared with gpxpy and with
+    the route_data JSON posted by the clients"""
+    import json
+    from io import BytesIO
+
+    import gpxpy
+
+    from project.routedb.serializers import validate_route_data
+    from project.utils.gpx import gpx_chunks
+    from project.utils.route_data import validate_route_arrays
+    from project.utils.route_files import parse_route_file
+
+    route = synthetic_route(points)
+    gpx_data = "".join(gpx_chunks(route)).encode()
+    json_data = json.dumps(route)
+
+    def parse_with_gpxpy():
+        gpxpy.parse(gpx_data.decode())
+
+    def parse_json():
+        validate_route_data(json.loads(json_data))
+
+    def parse_file():
+        validate_route_arrays(parse_route_file(BytesIO(gpx_data)))
+
+    return [
+        throughput("gpxpy", timed(parse_with_gpxpy, repeat), points),
+        throughput("route_data json", timed(parse_json, repeat), points),
+        throughput("iterparse", timed(parse_file, repeat), points),
+    ]
+
+
+@benchmark("fit_parse")
+def fit_parse_benchmark(repeat=20, points=5000, **kwargs):
+    """Reading the points of an uploaded FIT file compared with the same route
+    as GPX"""
+    from io import BytesIO
+
+    from project.utils.gpx import gpx_chunks
+    from project.utils.route_data import validate_route_arrays
+    from project.utils.route_files import parse_route_file
+
+    route = synthetic_route(points)
+    fit_data = synthetic_fit(route)
+    gpx_data = "".join(gpx_chunks(route)).encode()
+
+    def parse_gpx():
+        validate_route_arrays(parse_route_file(BytesIO(gpx_data)))
+
+    def parse_fit():
+        validate_route_arrays(parse_route_file(BytesIO(fit_data)))
+
+    return [
+        f"file sizes: gpx {len(gpx_data) / 1e6:.2f}MB, "
+        f"fit {len(fit_data) / 1e6:.2f}MB",
+        throughput("gpx", timed(parse_gpx, repeat), points),
+        throughput("fit", timed(parse_fit, repeat), points),
+    ]
+
+
+def _legacy_validate_route_data(value):
+    from project.utils.validators import validate_latitude, validate_longitude
+
+    for x in value:
+        validate_latitude(x["latlon"][0])
+        validate_longitude(x["latlon"][1])
+    return value
+
+
+@benchmark("route_data_validation")
+def route_data_validation_benchmark(repeat=20, points=5000, **kwargs):
+    """Validating posted route data point by point and on arrays, then the
+    route extras parsing route_json again or reusing the validated arrays"""
+    from project.routedb.serializers import validate_route_data
+    from project.utils.geo import geo_lookup
+
+    data = synthetic_route(points)
+    arrays = validate_route_data(data)
+    route = Route(name="benchmark")
+    route.route = data
+    geo_lookup.warm()
+    return [
+        throughput(
+            "per point validators",
+            timed(lambda: _legacy_validate_route_data(data), repeat),
+            points,
+        ),
+        throughput(
+            "vectorized validation",
+            timed(lambda: validate_route_data(data), repeat),
+            points,
+        ),
+        throughput(
+            "route extras from route_json",
+            timed(route.prefetch_route_extras, repeat),
+            points,
+        ),
+        throughput(
+            "route extras from arrays",
+            timed(lambda: route.prefetch_route_extras(arrays), repeat),
+            points,
+        ),
+    ]
+
+
+@benchmark("route_json_render")
+def route_json_render_benchmark(repeat=20, points=5000, **kwargs):
+    """Rendering the points of a route detail response and parsing a posted
+    route, with the rest_framework classes and with orjson"""
+    import json
+    from io import BytesIO
+
+    import orjson
+    from rest_framework.parsers import JSONParser
+    from rest_framework.renderers import JSONRenderer
+
+    from project.utils.parsers import ORJSONParser
+    from project.utils.renderers import ORJSONRenderer
+
+    route_json = json.dumps(synthetic_route(points))
+    body = json.dumps({"name": "benchmark", "route_data": json.loads(route_json)})
+    body = body.encode()
+
+    def render_stdlib():
+        JSONRenderer().render({"route_data": json.loads(route_json)})
+
+    def render_orjson():
+        ORJSONRenderer().render({"route_data": json.loads(route_json)})
+
+    def render_fragment():
+        ORJSONRenderer().render({"route_data": orjson.Fragment(route_json)})
+
+    return [
+        throughput(
+            "render, json.loads + JSONRenderer", timed(render_stdlib, repeat), points
+        ),
+        throughput(
+            "render, json.loads + ORJSONRenderer", timed(render_orjson, repeat), points
+        ),
+        throughput(
+            "render, stored JSON as a fragment", timed(render_fragment, repeat), points
+        ),
+        throughput(
+            "parse, JSONParser",
+            timed(lambda: JSONParser().parse(BytesIO(body)), repeat),
+            points,
+        ),
+        throughput(
+            "parse, ORJSONParser",
+            timed(lambda: ORJSONParser().parse(BytesIO(body)), repeat),
+            points,
+        ),
+    ]
+
+
+@benchmark("route_formats")
+def route_formats_benchmark(repeat=20, points=5000, **kwargs):
+    """Size and encoding time of route_data in each format, from the stored
+    route JSON"""
+    import json
+
+    import orjson
+
+    from project.routedb.serializers import ROUTE_FORMATS
+    from project.utils.route_data import route_to_arrays
+
+    route_json = json.dumps(synthetic_route(points))
+    results = [f"json: {len(route_json) / 1e3:.0f}kB"]
+    for route_format, encode in ROUTE_FORMATS.items():
+        encoded = encode(route_to_arrays(orjson.loads(route_json)))
+        timings = timed(
+            lambda: encode(route_to_arrays(orjson.loads(route_json))), repeat
+        )
+        results.append(
+            f"{throughput(route_format, timings, points)}, "
+            f"{len(encoded) / 1e3:.0f}kB"
+        )
+    return results
+
+
+def latest_routes_page(n_routes=25):
+    """Unsaved routes with the fields of the latest routes list"""
+    from datetime import datetime, timezone
+
+    from django.contrib.auth.models import User
+
+    from project.utils.helper import random_key
+
+    athlete = User(username="benchmark", first_name="Bench", last_name="Mark")
+    return [
+        Route(
+            uid=random_key(),
+            athlete=athlete,
+            name=f"Route {i}",
+            start_time=datetime(2020, 1, 1, tzinfo=timezone.utc),
+            tz="Europe/Helsinki",
+            country="FI",
+            distance=5000,
+            duration=1800,
+        )
+        for i in range(n_routes)
+    ]
+
+
+def legacy_latest_route_list_serializer():
+    """LatestRouteListSerializer with its URLs reversed by row"""
+    from rest_framework import serializers
+
+    from project.routedb.serializers import LatestRouteListSerializer
+
+    class LegacyURLField(serializers.ReadOnlyField):
+        def to_representation(self, value):
+            request = self.context.get("request")
+            return request and request.build_absolute_uri(value) or ""
+
+    class LegacyLatestRouteListSerializer(LatestRouteListSerializer):
+        url = LegacyURLField(source="api_url")
+        map_url = LegacyURLField(source="image_url")
+        map_thumbnail_url = LegacyURLField(source="thumbnail_url")
+
+    return LegacyLatestRouteListSerializer
+
+
+@benchmark("route_list_serializers")
+def route_list_serializers_benchmark(repeat=20, points=5000, **kwargs):
+    """Serializing a page of the latest routes with the URLs reversed by row,
+    with URL templates, and with a sparse fieldset"""
+    from rest_framework.request import Request
+    from rest_framework.test import APIRequestFactory
+
+    from project.routedb.serializers import LatestRouteListSerializer
+
+    routes = latest_routes_page()
+    factory = APIRequestFactory()
+
+    def serialize(serializer_class, path="/api/v1/latest-routes/"):
+        request = Request(factory.get(path))
+        return lambda: serializer_class(
+            routes, many=True, context={"request": request}
+        ).data
+
+    def timed_page(serializer_class, path="/api/v1/latest-routes/"):
+        # A new request by run, the URL templates are built once per request
+        return [timed(serialize(serializer_class, path), 1)[0] for _ in range(repeat)]
+
+    return [
+        summarize(
+            "25 rows, reverse by row",
+            timed_page(legacy_latest_route_list_serializer()),
+        ),
+        summarize("25 rows, URL templates", timed_page(LatestRouteListSerializer)),
+        summarize(
+            "25 rows, ?fields=id,name,url",
+            timed_page(
+                LatestRouteListSerializer, "/api/v1/latest-routes/?fields=id,name,url"
+            ),
+        ),
+    ]
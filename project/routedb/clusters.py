@@ -0,0 +1,136 @@
+from collections import defaultdict
+
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, F, OuterRef
+
+from project.routedb.models import ClusteredMap, MapCluster, RasterMap, Route
+from project.utils.globalmaptiles import GlobalMercator
+
+CLUSTER_MAX_ZOOM = 18
+# Clusters returned for a map displayed at zoom z are the tiles of zoom z + 2,
+# ie: cells of 64x64 pixels on screen.
+CLUSTER_CELL_ZOOM_OFFSET = 2
+
+mercator = GlobalMercator()
+
+
+def cluster_tiles(lat, lon):
+    """(zoom, tile_x, tile_y) of the tiles containing the point at every level"""
+    for zoom in range(CLUSTER_MAX_ZOOM + 1):
+        tile = mercator.latlon_to_tile({"lat": lat, "lng": lon}, zoom)
+        yield zoom, tile["x"], tile["y"]
+
+
+def update_clusters(lat, lon, sign):
+    """Add (sign=1) or remove (sign=-1) a map centre from the clusters"""
+    for zoom, tile_x, tile_y in cluster_tiles(lat, lon):
+        tile = MapCluster.objects.filter(zoom=zoom, tile_x=tile_x, tile_y=tile_y)
+        updates = {
+            "count": F("count") + sign,
+            "sum_latitude": F("sum_latitude") + sign * lat,
+            "sum_longitude": F("sum_longitude") + sign * lon,
+        }
+        if sign < 0:
+            tile.filter(count__lte=1).delete()
+            tile.update(**updates)
+            continue
+        if tile.update(**updates):
+            continue
+        try:
+            with transaction.atomic():
+                MapCluster.objects.create(
+                    zoom=zoom,
+                    tile_x=tile_x,
+                    tile_y=tile_y,
+                    count=1,
+                    sum_latitude=lat,
+                    sum_longitude=lon,
+                )
+        except IntegrityError:
+            # Created concurrently
+            tile.update(**updates)
+
+
+def sync_map_clusters(raster_map_id):
+    """
+    Bring the clusters up to date with the current centre and visibility of
+    a map, a map is part of the clusters when it has at least one public route.
+    """
+    with transaction.atomic():
+        raster_map = (
+            RasterMap.objects.select_for_update()
+            .filter(pk=raster_map_id)
+            .only("_latitude", "_longitude")
+            .first()
+        )
+        if raster_map is None:
+            return
+        entry = ClusteredMap.objects.filter(raster_map_id=raster_map_id).first()
+        current = (entry.latitude, entry.longitude) if entry else None
+        target = None
+        if Route.objects.filter(raster_map_id=raster_map_id, is_private=False).exists():
+            target = (raster_map._latitude, raster_map._longitude)
+        if current == target:
+            return
+        if current:
+            update_clusters(*current, -1)
+        if target:
+            update_clusters(*target, 1)
+            ClusteredMap.objects.update_or_create(
+                raster_map_id=raster_map_id,
+                defaults={"latitude": target[0], "longitude": target[1]},
+            )
+        else:
+            entry.delete()
+
+
+def remove_map_from_clusters(raster_map_id):
+    with transaction.atomic():
+        RasterMap.objects.select_for_update().filter(pk=raster_map_id).exists()
+        entry = ClusteredMap.objects.filter(raster_map_id=raster_map_id).first()
+        if entry is None:
+            return
+        update_clusters(entry.latitude, entry.longitude, -1)
+        entry.delete()
+
+
+def rebuild_clusters(batch_size=1000):
+    """Recompute the whole MapCluster table, returns the number of maps counted"""
+    public_routes = Route.objects.filter(raster_map_id=OuterRef("pk"), is_private=False)
+    tiles = defaultdict(lambda: [0, 0.0, 0.0])
+    entries = []
+    with transaction.atomic():
+        # Lock the maps so that no signal updates the clusters meanwhile
+        list(RasterMap.objects.select_for_update().values_list("id", flat=True))
+        listed = (
+            RasterMap.objects.filter(Exists(public_routes))
+            .values_list("id", "_latitude", "_longitude")
+            .iterator(chunk_size=batch_size)
+        )
+        for raster_map_id, lat, lon in listed:
+            entries.append(
+                ClusteredMap(raster_map_id=raster_map_id, latitude=lat, longitude=lon)
+            )
+            for key in cluster_tiles(lat, lon):
+                tile = tiles[key]
+                tile[0] += 1
+                tile[1] += lat
+                tile[2] += lon
+        MapCluster.objects.all().delete()
+        ClusteredMap.objects.all().delete()
+        MapCluster.objects.bulk_create(
+            (
+                MapCluster(
+                    zoom=zoom,
+                    tile_x=tile_x,
+                    tile_y=tile_y,
+                    count=count,
+                    sum_latitude=sum_lat,
+                    sum_longitude=sum_lon,
+                )
+                for (zoom, tile_x, tile_y), (count, sum_lat, sum_lon) in tiles.items()
+            ),
+            batch_size=batch_size,
+        )
+        ClusteredMap.objects.bulk_create(entries, batch_size=batch_size)
+    return len(entries)
@@ -0,0 +1,186 @@
+import json
+from collections import defaultdict
+from functools import reduce
+from operator import or_
+
+from django.db import connections, transaction
+from django.db.models import Q
+from django.utils.timezone import now
+
+from project.routedb.models import HeatmapTile, Route
+from project.utils.heatmap import (
+    HEATMAP_MAX_ZOOM,
+    HEATMAP_MIN_ZOOM,
+    decode_grid,
+    empty_grid,
+    encode_grid,
+    route_tiles,
+)
+from project.utils.route_data import route_to_arrays
+
+HEATMAP_ZOOMS = range(HEATMAP_MIN_ZOOM, HEATMAP_MAX_ZOOM + 1)
+
+
+def route_contributions(route_json, zooms=HEATMAP_ZOOMS):
+    """{(zoom, tile_x, tile_y): pixels} crossed by a route"""
+    arrays = route_to_arrays(json.loads(route_json))
+    return {
+        (zoom, tile_x, tile_y): pixels
+        for zoom in zooms
+        for tile_x, tile_y, pixels in route_tiles(arrays.lats, arrays.lons, zoom)
+    }
+
+
+def apply_contributions(contributions, athlete_id, sign):
+    """
+    Add (sign=1) or subtract (sign=-1) the pixels of a route to the global
+    heatmap and to the heatmap of its athlete
+    """
+    if not contributions:
+        return
+    keys = sorted(contributions)
+    tiles_filter = reduce(
+        or_, (Q(zoom=zoom, tile_x=x, tile_y=y) for zoom, x, y in keys)
+    )
+    with transaction.atomic():
+        for scope in (None, athlete_id):
+            if sign > 0:
+                HeatmapTile.objects.bulk_create(
+                    [
+                        HeatmapTile(
+                            athlete_id=scope, zoom=zoom, tile_x=x, tile_y=y, data=b""
+                        )
+                        for zoom, x, y in keys
+                    ],
+                    ignore_conflicts=True,
+                )
+            # Locked in a consistent order so that concurrent updates of
+            # overlapping routes can not deadlock
+            tiles = (
+                HeatmapTile.objects.select_for_update()
+                .filter(tiles_filter, athlete_id=scope)
+                .order_by("zoom", "tile_x", "tile_y")
+            )
+            to_update = []
+            to_delete = []
+            for tile in tiles:
+                grid = decode_grid(tile.data).astype("i8")
+                grid[contributions[(tile.zoom, tile.tile_x, tile.tile_y)]] += sign
+                if grid.max() <= 0:
+                    to_delete.append(tile.pk)
+                    continue
+                tile.data = encode_grid(grid.clip(0))
+                tile.modification_date = now()
+                to_update.append(tile)
+            HeatmapTile.objects.bulk_update(to_update, ["data", "modification_date"])
+            HeatmapTile.objects.filter(pk__in=to_delete).delete()
+
+
+def heatmap_state(athlete_id, is_private, route_json):
+    """What a route contributes to the heatmaps, only public routes do"""
+    if is_private:
+        return None
+    return athlete_id, route_json
+
+
+def update_route_heatmaps(previous, current):
+    """Move the contribution of a route from its previous to its current state"""
+    if previous == current:
+        return
+    if previous:
+        athlete_id, route_json = previous
+        apply_contributions(route_contributions(route_json), athlete_id, -1)
+    if current:
+        athlete_id, route_json = current
+        apply_contributions(route_contributions(route_json), athlete_id, 1)
+
+
+def flush_grids(zoom, grids, modification_date, batch_size):
+    """
+    Add partial grids to the tiles of a zoom level being rebuilt, returns the
+    number of tiles created
+    """
+    if not grids:
+        return 0
+    tiles_filter = reduce(
+        or_, (Q(athlete_id=scope, tile_x=x, tile_y=y) for scope, x, y in grids)
+    )
+    to_update = []
+    for tile in HeatmapTile.objects.filter(tiles_filter, zoom=zoom):
+        grid = grids.pop((tile.athlete_id, tile.tile_x, tile.tile_y))
+        tile.data = encode_grid(decode_grid(tile.data) + grid)
+        tile.modification_date = modification_date
+        to_update.append(tile)
+    HeatmapTile.objects.bulk_update(
+        to_update, ["data", "modification_date"], batch_size=batch_size
+    )
+    created = HeatmapTile.objects.bulk_create(
+        (
+            HeatmapTile(
+                athlete_id=athlete_id,
+                zoom=zoom,
+                tile_x=x,
+                tile_y=y,
+                data=encode_grid(grid),
+                modification_date=modification_date,
+            )
+            for (athlete_id, x, y), grid in grids.items()
+        ),
+        batch_size=batch_size,
+    )
+    grids.clear()
+    return len(created)
+
+
+def rebuild_zoom(zoom, batch_size=100, max_grids=256):
+    """
+    Recompute all the heatmap tiles of a zoom level from the public routes,
+    returns the number of tiles. At most about max_grids uncompressed grids
+    (256kB each) are kept in memory, they are added to the tiles already
+    written when there are more.
+    """
+    grids = defaultdict(empty_grid)
+    routes = (
+        Route.objects.filter(is_private=False)
+        .values_list("athlete_id", "route_json")
+        .iterator(chunk_size=batch_size)
+    )
+    modification_date = now()
+    n_tiles = 0
+    with transaction.atomic():
+        HeatmapTile.objects.filter(zoom=zoom).delete()
+        for athlete_id, route_json in routes:
+            contributions = route_contributions(route_json, zooms=[zoom])
+            for (_, x, y), pixels in contributions.items():
+                grids[(None, x, y)][pixels] += 1
+                grids[(athlete_id, x, y)][pixels] += 1
+            if len(grids) >= max_grids:
+                n_tiles += flush_grids(zoom, grids, modification_date, batch_size)
+        n_tiles += flush_grids(zoom, grids, modification_date, batch_size)
+    return n_tiles
+
+
+def _rebuild_zoom_worker(zoom):
+    try:
+        return zoom, rebuild_zoom(zoom)
+    finally:
+        connections.close_all()
+
+
+def rebuild_heatmaps(processes=1, zooms=HEATMAP_ZOOMS):
+    """
+    Recompute the heatmaps, one zoom level per worker process.
+    Yields (zoom, number of tiles) as levels complete.
+    """
+    # Deepest levels have the most tiles, start them first
+    zooms = sorted(zooms, reverse=True)
+    if processes <= 1:
+        for zoom in zooms:
+            yield zoom, rebuild_zoom(zoom)
+        return
+    import multiprocessing
+
+    # Forked workers must not share the parent database connections
+    connections.close_all()
+    with multiprocessing.get_context("fork").Pool(processes) as pool:
+        yield from pool.imap_unordered(_rebuild_zoom_worker, zooms)
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from project.routedb.benchmarks import BENCHMARKS
+
+
+class Command(BaseCommand):
+    help = "Run micro benchmarks"
+
+    def add_arguments(self, parser):
+        parser.add_argument("names", nargs="*", help=", ".join(sorted(BENCHMARKS)))
+        parser.add_argument("--repeat", type=int, default=20)
+        parser.add_argument("--points", type=int, default=5000)
+
+    def handle(self, *args, **options):
+        names = options["names"] or sorted(BENCHMARKS)
+        for name in names:
+            if name not in BENCHMARKS:
+                raise CommandError(f"Unknown benchmark {name}")
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            for line in BENCHMARKS[name](
+                repeat=options["repeat"], points=options["points"]
+            ):
+                self.stdout.write(f"  {line}")
+        self.stdout.write(self.style.SUCCESS("Done"))
@@ -1,14 +1,34 @@
 from django.core.management.base import BaseCommand
 
 from project.routedb.models import RasterMap
+from project.utils.geo import geo_lookup
 
 
 class Command(BaseCommand):
     help = "fill auto generated field"
 
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def update_batch(self, maps):
+        centers = [m.get_center() for m in maps]
+        countries = geo_lookup.countries_at(
+            [c[0] for c in centers], [c[1] for c in centers]
+        )
+        for raster_map, center, country in zip(maps, centers, countries):
+            raster_map._latitude, raster_map._longitude = center
+            raster_map.country = country
+        RasterMap.objects.bulk_update(maps, ["_latitude", "_longitude", "country"])
+
     def handle(self, *args, **options):
-        qs = RasterMap.objects.all()
-        for r in qs:
-            r.prefetch_map_extras()
-            r.save()
+        batch_size = options["batch_size"]
+        qs = RasterMap.objects.all().only("id", "corners_coordinates")
+        batch = []
+        for r in qs.iterator(chunk_size=batch_size):
+            batch.append(r)
+            if len(batch) >= batch_size:
+                self.update_batch(batch)
+                batch = []
+        if batch:
+            self.update_batch(batch)
         self.stdout.write(self.style.SUCCESS("Done"))
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+
+from project.routedb.models import RasterMap, Route
+
+BBOX_FIELDS = ["north", "south", "east", "west"]
+
+
+class Command(BaseCommand):
+    help = "Fill the bounding boxes of routes and maps saved without them"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument(
+            "--all", action="store_true", default=False, help="Recompute all of them"
+        )
+
+    def fill(self, qs, batch_size):
+        model = qs.model
+        if not self.all:
+            qs = qs.filter(north__isnull=True)
+        batch = []
+        n = 0
+        for obj in qs.iterator(chunk_size=batch_size):
+            for key, value in obj.get_bounding_box().items():
+                setattr(obj, key, value)
+            batch.append(obj)
+            if len(batch) >= batch_size:
+                model.objects.bulk_update(batch, BBOX_FIELDS)
+                n += len(batch)
+                batch = []
+        model.objects.bulk_update(batch, BBOX_FIELDS)
+        return n + len(batch)
+
+    def handle(self, *args, **options):
+        self.all = options["all"]
+        batch_size = options["batch_size"]
+        n_maps = self.fill(
+            RasterMap.objects.only("id", "corners_coordinates"), batch_size
+        )
+        n_routes = self.fill(Route.objects.only("id", "route_json"), batch_size)
+        self.stdout.write(
+            self.style.SUCCESS(f"Updated {n_maps} maps and {n_routes} routes")
+        )
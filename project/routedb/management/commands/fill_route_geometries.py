@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from project.routedb.models import Route
+
+
+class Command(BaseCommand):
+    help = "Fill the simplified geometries of routes saved without them"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=100)
+        parser.add_argument(
+            "--all", action="store_true", default=False, help="Recompute all of them"
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        qs = Route.objects.only("id", "route_json")
+        if not options["all"]:
+            qs = qs.filter(geometries={})
+        batch = []
+        n = 0
+        for route in qs.iterator(chunk_size=batch_size):
+            route.geometries = route.get_geometries(route.get_arrays())
+            batch.append(route)
+            if len(batch) >= batch_size:
+                Route.objects.bulk_update(batch, ["geometries"])
+                n += len(batch)
+                batch = []
+        Route.objects.bulk_update(batch, ["geometries"])
+        self.stdout.write(self.style.SUCCESS(f"Updated {n + len(batch)} routes"))
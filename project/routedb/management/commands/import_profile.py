@@ -0,0 +1,87 @@
+import os
+import subprocess
+import sys
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+SETUP_SCRIPT = """
+import time
+t0 = time.perf_counter()
+import django
+django.setup()
+for module_name in {modules!r}:
+    __import__(module_name)
+print(time.perf_counter() - t0)
+"""
+
+
+class Command(BaseCommand):
+    help = "Print the import time breakdown of a cold django.setup()"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--import",
+            dest="modules",
+            action="append",
+            default=[],
+            help="Also import this module after django.setup()",
+        )
+        parser.add_argument("--limit", type=int, default=25)
+        parser.add_argument(
+            "--budget",
+            type=float,
+            default=None,
+            help="Fail if the cold setup takes longer than this many milliseconds",
+        )
+
+    def run_setup(self, modules, importtime=False):
+        cmd = [sys.executable]
+        if importtime:
+            cmd += ["-X", "importtime"]
+        cmd += ["-c", SETUP_SCRIPT.format(modules=modules)]
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=settings.SETTINGS_MODULE)
+        proc = subprocess.run(
+            cmd,
+            capture_output=True,
+            text=True,
+            env=env,
+            cwd=os.path.dirname(settings.BASE_DIR),
+        )
+        if proc.returncode != 0:
+            raise CommandError(proc.stderr)
+        return float(proc.stdout.strip().splitlines()[-1]), proc.stderr
+
+    def parse_importtime(self, output):
+        packages = defaultdict(int)
+        for line in output.splitlines():
+            if not line.startswith("import time:"):
+                continue
+            self_us, _, name = line[len("import time:") :].split("|")
+            if not self_us.strip().isdigit():
+                continue  # header line
+            packages[name.strip().split(".")[0]] += int(self_us)
+        return sorted(packages.items(), key=lambda x: -x[1])
+
+    def handle(self, *args, **options):
+        modules = options["modules"]
+        _, importtime_output = self.run_setup(modules, importtime=True)
+        packages = self.parse_importtime(importtime_output)
+        total_us = sum(us for _, us in packages)
+        self.stdout.write(f"{'package':<32} {'self':>10} {'share':>7}")
+        for name, us in packages[: options["limit"]]:
+            self.stdout.write(
+                f"{name:<32} {us / 1000:8.1f}ms {100 * us / total_us:6.1f}%"
+            )
+        self.stdout.write(f"{'total':<32} {total_us / 1000:8.1f}ms")
+
+        # Timing without -X importtime, whose bookkeeping inflates the numbers
+        setup_time, _ = self.run_setup(modules)
+        self.stdout.write(f"Cold django.setup() took {setup_time * 1000:.1f}ms")
+        budget = options["budget"]
+        if budget is not None and setup_time * 1000 > budget:
+            raise CommandError(
+                f"Cold django.setup() took {setup_time * 1000:.1f}ms, "
+                f"over the {budget:.0f}ms budget"
+            )
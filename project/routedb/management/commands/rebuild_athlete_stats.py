@@ -0,0 +1,30 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from project.routedb.stats import rebuild_athlete_stats
+
+
+class Command(BaseCommand):
+    help = "Recompute the route statistics of athletes"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "usernames",
+            nargs="*",
+            help="Only rebuild the statistics of these athletes",
+        )
+
+    def handle(self, *args, **options):
+        athletes = User.objects.filter(
+            Q(routes__isnull=False) | Q(stats__isnull=False)
+        ).distinct()
+        if options["usernames"]:
+            athletes = User.objects.filter(username__in=options["usernames"])
+        n_athletes = n_rows = 0
+        for athlete_id in athletes.values_list("id", flat=True).iterator():
+            n_rows += rebuild_athlete_stats(athlete_id)
+            n_athletes += 1
+        self.stdout.write(
+            self.style.SUCCESS(f"Rebuilt {n_rows} rows for {n_athletes} athletes")
+        )
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from project.utils.heatmap import HEATMAP_MAX_ZOOM, HEATMAP_MIN_ZOOM
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the global and per athlete heatmap tiles from the public "
+        "routes. Routes saved while a zoom level is rebuilt may be missed, run "
+        "it when the site is quiet."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--processes",
+            type=int,
+            default=1,
+            help="Number of zoom levels rebuilt in parallel",
+        )
+        parser.add_argument(
+            "--zoom",
+            type=int,
+            action="append",
+            dest="zooms",
+            help="Only rebuild this zoom level, can be repeated",
+        )
+
+    def handle(self, *args, **options):
+        from project.routedb.heatmaps import HEATMAP_ZOOMS, rebuild_heatmaps
+
+        zooms = options["zooms"] or HEATMAP_ZOOMS
+        invalid = [zoom for zoom in zooms if zoom not in HEATMAP_ZOOMS]
+        if invalid:
+            raise CommandError(
+                f"Zoom levels must be between {HEATMAP_MIN_ZOOM} and "
+                f"{HEATMAP_MAX_ZOOM}"
+            )
+        for zoom, n_tiles in rebuild_heatmaps(options["processes"], zooms):
+            self.stdout.write(f"Zoom {zoom}: {n_tiles} tiles")
+        self.stdout.write(self.style.SUCCESS("Heatmaps rebuilt"))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from project.routedb.clusters import rebuild_clusters
+
+
+class Command(BaseCommand):
+    help = "Recompute the clusters of public maps used by the explore view"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        n_maps = rebuild_clusters(batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"Clustered {n_maps} maps"))
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from project.routedb.models import Comment, Route, ThumbUp
+
+
+def count_of(model):
+    return Coalesce(
+        Subquery(
+            model.objects.filter(route_id=OuterRef("pk"))
+            .order_by()
+            .values("route_id")
+            .annotate(n=Count("id"))
+            .values("n")
+        ),
+        0,
+    )
+
+
+class Command(BaseCommand):
+    help = "Recompute the like and comment counters of routes"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=10000)
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        max_id = Route.objects.aggregate(max_id=Max("id"))["max_id"] or 0
+        updated = 0
+        for start in range(0, max_id + 1, batch_size):
+            updated += Route.objects.filter(
+                id__gte=start, id__lt=start + batch_size
+            ).update(
+                like_count=count_of(ThumbUp),
+                comment_count=count_of(Comment),
+            )
+        self.stdout.write(self.style.SUCCESS(f"Updated {updated} routes"))
@@ -0,0 +1,69 @@
+# Generated by Django 5.2.7 on 2026-10-19 18:30
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Min, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def remove_duplicate_thumbsup(apps, schema_editor):
+    ThumbUp = apps.get_model("routedb", "ThumbUp")
+    duplicates = (
+        ThumbUp.objects.order_by()
+        .values("route_id", "user_id")
+        .annotate(first_id=Min("id"), n=Count("id"))
+        .filter(n__gt=1)
+    )
+    for duplicate in duplicates:
+        ThumbUp.objects.filter(
+            route_id=duplicate["route_id"], user_id=duplicate["user_id"]
+        ).exclude(id=duplicate["first_id"]).delete()
+
+
+def fill_route_counters(apps, schema_editor):
+    Route = apps.get_model("routedb", "Route")
+    ThumbUp = apps.get_model("routedb", "ThumbUp")
+    Comment = apps.get_model("routedb", "Comment")
+
+    def count_of(model):
+        return Coalesce(
+            Subquery(
+                model.objects.filter(route_id=OuterRef("pk"))
+                .order_by()
+                .values("route_id")
+                .annotate(n=Count("id"))
+                .values("n")
+            ),
+            0,
+        )
+
+    Route.objects.update(like_count=count_of(ThumbUp), comment_count=count_of(Comment))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("routedb", "0027_alter_usersettings_avatar"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="route",
+            name="comment_count",
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="route",
+            name="like_count",
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(remove_duplicate_thumbsup, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="thumbup",
+            constraint=models.UniqueConstraint(
+                fields=("route", "user"), name="unique_thumbup_route_user"
+            ),
+        ),
+        migrations.RunPython(fill_route_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,85 @@
+# Generated by Django 5.2.7 on 2026-10-19 18:33
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def fill_recipients(apps, schema_editor):
+    Route = apps.get_model("routedb", "Route")
+    for model_name in ("ThumbUp", "Comment"):
+        model = apps.get_model("routedb", model_name)
+        model.objects.filter(recipient__isnull=True).update(
+            recipient_id=Subquery(
+                Route.objects.filter(pk=OuterRef("route_id")).values("athlete_id")
+            )
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("routedb", "0028_route_counters"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="comment",
+            name="recipient",
+            field=models.ForeignKey(
+                editable=False,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="comments_received",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+        migrations.AddField(
+            model_name="thumbup",
+            name="recipient",
+            field=models.ForeignKey(
+                editable=False,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="thumbsup_received",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+        migrations.RunPython(fill_recipients, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="comment",
+            name="recipient",
+            field=models.ForeignKey(
+                editable=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="comments_received",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="thumbup",
+            name="recipient",
+            field=models.ForeignKey(
+                editable=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="thumbsup_received",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="comment",
+            index=models.Index(
+                fields=["recipient", "-creation_date"],
+                name="routedb_com_recipie_2ee22f_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="thumbup",
+            index=models.Index(
+                fields=["recipient", "-creation_date"],
+                name="routedb_thu_recipie_e06fd8_idx",
+            ),
+        ),
+    ]
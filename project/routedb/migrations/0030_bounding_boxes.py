@@ -0,0 +1,72 @@
+# Generated by Django 5.2.7 on 2026-10-19 18:34
+
+import django.contrib.postgres.indexes
+from django.conf import settings
+from django.db import migrations, models
+
+import project.utils.spatial
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("routedb", "0029_notification_recipient"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="rastermap",
+            name="east",
+            field=models.FloatField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="rastermap",
+            name="north",
+            field=models.FloatField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="rastermap",
+            name="south",
+            field=models.FloatField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="rastermap",
+            name="west",
+            field=models.FloatField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="route",
+            name="east",
+            field=models.FloatField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="route",
+            name="north",
+            field=models.FloatField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="route",
+            name="south",
+            field=models.FloatField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="route",
+            name="west",
+            field=models.FloatField(editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="rastermap",
+            index=django.contrib.postgres.indexes.GistIndex(
+                project.utils.spatial.BoundingBox("west", "south", "east", "north"),
+                name="routedb_rastermap_bbox_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="route",
+            index=django.contrib.postgres.indexes.GistIndex(
+                project.utils.spatial.BoundingBox("west", "south", "east", "north"),
+                name="routedb_route_bbox_idx",
+            ),
+        ),
+    ]
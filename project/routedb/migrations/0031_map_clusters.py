@@ -0,0 +1,61 @@
+# Generated by Django 5.2.7 on 2026-10-19 18:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("routedb", "0030_bounding_boxes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ClusteredMap",
+            fields=[
+                (
+                    "raster_map",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="cluster_entry",
+                        serialize=False,
+                        to="routedb.rastermap",
+                    ),
+                ),
+                ("latitude", models.FloatField()),
+                ("longitude", models.FloatField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name="MapCluster",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("zoom", models.PositiveSmallIntegerField()),
+                ("tile_x", models.IntegerField()),
+                ("tile_y", models.IntegerField()),
+                ("count", models.PositiveIntegerField(default=0)),
+                ("sum_latitude", models.FloatField(default=0)),
+                ("sum_longitude", models.FloatField(default=0)),
+            ],
+            options={
+                "verbose_name": "map cluster",
+                "verbose_name_plural": "map clusters",
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("zoom", "tile_x", "tile_y"),
+                        name="unique_mapcluster_tile",
+                    )
+                ],
+            },
+        ),
+    ]
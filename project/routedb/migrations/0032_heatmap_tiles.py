@@ -0,0 +1,60 @@
+# Generated by Django 5.2.7 on 2026-10-19 18:44
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("routedb", "0031_map_clusters"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="HeatmapTile",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("zoom", models.PositiveSmallIntegerField()),
+                ("tile_x", models.IntegerField()),
+                ("tile_y", models.IntegerField()),
+                ("data", models.BinaryField()),
+                ("modification_date", models.DateTimeField(auto_now=True)),
+                (
+                    "athlete",
+                    models.ForeignKey(
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="heatmap_tiles",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "heatmap tile",
+                "verbose_name_plural": "heatmap tiles",
+                "constraints": [
+                    models.UniqueConstraint(
+                        condition=models.Q(("athlete__isnull", True)),
+                        fields=("zoom", "tile_x", "tile_y"),
+                        name="unique_global_heatmaptile",
+                    ),
+                    models.UniqueConstraint(
+                        condition=models.Q(("athlete__isnull", False)),
+                        fields=("athlete", "zoom", "tile_x", "tile_y"),
+                        name="unique_athlete_heatmaptile",
+                    ),
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 5.2.7 on 2026-10-19 18:47
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.conf import settings
+from django.contrib.postgres.operations import TrigramExtension
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+from django.db.models import OuterRef, Subquery, Value
+from django.db.models.functions import Concat
+
+
+def fill_search_vectors(apps, schema_editor):
+    Route = apps.get_model("routedb", "Route")
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split("."))
+    athlete_name = Subquery(
+        User.objects.filter(pk=OuterRef("athlete_id"))
+        .annotate(
+            full_name=Concat(
+                "first_name", Value(" "), "last_name", Value(" "), "username"
+            )
+        )
+        .values("full_name")[:1]
+    )
+    Route.objects.update(
+        search_vector=SearchVector("name", weight="A", config="simple")
+        + SearchVector(athlete_name, weight="B", config="simple")
+        + SearchVector("comment", weight="C", config="simple")
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("routedb", "0032_heatmap_tiles"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name="route",
+            name="search_vector",
+            field=django.contrib.postgres.search.SearchVectorField(
+                editable=False, null=True
+            ),
+        ),
+        migrations.RunPython(fill_search_vectors, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="route",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["search_vector"], name="routedb_route_search_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="route",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["name"],
+                name="routedb_route_name_trgm_idx",
+                opclasses=["gin_trgm_ops"],
+            ),
+        ),
+    ]
@@ -0,0 +1,77 @@
+# Generated by Django 5.2.7 on 2026-10-19 18:49
+
+import django.contrib.postgres.fields
+import django.contrib.postgres.indexes
+from django.conf import settings
+from django.db import migrations, models
+
+BATCH_SIZE = 1000
+
+
+# Read with SQL since the tagging app is no longer installed, its tables are
+# kept until a later release drops them, with an irreversible migration
+TAGGING_SQL = """
+SELECT item.object_id, tag.name
+FROM tagging_taggeditem item
+JOIN tagging_tag tag ON tag.id = item.tag_id
+JOIN django_content_type content_type ON content_type.id = item.content_type_id
+WHERE content_type.app_label = 'routedb' AND content_type.model = 'route'
+ORDER BY item.object_id
+"""
+
+
+def copy_tagging_data(apps, schema_editor):
+    connection = schema_editor.connection
+    if "tagging_taggeditem" not in connection.introspection.table_names():
+        return
+    Route = apps.get_model("routedb", "Route")
+    routes = {}
+
+    def flush():
+        Route.objects.bulk_update(
+            [
+                Route(id=route_id, hashtags=sorted(tags))
+                for route_id, tags in routes.items()
+            ],
+            ["hashtags"],
+        )
+        routes.clear()
+
+    with connection.cursor() as cursor:
+        cursor.execute(TAGGING_SQL)
+        while items := cursor.fetchmany(BATCH_SIZE):
+            for route_id, tag in items:
+                if route_id not in routes and len(routes) >= BATCH_SIZE:
+                    flush()
+                routes.setdefault(route_id, set()).add(tag.lower()[:30])
+    flush()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("routedb", "0033_route_search"),
+        ("contenttypes", "0002_remove_content_type_name"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="route",
+            name="hashtags",
+            field=django.contrib.postgres.fields.ArrayField(
+                base_field=models.CharField(max_length=30),
+                blank=True,
+                default=list,
+                editable=False,
+                size=None,
+            ),
+        ),
+        migrations.RunPython(copy_tagging_data, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="route",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["hashtags"], name="routedb_route_hashtags_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 5.2.7 on 2026-10-19 18:53
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("routedb", "0034_route_hashtags"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="AthleteStat",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "period",
+                    models.CharField(
+                        choices=[
+                            ("day", "day"),
+                            ("week", "week"),
+                            ("month", "month"),
+                            ("year", "year"),
+                        ],
+                        max_length=5,
+                    ),
+                ),
+                ("period_start", models.DateField()),
+                ("is_private", models.BooleanField(default=False)),
+                ("route_count", models.PositiveIntegerField(default=0)),
+                ("distance", models.BigIntegerField(default=0)),
+                ("duration", models.BigIntegerField(default=0)),
+                (
+                    "athlete",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="stats",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "athlete stat",
+                "verbose_name_plural": "athlete stats",
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("athlete", "period", "period_start", "is_private"),
+                        name="unique_athletestat_period",
+                    )
+                ],
+            },
+        ),
+    ]
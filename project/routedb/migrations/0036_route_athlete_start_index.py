@@ -0,0 +1,21 @@
+# Generated by Django 5.2.7 on 2026-10-19 18:56
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("routedb", "0035_athlete_stats"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="route",
+            index=models.Index(
+                fields=["athlete", "start_time"], name="routedb_route_athlete_time_idx"
+            ),
+        ),
+    ]
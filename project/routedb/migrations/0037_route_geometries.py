@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-19 19:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("routedb", "0036_route_athlete_start_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="route",
+            name="geometries",
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
@@ -0,0 +1,97 @@
+# Generated by Django 5.2.7 on 2026-10-19 19:01
+
+import django.contrib.postgres.fields
+import django.db.models.deletion
+from django.db import migrations, models
+
+import project.utils.validators
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("routedb", "0037_route_geometries"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RouteSplits",
+            fields=[
+                (
+                    "route",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="splits",
+                        serialize=False,
+                        to="routedb.route",
+                    ),
+                ),
+                (
+                    "passages",
+                    django.contrib.postgres.fields.ArrayField(
+                        base_field=models.FloatField(null=True), size=None
+                    ),
+                ),
+                (
+                    "raster_map",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="route_splits",
+                        to="routedb.rastermap",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "route splits",
+                "verbose_name_plural": "route splits",
+            },
+        ),
+        migrations.CreateModel(
+            name="MapControl",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("order", models.PositiveSmallIntegerField()),
+                ("code", models.CharField(blank=True, max_length=8)),
+                (
+                    "latitude",
+                    models.FloatField(
+                        validators=[project.utils.validators.validate_latitude]
+                    ),
+                ),
+                (
+                    "longitude",
+                    models.FloatField(
+                        validators=[project.utils.validators.validate_longitude]
+                    ),
+                ),
+                ("radius", models.PositiveSmallIntegerField(default=30)),
+                (
+                    "raster_map",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="controls",
+                        to="routedb.rastermap",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "map control",
+                "verbose_name_plural": "map controls",
+                "ordering": ["raster_map", "order"],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("raster_map", "order"), name="unique_mapcontrol_order"
+                    )
+                ],
+            },
+        ),
+    ]
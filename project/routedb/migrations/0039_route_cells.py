@@ -0,0 +1,34 @@
+# Generated by Django 5.2.7 on 2026-10-19 19:03
+
+import django.contrib.postgres.fields
+import django.contrib.postgres.indexes
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("routedb", "0038_route_splits"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="route",
+            name="cells",
+            field=django.contrib.postgres.fields.ArrayField(
+                base_field=models.BigIntegerField(),
+                blank=True,
+                default=list,
+                editable=False,
+                size=None,
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="route",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["cells"], name="routedb_route_cells_idx"
+            ),
+        ),
+    ]
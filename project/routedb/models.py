@@ -9,18 +9,16 @@ import tempfile
 from datetime import datetime, timezone
 from io import BytesIO
 
-import arrow
-import gpxpy
 from django.conf import settings
 from django.contrib.auth.models import User
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex, GistIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.core.cache import cache
 from django.core.files.base import ContentFile, File
 from django.db import models
 from django.urls import reverse
 from django.utils.timezone import now
-from django_s3_storage.storage import S3Storage
-from PIL import Image
-from tagging.registry import register as register_tagged_model
 
 from project.utils.helper import (
     country_at_coords,
@@ -28,13 +26,15 @@ from project.utils.helper import (
     time_base64,
     tz_at_coords,
 )
+from project.utils.spatial import BoundingBox
+from project.utils.storages import LazyS3Storage
 from project.utils.validators import (
     validate_corners_coordinates,
     validate_latitude,
     validate_longitude,
 )
 
-map_storage = S3Storage(aws_s3_bucket_name=settings.AWS_S3_BUCKET)
+map_storage = LazyS3Storage(aws_s3_bucket_name=settings.AWS_S3_BUCKET)
 
 
 def map_upload_path(instance=None, file_name=None):
@@ -131,10 +131,16 @@ class RasterMap(models.Model):
     country = models.CharField(max_length=2, editable=False)
     _latitude = models.FloatField(validators=[validate_latitude], editable=False)
     _longitude = models.FloatField(validators=[validate_longitude], editable=False)
+    north = models.FloatField(null=True, editable=False)
+    south = models.FloatField(null=True, editable=False)
+    east = models.FloatField(null=True, editable=False)
+    west = models.FloatField(null=True, editable=False)
 
     def prefetch_map_extras(self, *args, **kwargs):
         self._latitude, self._longitude = self.get_center()
         self.country = self.get_country()
+        for key, value in self.get_bounding_box().items():
+            setattr(self, key, value)
 
     @property
     def path(self):
@@ -173,6 +179,8 @@ class RasterMap(models.Model):
             raise ValueError("Not a base 64 encoded data URI of an image")
 
     def strip_exif(self):
+        from PIL import Image
+
         if self.image.closed:
             self.image.open()
         with Image.open(self.image.file) as image:
@@ -190,6 +198,8 @@ class RasterMap(models.Model):
         self.image.close()
 
     def rotate(self, ninety_multiplier=1):
+        from PIL import Image
+
         ninety_multiplier = ninety_multiplier % 4
         cc = self.corners_coordinates.split(",")
         self.corners_coordinates = ",".join(
@@ -254,11 +264,24 @@ class RasterMap(models.Model):
         lons = cal_values[1::2]
         return [sum(lats) / 4, sum(lons) / 4]
 
+    def get_bounding_box(self):
+        cal_values = [float(x) for x in self.corners_coordinates.split(",")]
+        lats = cal_values[::2]
+        lons = cal_values[1::2]
+        return {
+            "north": max(lats),
+            "south": min(lats),
+            "east": max(lons),
+            "west": min(lons),
+        }
+
     def get_country(self):
         return country_at_coords(*self.center)
 
     @property
     def thumbnail(self):
+        from PIL import Image
+
         cache_key = f"map_{self.image.name}_thumb"
         cached_thumb = cache.get(cache_key)
         if cached_thumb:
@@ -296,6 +319,8 @@ class RasterMap(models.Model):
 
     @property
     def og_thumbnail(self):
+        from PIL import Image
+
         cache_key = f"map_{self.image.name}_og_thumb"
         cached_thumb = cache.get(cache_key)
         if cached_thumb:
@@ -346,6 +371,17 @@ class RasterMap(models.Model):
         ordering = ["-creation_date"]
         verbose_name = "raster map"
         verbose_name_plural = "raster maps"
+        indexes = [
+            GistIndex(
+                BoundingBox("west", "south", "east", "north"),
+                name="routedb_rastermap_bbox_idx",
+            ),
+        ]
+
+
+# Only changed with UPDATE ... SET field = field + 1, see
+# project.routedb.signals.increment_route_counter
+ROUTE_COUNTER_FIELDS = ("like_count", "comment_count")
 
 
 class Route(models.Model):
@@ -370,18 +406,60 @@ class Route(models.Model):
     distance = models.IntegerField()
     duration = models.IntegerField(blank=True, null=True)
     comment = models.TextField(blank=True)
-
-    def prefetch_route_extras(self, *args, **kwargs):
-        if self.route[0]["time"]:
-            self.start_time = datetime.fromtimestamp(
-                self.route[0]["time"], timezone.utc
-            )
-            self.duration = self.get_duration()
+    like_count = models.IntegerField(default=0, editable=False)
+    comment_count = models.IntegerField(default=0, editable=False)
+    north = models.FloatField(null=True, editable=False)
+    south = models.FloatField(null=True, editable=False)
+    east = models.FloatField(null=True, editable=False)
+    west = models.FloatField(null=True, editable=False)
+    # Lowercase hashtags of the comment
+    hashtags = ArrayField(
+        models.CharField(max_length=30), default=list, blank=True, editable=False
+    )
+    # Encoded polylines of the simplified route by level of detail, see
+    # project.utils.route_data.DETAIL_TOLERANCES
+    geometries = models.JSONField(default=dict, blank=True, editable=False)
+    # Web mercator tiles crossed by the route, see project.routedb.similarity
+    cells = ArrayField(
+        models.BigIntegerField(), default=list, blank=True, editable=False
+    )
+    # Name, athlete name and comment, see project.routedb.search
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    def save(self, *args, **kwargs):
+        # A full save would write back the counters loaded with the instance,
+        # losing the increments made since then
+        if not self._state.adding and kwargs.get("update_fields") is None:
+            deferred = self.get_deferred_fields()
+            kwargs["update_fields"] = [
+                field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in ROUTE_COUNTER_FIELDS
+                and field.attname not in deferred
+            ]
+        super().save(*args, **kwargs)
+
+    def prefetch_route_extras(self, arrays=None):
+        """
+        Compute the fields derived from the track, from its RouteArrays when
+        given instead of parsing route_json again
+        """
+        if arrays is None:
+            arrays = self.get_arrays()
+        for key, value in self.get_bounding_box(arrays).items():
+            setattr(self, key, value)
+        start = arrays.times[0].item()
+        if start and not math.isnan(start):
+            self.start_time = datetime.fromtimestamp(start, timezone.utc)
+            self.duration = self.get_duration(arrays)
         elif self.start_time is None:
             self.start_time = now()
-        self.country = self.get_country()
-        self.tz = self.get_tz() or "UTC"
-        self.distance = self.get_distance()
+        self.country = self.get_country(arrays)
+        self.tz = self.get_tz(arrays) or "UTC"
+        self.distance = self.get_distance(arrays)
+        self.geometries = self.get_geometries(arrays)
+        self.cells = self.get_cells(arrays)
 
     @property
     def route(self):
@@ -439,37 +517,43 @@ class Route(models.Model):
     def api_url(self):
         return reverse("route_detail", kwargs={"uid": self.uid})
 
-    def get_tz(self):
-        return tz_at_coords(
-            self.route[0]["latlon"][0],
-            self.route[0]["latlon"][1],
-        )
+    def get_arrays(self):
+        from project.utils.route_data import route_to_arrays
 
-    def get_country(self):
-        return country_at_coords(
-            self.route[0]["latlon"][0],
-            self.route[0]["latlon"][1],
-        )
+        return route_to_arrays(self.route)
 
-    def get_duration(self):
-        return self.route[-1]["time"] - self.route[0]["time"]
-
-    def get_distance(self):
-        d = 0
-        prev_p = self.route[0]
-        c = math.pi / 180
-        for p in self.route[1:]:
-            dlat = p["latlon"][0] - prev_p["latlon"][0]
-            dlon = p["latlon"][1] - prev_p["latlon"][1]
-            a = (
-                math.sin(c * dlat / 2) ** 2
-                + math.cos(c * p["latlon"][0])
-                * math.cos(c * prev_p["latlon"][0])
-                * math.sin(c * dlon / 2) ** 2
-            )
-            d += 12756274 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-            prev_p = p
-        return d
+    def get_tz(self, arrays):
+        return tz_at_coords(arrays.lats[0].item(), arrays.lons[0].item())
+
+    def get_country(self, arrays):
+        return country_at_coords(arrays.lats[0].item(), arrays.lons[0].item())
+
+    def get_duration(self, arrays):
+        from project.utils.route_data import route_duration
+
+        return route_duration(arrays)
+
+    def get_bounding_box(self, arrays=None):
+        from project.utils.route_data import arrays_bounds
+
+        if arrays is None:
+            arrays = self.get_arrays()
+        return arrays_bounds(arrays)
+
+    def get_geometries(self, arrays):
+        from project.utils.route_data import route_geometries
+
+        return route_geometries(arrays)
+
+    def get_cells(self, arrays):
+        from project.utils.route_data import route_cells
+
+        return route_cells(arrays).tolist()
+
+    def get_distance(self, arrays):
+        from project.utils.route_data import route_distance
+
+        return route_distance(arrays)
 
     @property
     def athlete_fullname(self):
@@ -488,23 +572,9 @@ class Route(models.Model):
 
     @property
     def gpx(self):
-        gpx = gpxpy.gpx.GPX()
-        gpx.creator = "Mapdump.com"
-        gpx_track = gpxpy.gpx.GPXTrack()
-        gpx.tracks.append(gpx_track)
-
-        gpx_segment = gpxpy.gpx.GPXTrackSegment()
-        locs = self.route
-        for location in locs:
-            pt = gpxpy.gpx.GPXTrackPoint(
-                location["latlon"][0],
-                location["latlon"][1],
-            )
-            if location["time"]:
-                pt.time = arrow.get(location["time"]).datetime
-            gpx_segment.points.append(pt)
-        gpx_track.segments.append(gpx_segment)
-        return gpx.to_xml()
+        from project.utils.gpx import gpx_chunks
+
+        return "".join(gpx_chunks(self.route))
 
     @property
     def gpx_url(self):
@@ -526,23 +596,56 @@ class Route(models.Model):
         verbose_name_plural = "routes"
         indexes = [
             models.Index(fields=["-start_time"]),
+            models.Index(
+                fields=["athlete", "start_time"],
+                name="routedb_route_athlete_time_idx",
+            ),
+            GistIndex(
+                BoundingBox("west", "south", "east", "north"),
+                name="routedb_route_bbox_idx",
+            ),
+            GinIndex(fields=["search_vector"], name="routedb_route_search_idx"),
+            GinIndex(fields=["hashtags"], name="routedb_route_hashtags_idx"),
+            GinIndex(fields=["cells"], name="routedb_route_cells_idx"),
+            GinIndex(
+                fields=["name"],
+                opclasses=["gin_trgm_ops"],
+                name="routedb_route_name_trgm_idx",
+            ),
         ]
 
 
-register_tagged_model(Route)
-
-
 class ThumbUp(models.Model):
     creation_date = models.DateTimeField(auto_now_add=True)
     route = models.ForeignKey(Route, on_delete=models.CASCADE, related_name="thumbsup")
     user = models.ForeignKey(
         User, on_delete=models.CASCADE, related_name="thumbsup_given"
     )
+    # Athlete of the route, denormalized for the notifications feed
+    recipient = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name="thumbsup_received",
+        editable=False,
+    )
+
+    def save(self, *args, **kwargs):
+        if self.recipient_id is None:
+            self.recipient_id = self.route.athlete_id
+        super().save(*args, **kwargs)
 
     class Meta:
         ordering = ["-creation_date"]
         verbose_name = "thumb up"
         verbose_name_plural = "thumbs up"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["route", "user"], name="unique_thumbup_route_user"
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["recipient", "-creation_date"]),
+        ]
 
 
 class Comment(models.Model):
@@ -551,11 +654,187 @@ class Comment(models.Model):
     user = models.ForeignKey(
         User, on_delete=models.CASCADE, related_name="comments_given"
     )
+    # Athlete of the route, denormalized for the notifications feed
+    recipient = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name="comments_received",
+        editable=False,
+    )
     message = models.TextField(
         max_length=1024,
     )
 
+    def save(self, *args, **kwargs):
+        if self.recipient_id is None:
+            self.recipient_id = self.route.athlete_id
+        super().save(*args, **kwargs)
+
     class Meta:
         ordering = ["-creation_date"]
         verbose_name = "comment"
         verbose_name_plural = "comments"
+        indexes = [
+            models.Index(fields=["recipient", "-creation_date"]),
+        ]
+
+
+class ClusteredMap(models.Model):
+    """Centre at which a map with a public route is counted in the clusters"""
+
+    raster_map = models.OneToOneField(
+        RasterMap,
+        primary_key=True,
+        on_delete=models.CASCADE,
+        related_name="cluster_entry",
+    )
+    latitude = models.FloatField()
+    longitude = models.FloatField()
+
+
+class MapCluster(models.Model):
+    """Number of public maps whose centre falls in an XYZ tile"""
+
+    zoom = models.PositiveSmallIntegerField()
+    tile_x = models.IntegerField()
+    tile_y = models.IntegerField()
+    count = models.PositiveIntegerField(default=0)
+    sum_latitude = models.FloatField(default=0)
+    sum_longitude = models.FloatField(default=0)
+
+    @property
+    def latitude(self):
+        return self.sum_latitude / self.count
+
+    @property
+    def longitude(self):
+        return self.sum_longitude / self.count
+
+    def __str__(self):
+        return f"cluster <{self.zoom}/{self.tile_x}/{self.tile_y}>"
+
+    class Meta:
+        verbose_name = "map cluster"
+        verbose_name_plural = "map clusters"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["zoom", "tile_x", "tile_y"], name="unique_mapcluster_tile"
+            ),
+        ]
+
+
+class HeatmapTile(models.Model):
+    """
+    Number of public routes crossing each pixel of an XYZ tile, for all the
+    athletes when athlete is null or for a single one otherwise
+    """
+
+    athlete = models.ForeignKey(
+        User,
+        null=True,
+        on_delete=models.CASCADE,
+        related_name="heatmap_tiles",
+    )
+    zoom = models.PositiveSmallIntegerField()
+    tile_x = models.IntegerField()
+    tile_y = models.IntegerField()
+    # zlib compressed little endian uint32 grid, see project.utils.heatmap
+    data = models.BinaryField()
+    modification_date = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"heatmap tile <{self.zoom}/{self.tile_x}/{self.tile_y}>"
+
+    class Meta:
+        verbose_name = "heatmap tile"
+        verbose_name_plural = "heatmap tiles"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["zoom", "tile_x", "tile_y"],
+                condition=models.Q(athlete__isnull=True),
+                name="unique_global_heatmaptile",
+            ),
+            models.UniqueConstraint(
+                fields=["athlete", "zoom", "tile_x", "tile_y"],
+                condition=models.Q(athlete__isnull=False),
+                name="unique_athlete_heatmaptile",
+            ),
+        ]
+
+
+class AthleteStat(models.Model):
+    """Totals of the routes of an athlete started in a calendar period"""
+
+    PERIODS = ["day", "week", "month", "year"]
+
+    athlete = models.ForeignKey(User, on_delete=models.CASCADE, related_name="stats")
+    period = models.CharField(
+        max_length=5, choices=[(period, period) for period in PERIODS]
+    )
+    # In the local time of the routes, weeks start on Mondays
+    period_start = models.DateField()
+    is_private = models.BooleanField(default=False)
+    route_count = models.PositiveIntegerField(default=0)
+    distance = models.BigIntegerField(default=0)
+    duration = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"stats <{self.athlete_id} {self.period} {self.period_start}>"
+
+    class Meta:
+        verbose_name = "athlete stat"
+        verbose_name_plural = "athlete stats"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["athlete", "period", "period_start", "is_private"],
+                name="unique_athletestat_period",
+            ),
+        ]
+
+
+class MapControl(models.Model):
+    """Control of the orienteering course printed on a map"""
+
+    raster_map = models.ForeignKey(
+        RasterMap, on_delete=models.CASCADE, related_name="controls"
+    )
+    # 0 is the start, the last control the finish
+    order = models.PositiveSmallIntegerField()
+    code = models.CharField(max_length=8, blank=True)
+    latitude = models.FloatField(validators=[validate_latitude])
+    longitude = models.FloatField(validators=[validate_longitude])
+    # Distance in meters within which a route passes the control
+    radius = models.PositiveSmallIntegerField(default=30)
+
+    def __str__(self):
+        return f"control <{self.raster_map_id} {self.order}>"
+
+    class Meta:
+        ordering = ["raster_map", "order"]
+        verbose_name = "map control"
+        verbose_name_plural = "map controls"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["raster_map", "order"], name="unique_mapcontrol_order"
+            ),
+        ]
+
+
+class RouteSplits(models.Model):
+    """Times at which a route passed the controls of its map"""
+
+    route = models.OneToOneField(
+        Route, on_delete=models.CASCADE, primary_key=True, related_name="splits"
+    )
+    raster_map = models.ForeignKey(
+        RasterMap, on_delete=models.CASCADE, related_name="route_splits"
+    )
+    # Timestamps in the order of the controls, null for the missed ones
+    passages = ArrayField(models.FloatField(null=True))
+
+    def __str__(self):
+        return f"splits <{self.route_id}>"
+
+    class Meta:
+        verbose_name = "route splits"
+        verbose_name_plural = "route splits"
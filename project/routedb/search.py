@@ -0,0 +1,69 @@
+import re
+
+from django.contrib.auth.models import User
+from django.contrib.postgres.search import (
+    SearchQuery,
+    SearchRank,
+    SearchVector,
+    TrigramWordSimilarity,
+)
+from django.db.models import F, OuterRef, Subquery, Value
+from django.db.models.functions import Concat
+
+# Routes are named in many languages, no stemming nor stop words
+SEARCH_CONFIG = "simple"
+SEARCH_MAX_TERMS = 8
+SEARCH_TERM_RE = re.compile(r"\w+")
+
+
+def athlete_name():
+    return Subquery(
+        User.objects.filter(pk=OuterRef("athlete_id"))
+        .annotate(
+            full_name=Concat(
+                "first_name", Value(" "), "last_name", Value(" "), "username"
+            )
+        )
+        .values("full_name")[:1]
+    )
+
+
+def route_search_vector():
+    return (
+        SearchVector("name", weight="A", config=SEARCH_CONFIG)
+        + SearchVector(athlete_name(), weight="B", config=SEARCH_CONFIG)
+        + SearchVector("comment", weight="C", config=SEARCH_CONFIG)
+    )
+
+
+def update_search_vectors(routes):
+    return routes.update(search_vector=route_search_vector())
+
+
+def prefix_search_query(text):
+    """Match routes containing words starting with each of the terms"""
+    terms = SEARCH_TERM_RE.findall(text.lower())[:SEARCH_MAX_TERMS]
+    if not terms:
+        return None
+    return SearchQuery(
+        " & ".join(f"{term}:*" for term in terms),
+        search_type="raw",
+        config=SEARCH_CONFIG,
+    )
+
+
+def search_routes(routes, text):
+    """
+    Filter the routes matching the text, annotated with a rank.
+    Falls back to a fuzzy match of the route name when no full text match.
+    """
+    query = prefix_search_query(text)
+    if query is not None:
+        matches = routes.filter(search_vector=query).annotate(
+            rank=SearchRank(F("search_vector"), query)
+        )
+        if matches.exists():
+            return matches
+    return routes.filter(name__trigram_word_similar=text).annotate(
+        rank=TrigramWordSimilarity(text, "name")
+    )
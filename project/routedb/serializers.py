@@ -2,17 +2,40 @@ import base64
 import re
 from io import BytesIO
 
+import orjson
 from allauth.account.models import EmailAddress
 from django.contrib.auth import authenticate
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import transaction
 from django.db.models import Q
+from django.urls import reverse
+from django.utils.http import parse_header_parameters
 from django.utils.safestring import mark_safe
 from django.utils.translation import gettext_lazy as _
-from PIL import Image
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
-
-from project.routedb.models import Comment, RasterMap, Route, ThumbUp, UserSettings
+from rest_framework.permissions import SAFE_METHODS
+
+from project.routedb.models import (
+    Comment,
+    MapCluster,
+    MapControl,
+    RasterMap,
+    Route,
+    ThumbUp,
+    UserSettings,
+)
+from project.utils.route_data import (
+    DETAIL_TOLERANCES,
+    encode_geolocation_series,
+    encode_route_columns,
+    route_data_to_arrays,
+    route_json_from_arrays,
+    route_to_arrays,
+    validate_route_arrays,
+)
+from project.utils.route_files import parse_route_file
 from project.utils.validators import (
     custom_username_validators,
     validate_latitude,
@@ -22,6 +45,41 @@ from project.utils.validators import (
 HASHTAG_REGEX = re.compile(r"(^|\B)#(?![0-9_]+\b)([a-zA-Z0-9_]{1,30})(\b|\r)")
 
 
+def parse_hashtags(text):
+    """Sorted lowercase hashtags found in the text, without duplicates"""
+    return sorted(
+        {match.group(2).lower() for match in re.finditer(HASHTAG_REGEX, text)}
+    )
+
+
+def validate_route_data(value):
+    """RouteArrays of the route data posted by the clients"""
+    try:
+        return route_data_to_arrays(value)
+    except ValueError as e:
+        raise ValidationError(str(e))
+
+
+class RouteGeometryMixin:
+    """
+    Add the geometry of the route simplified at the level of detail given by
+    ?detail=, as an encoded polyline
+    """
+
+    def get_fields(self):
+        fields = super().get_fields()
+        request = self.context.get("request")
+        detail = request.GET.get("detail") if request else None
+        if not detail:
+            return fields
+        if detail not in DETAIL_TOLERANCES:
+            raise ValidationError(
+                {"detail": f"Expecting one of {', '.join(DETAIL_TOLERANCES)}"}
+            )
+        fields["geometry"] = serializers.ReadOnlyField(source=f"geometries.{detail}")
+        return fields
+
+
 class AuthTokenSerializer(serializers.Serializer):
     username = serializers.CharField(label=_("Username or Email"), write_only=True)
     password = serializers.CharField(
@@ -75,15 +133,132 @@ class AuthTokenSerializer(serializers.Serializer):
         return attrs
 
 
-class RelativeURLField(serializers.ReadOnlyField):
+class RouteDataField(serializers.JSONField):
+    """
+    Points of a route, written as a list of {"time": ..., "latlon": [lat, lon]}
+    and read as the stored route_json, passed to the renderer without being
+    decoded, see project.utils.renderers.ORJSONRenderer
+    """
+
+    def get_attribute(self, instance):
+        return instance.route_json
+
+    def to_representation(self, value):
+        return orjson.Fragment(value)
+
+
+def encode_route_base64(arrays):
+    return base64.b64encode(encode_route_columns(arrays)).decode()
+
+
+# Compact formats of route_data a client can ask for instead of the list of
+# points, see RouteSerializer.to_representation
+ROUTE_FORMATS = {
+    "polyline": encode_geolocation_series,
+    "binary": encode_route_base64,
+}
+ROUTE_DATA_CACHE_TIMEOUT = 31 * 24 * 3600
+
+
+def requested_route_format(request):
+    """
+    Format of route_data asked with ?route_format= or as a parameter of the
+    accepted media type, e.g. "application/json; route_format=polyline"
+    """
+    route_format = request.GET.get("route_format") if request else None
+    if not route_format and getattr(request, "accepted_media_type", None):
+        _, params = parse_header_parameters(request.accepted_media_type)
+        route_format = params.get("route_format")
+    if route_format and route_format != "json" and route_format not in ROUTE_FORMATS:
+        raise ValidationError(
+            {"route_format": f"Expecting one of json, {', '.join(ROUTE_FORMATS)}"}
+        )
+    return route_format or "json"
+
+
+def encoded_route_data(route, route_format):
+    """
+    route_data of a route in one of ROUTE_FORMATS, None when the route can not
+    be encoded in it. Cached until the route is modified.
+    """
+    cache_key = (
+        f"route_data_{route.uid}_{route.modification_date.timestamp()}_{route_format}"
+    )
+    encoded = cache.get(cache_key)
+    if encoded is None:
+        arrays = route_to_arrays(orjson.loads(route.route_json))
+        # Cached as "" when the route can not be encoded
+        encoded = ROUTE_FORMATS[route_format](arrays) or ""
+        cache.set(cache_key, encoded, ROUTE_DATA_CACHE_TIMEOUT)
+    return encoded or None
+
+
+# Stands for the uid in the URL templates, matches the uid patterns of the urls
+URL_UID_PLACEHOLDER = "UIDPLACEHOLDER"
+
+
+def url_template(request, view_name):
+    """
+    (prefix, suffix) around the uid in the absolute URL of a view, reversed
+    once per request
+    """
+    templates = getattr(request, "url_templates", None)
+    if templates is None:
+        templates = request.url_templates = {}
+    if view_name not in templates:
+        url = request.build_absolute_uri(
+            reverse(view_name, kwargs={"uid": URL_UID_PLACEHOLDER})
+        )
+        templates[view_name] = tuple(url.split(URL_UID_PLACEHOLDER))
+    return templates[view_name]
+
+
+class URLTemplateField(serializers.ReadOnlyField):
     """
-    Field that returns a link to the relative url.
+    Absolute URL of a view for the uid of the object, formatted into a
+    template instead of calling reverse() and build_absolute_uri() by row
     """
 
+    def __init__(self, view_name, **kwargs):
+        self.view_name = view_name
+        kwargs.setdefault("source", "uid")
+        super().__init__(**kwargs)
+
     def to_representation(self, value):
         request = self.context.get("request")
-        url = request and request.build_absolute_uri(value) or ""
-        return url
+        if not request:
+            return ""
+        prefix, suffix = url_template(request, self.view_name)
+        return f"{prefix}{value}{suffix}"
+
+
+class SparseFieldsMixin:
+    """
+    Only output the fields listed in the comma separated ?fields= parameter.
+    It applies to the objects of the response, not to the serializers nested
+    in another one using it.
+    """
+
+    def get_fields(self):
+        fields = super().get_fields()
+        request = self.context.get("request")
+        names = request.GET.get("fields") if request else None
+        if not names or request.method not in SAFE_METHODS or self.is_nested():
+            return fields
+        names = set(names.split(","))
+        if unknown := names - set(fields):
+            raise ValidationError(
+                {"fields": f"Unknown fields {', '.join(sorted(unknown))}"}
+            )
+        return {name: field for name, field in fields.items() if name in names}
+
+    def is_nested(self):
+        parent = self.parent
+        while parent is not None:
+            if isinstance(parent, SparseFieldsMixin):
+                return True
+            parent = parent.parent
+        return False
 
 
 class UserSettingsSerializer(serializers.ModelSerializer):
@@ -96,6 +271,8 @@ class UserSettingsSerializer(serializers.ModelSerializer):
             return None
         if not value.startswith("data:image/png;base64,"):
             raise ValidationError("The image should be a base 64 encoded PNG")
+        from PIL import Image
+
         content_b64 = value.partition("base64,")[2]
         in_buf = BytesIO()
         in_buf.write(base64.b64decode(content_b64))
@@ -155,17 +332,56 @@ class RouteCommentSerializer(serializers.ModelSerializer):
         )
 
 
-class RouteSerializer(serializers.ModelSerializer):
+class NotificationRouteSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Route
+        fields = ("name", "uid")
+
+
+class LikeNotificationSerializer(serializers.ModelSerializer):
+    creation_date = serializers.ReadOnlyField()
+    user = UserInfoSerializer()
+    route = NotificationRouteSerializer()
+
+    class Meta:
+        model = ThumbUp
+        fields = (
+            "creation_date",
+            "user",
+            "route",
+        )
+
+
+class CommentNotificationSerializer(serializers.ModelSerializer):
+    creation_date = serializers.ReadOnlyField()
+    user = UserInfoSerializer()
+    route = NotificationRouteSerializer()
+
+    class Meta:
+        model = Comment
+        fields = (
+            "id",
+            "creation_date",
+            "user",
+            "route",
+            "message",
+        )
+
+
+class RouteSerializer(
+    SparseFieldsMixin, RouteGeometryMixin, serializers.ModelSerializer
+):
     map_image = serializers.ImageField(
         source="raster_map.image", write_only=True, required=False
     )
     map_id = serializers.ChoiceField(
         [], source="raster_map.uid", allow_blank=True, required=False
     )
-    gpx_url = RelativeURLField()
-    map_url = RelativeURLField(source="image_url")
-    map_thumbnail_url = RelativeURLField(source="thumbnail_url")
-    route_data = serializers.JSONField(source="route")
+    gpx_url = URLTemplateField("gpx_download")
+    map_url = URLTemplateField("map_image")
+    map_thumbnail_url = URLTemplateField("map_thumbnail")
+    route_data = RouteDataField(source="route", required=False)
+    route_file = serializers.FileField(write_only=True, required=False)
     map_bounds = serializers.JSONField(source="raster_map.bounds", required=False)
     id = serializers.ReadOnlyField(source="uid")
     athlete = UserInfoSerializer(read_only=True)
@@ -182,9 +398,33 @@ class RouteSerializer(serializers.ModelSerializer):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.fields["map_id"].choices = [None] + list(
-            RasterMap.objects.all().values_list("uid", flat=True)
-        )
+        if "map_id" in self.fields:
+            self.fields["map_id"].choices = [None] + list(
+                RasterMap.objects.all().values_list("uid", flat=True)
+            )
+
+    def get_fields(self):
+        fields = super().get_fields()
+        request = self.context.get("request")
+        if "geometry" in fields and request and request.method in SAFE_METHODS:
+            # Sent instead of the raw points
+            fields.pop("route_data", None)
+        return fields
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        if "route_data" not in data:
+            return data
+        route_format = requested_route_format(self.context.get("request"))
+        encoded = None
+        if route_format in ROUTE_FORMATS:
+            encoded = encoded_route_data(instance, route_format)
+        if encoded is None:
+            route_format = "json"
+        else:
+            data["route_data"] = encoded
+        data["route_format"] = route_format
+        return data
 
     def validate_map_bounds(self, value):
         if not value:
@@ -199,20 +439,15 @@ class RouteSerializer(serializers.ModelSerializer):
         return value
 
     def validate_route_data(self, value):
-        if not isinstance(value, list) or len(value) <= 0:
-            raise ValidationError("Invalid route data")
-        for x in value:
-            if "time" not in x or not isinstance(x["time"], (type(None), float, int)):
-                raise ValidationError("Invalid route data")
-            if (
-                "latlon" not in x
-                or not isinstance(x["latlon"], list)
-                or len(x["latlon"]) != 2
-            ):
-                raise ValidationError("Invalid route data")
-            validate_latitude(x["latlon"][0])
-            validate_longitude(x["latlon"][1])
-        return value
+        return validate_route_data(value)
+
+    def validate_route_file(self, value):
+        try:
+            arrays = parse_route_file(value)
+            validate_route_arrays(arrays)
+        except ValueError as e:
+            raise ValidationError(str(e))
+        return arrays
 
     def validate(self, data):
         request = self.context.get("request")
@@ -220,6 +455,10 @@ class RouteSerializer(serializers.ModelSerializer):
             if data.get("raster_map"):
                 raise ValidationError("This method does not allow to update to map")
         else:  # Method is POST
+            if "route" not in data and "route_file" not in data:
+                raise ValidationError("Either set route_data or route_file")
+            if "route" in data and "route_file" in data:
+                raise ValidationError("Either set route_data or route_file, not both")
             if data.get("start_time"):
                 if data.get("route_data", {}).get("time", [None])[0]:
                     raise ValidationError("Route data already include time")
@@ -244,6 +483,7 @@ class RouteSerializer(serializers.ModelSerializer):
                 )
         return data
 
+    @transaction.atomic
     def create(self, validated_data):
         user = None
         request = self.context.get("request")
@@ -271,21 +511,33 @@ class RouteSerializer(serializers.ModelSerializer):
             route.start_time = validated_data["start_time"]
         if validated_data.get("is_private"):
             route.is_private = True
-        route.route = validated_data["route"]
-        route.prefetch_route_extras()
+        arrays = self.pop_route_arrays(validated_data)
+        route.route_json = route_json_from_arrays(arrays)
+        route.prefetch_route_extras(arrays)
+        route.hashtags = parse_hashtags(route.comment)
         route.save()
         return route
 
-    def save(self):
-        super().save()
-        instance = self.instance
-        instance.prefetch_route_extras()
-        instance.save()
-        comment = instance.comment
-        instance.tags = ", ".join(
-            hashtag_match.group(2).lower()
-            for hashtag_match in re.finditer(HASHTAG_REGEX, comment)
+    @transaction.atomic
+    def update(self, instance, validated_data):
+        arrays = self.pop_route_arrays(validated_data)
+        if arrays is not None:
+            instance.route_json = route_json_from_arrays(arrays)
+            instance.prefetch_route_extras(arrays)
+        instance.hashtags = parse_hashtags(
+            validated_data.get("comment", instance.comment)
         )
+        return super().update(instance, validated_data)
+
+    def pop_route_arrays(self, validated_data):
+        """
+        RouteArrays of the track given as route_data or as route_file, used to
+        compute the route extras without parsing route_json again
+        """
+        arrays = validated_data.pop("route_file", None)
+        if arrays is None:
+            arrays = validated_data.pop("route", None)
+        return arrays
 
     class Meta:
         model = Route
@@ -308,18 +560,21 @@ class RouteSerializer(serializers.ModelSerializer):
             "map_size",
             "comment",
             "route_data",
+            "route_file",
             "is_private",
             "thumbsup",
             "comments",
         )
 
 
-class UserRouteListSerializer(serializers.ModelSerializer):
-    url = RelativeURLField(source="api_url")
+class UserRouteListSerializer(
+    SparseFieldsMixin, RouteGeometryMixin, serializers.ModelSerializer
+):
+    url = URLTemplateField("route_detail")
     id = serializers.ReadOnlyField(source="uid")
     country = serializers.ReadOnlyField()
-    map_url = RelativeURLField(source="image_url")
-    map_thumbnail_url = RelativeURLField(source="thumbnail_url")
+    map_url = URLTemplateField("map_image")
+    map_thumbnail_url = URLTemplateField("map_thumbnail")
     tz = serializers.ReadOnlyField()
     start_time = serializers.ReadOnlyField()
     distance = serializers.ReadOnlyField()
@@ -342,17 +597,21 @@ class UserRouteListSerializer(serializers.ModelSerializer):
         )
 
 
-class LatestRouteListSerializer(serializers.ModelSerializer):
-    url = RelativeURLField(source="api_url")
+class LatestRouteListSerializer(
+    SparseFieldsMixin, RouteGeometryMixin, serializers.ModelSerializer
+):
+    url = URLTemplateField("route_detail")
     id = serializers.ReadOnlyField(source="uid")
     country = serializers.ReadOnlyField()
-    map_url = RelativeURLField(source="image_url")
-    map_thumbnail_url = RelativeURLField(source="thumbnail_url")
+    map_url = URLTemplateField("map_image")
+    map_thumbnail_url = URLTemplateField("map_thumbnail")
     tz = serializers.ReadOnlyField()
     start_time = serializers.ReadOnlyField()
     distance = serializers.ReadOnlyField()
     duration = serializers.ReadOnlyField()
     athlete = UserInfoSerializer(read_only=True)
+    like_count = serializers.ReadOnlyField()
+    comment_count = serializers.ReadOnlyField()
 
     class Meta:
         model = Route
@@ -369,9 +628,19 @@ class LatestRouteListSerializer(serializers.ModelSerializer):
             "name",
             "athlete",
             "is_private",
+            "like_count",
+            "comment_count",
         )
 
 
+class SimilarRouteSerializer(LatestRouteListSerializer):
+    # Largest distance in meters between the courses
+    distance_to_route = serializers.FloatField()
+
+    class Meta(LatestRouteListSerializer.Meta):
+        fields = LatestRouteListSerializer.Meta.fields + ("distance_to_route",)
+
+
 class UserMainSerializer(serializers.ModelSerializer):
     # latest_routes = serializers.SerializerMethodField()
     # routes = UserRouteListSerializer(many=True)
@@ -450,12 +719,42 @@ class ResendVerificationSerializer(serializers.Serializer):
             pass
 
 
-class MapListSerializer(serializers.ModelSerializer):
+class MapListSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     id = serializers.ReadOnlyField(source="uid")
-    image_url = RelativeURLField()
+    image_url = URLTemplateField("raster_map_image")
     bounds = serializers.JSONField()
     routes = LatestRouteListSerializer(source="route_set", many=True)
 
     class Meta:
         model = RasterMap
         fields = ("id", "image_url", "country", "bounds", "routes")
+
+
+class MapSuggestionSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    id = serializers.ReadOnlyField(source="uid")
+    image_url = URLTemplateField("raster_map_image")
+    bounds = serializers.JSONField()
+    coverage = serializers.FloatField()
+
+    class Meta:
+        model = RasterMap
+        fields = ("id", "image_url", "country", "bounds", "coverage")
+
+
+class MapClusterSerializer(serializers.ModelSerializer):
+    lat = serializers.FloatField(source="latitude")
+    lon = serializers.FloatField(source="longitude")
+    tile = serializers.SerializerMethodField()
+
+    def get_tile(self, obj):
+        return [obj.zoom, obj.tile_x, obj.tile_y]
+
+    class Meta:
+        model = MapCluster
+        fields = ("lat", "lon", "count", "tile")
+
+
+class MapControlSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = MapControl
+        fields = ("code", "latitude", "longitude", "radius")
@@ -0,0 +1,207 @@
+import hashlib
+from functools import partial
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import MD5
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from project.routedb.clusters import remove_map_from_clusters, sync_map_clusters
+from project.routedb.models import Comment, RasterMap, Route, ThumbUp
+from project.routedb.search import update_search_vectors
+from project.routedb.stats import (
+    STAT_FIELDS,
+    apply_stat_deltas,
+    route_stat_values,
+    stat_deltas,
+)
+
+USER_NAME_FIELDS = ("first_name", "last_name", "username")
+ROUTE_SEARCHED_FIELDS = ("name", "comment", "athlete", "search_vector")
+# Fields the clusters, heatmaps, stats and splits are derived from
+ROUTE_DERIVED_FIELDS = (
+    "raster_map",
+    "route_json",
+    "athlete",
+    "is_private",
+    "start_time",
+    "tz",
+    "distance",
+    "duration",
+)
+
+
+def increment_route_counter(route_id, field, value):
+    Route.objects.filter(pk=route_id).update(**{field: F(field) + value})
+
+
+@receiver(post_save, sender=ThumbUp)
+def thumbup_created(sender, instance, created, **kwargs):
+    if created:
+        increment_route_counter(instance.route_id, "like_count", 1)
+
+
+@receiver(post_delete, sender=ThumbUp)
+def thumbup_deleted(sender, instance, **kwargs):
+    increment_route_counter(instance.route_id, "like_count", -1)
+
+
+@receiver(post_save, sender=Comment)
+def comment_created(sender, instance, created, **kwargs):
+    if created:
+        increment_route_counter(instance.route_id, "comment_count", 1)
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    increment_route_counter(instance.route_id, "comment_count", -1)
+
+
+def route_json_md5(route_json):
+    """Same digest as the MD5 database function, to compare tracks"""
+    return hashlib.md5(route_json.encode()).hexdigest()
+
+
+def saved_route_values(route_id):
+    """
+    Values of a route, as currently saved, used by the derived tables, with a
+    digest of the track rather than the track itself
+    """
+    return (
+        Route.objects.filter(pk=route_id)
+        .values("raster_map_id", *STAT_FIELDS, route_json_md5=MD5("route_json"))
+        .first()
+    )
+
+
+def saved_route_json(route_id):
+    return Route.objects.filter(pk=route_id).values_list("route_json", flat=True)[0]
+
+
+def saves_derived_fields(update_fields):
+    if update_fields is None:
+        return True
+    names = {Route._meta.get_field(name).name for name in update_fields}
+    return bool(names & set(ROUTE_DERIVED_FIELDS))
+
+
+@receiver(pre_save, sender=Route)
+def route_will_save(sender, instance, update_fields=None, **kwargs):
+    from project.routedb.heatmaps import heatmap_state
+
+    instance._previous = None
+    if not instance.pk or not saves_derived_fields(update_fields):
+        return
+    previous = saved_route_values(instance.pk)
+    if previous is None:
+        return
+    # The heatmap states are compared with the digests, the previous track is
+    # only read when it has to be removed from the heatmaps
+    previous_heatmap = heatmap_state(
+        previous["athlete_id"], previous["is_private"], previous["route_json_md5"]
+    )
+    current_heatmap = heatmap_state(
+        instance.athlete_id, instance.is_private, route_json_md5(instance.route_json)
+    )
+    if previous_heatmap != current_heatmap:
+        previous["heatmap"] = previous_heatmap and heatmap_state(
+            previous["athlete_id"], False, saved_route_json(instance.pk)
+        )
+    instance._previous = previous
+
+
+@receiver(post_save, sender=Route)
+def route_saved(sender, instance, created, update_fields=None, **kwargs):
+    from project.routedb.heatmaps import heatmap_state, update_route_heatmaps
+    from project.routedb.splits import update_route_splits
+
+    # The search vector is computed by the database, a save writing the stale
+    # value held by the instance must be followed by an update
+    if update_fields is None or set(update_fields) & set(ROUTE_SEARCHED_FIELDS):
+        update_search_vectors(Route.objects.filter(pk=instance.pk))
+
+    if not created and not saves_derived_fields(update_fields):
+        return
+    previous = getattr(instance, "_previous", None) or {}
+    digest = route_json_md5(instance.route_json)
+
+    previous_raster_map_id = previous.get("raster_map_id")
+    if previous_raster_map_id and previous_raster_map_id != instance.raster_map_id:
+        sync_map_clusters(previous_raster_map_id)
+    if instance.raster_map_id:
+        sync_map_clusters(instance.raster_map_id)
+
+    if not previous or "heatmap" in previous:
+        previous_heatmap = previous.get("heatmap")
+        current_heatmap = heatmap_state(
+            instance.athlete_id, instance.is_private, instance.route_json
+        )
+        if previous_heatmap != current_heatmap:
+            transaction.on_commit(
+                partial(update_route_heatmaps, previous_heatmap, current_heatmap),
+                robust=True,
+            )
+
+    apply_stat_deltas(stat_deltas(previous, route_stat_values(instance)))
+
+    if (
+        previous.get("raster_map_id") != instance.raster_map_id
+        or previous.get("route_json_md5") != digest
+    ):
+        update_route_splits(instance.pk, instance.raster_map_id, instance.route_json)
+
+
+@receiver(pre_delete, sender=Route)
+def route_will_delete(sender, instance, **kwargs):
+    from project.routedb.heatmaps import heatmap_state, update_route_heatmaps
+
+    previous = saved_route_values(instance.pk)
+    if previous is None:
+        return
+    previous["route_json"] = saved_route_json(instance.pk)
+    apply_stat_deltas(stat_deltas(previous, None))
+    previous_heatmap = heatmap_state(
+        previous["athlete_id"], previous["is_private"], previous["route_json"]
+    )
+    if previous_heatmap:
+        transaction.on_commit(
+            partial(update_route_heatmaps, previous_heatmap, None), robust=True
+        )
+
+
+@receiver(post_delete, sender=Route)
+def route_deleted(sender, instance, **kwargs):
+    if instance.raster_map_id:
+        sync_map_clusters(instance.raster_map_id)
+
+
+@receiver(post_save, sender=RasterMap)
+def raster_map_saved(sender, instance, created, **kwargs):
+    if not created:
+        sync_map_clusters(instance.pk)
+
+
+@receiver(pre_delete, sender=RasterMap)
+def raster_map_will_delete(sender, instance, **kwargs):
+    remove_map_from_clusters(instance.pk)
+
+
+@receiver(pre_save, sender=User)
+def user_will_save(sender, instance, update_fields=None, **kwargs):
+    instance._previous_names = None
+    if update_fields is not None and not set(update_fields) & set(USER_NAME_FIELDS):
+        return  # eg: last_login updates
+    if instance.pk:
+        instance._previous_names = (
+            User.objects.filter(pk=instance.pk).values_list(*USER_NAME_FIELDS).first()
+        )
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, **kwargs):
+    names = tuple(getattr(instance, field) for field in USER_NAME_FIELDS)
+    previous_names = getattr(instance, "_previous_names", None)
+    if not created and previous_names and previous_names != names:
+        update_search_vectors(Route.objects.filter(athlete_id=instance.pk))
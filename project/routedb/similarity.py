@@ -0,0 +1,65 @@
+from django.db.models import F, Func, IntegerField
+
+from project.utils.gps_data_encoder import decode_polyline
+from project.utils.route_data import hausdorff_distance
+
+# Candidates cross a number of tiles between the number crossed by the route
+# divided and multiplied by this ratio
+SIMILAR_MAX_CELLS_RATIO = 2
+# Share of the tiles crossed by either route crossed by both
+SIMILAR_MIN_JACCARD = 0.5
+SIMILAR_MAX_CANDIDATES = 100
+# Routes deviating more from the route are not on the same course, in meters
+SIMILAR_MAX_DISTANCE = 150
+SIMILAR_DETAIL = "medium"
+
+
+def cell_count():
+    return Func(F("cells"), function="cardinality", output_field=IntegerField())
+
+
+def similar_routes(route, routes, limit=10):
+    """
+    Routes following the same course as the route, annotated with their
+    distance to it, the closest first.
+
+    Candidates sharing tiles with the route are found with the index on the
+    cells, the most overlapping ones are then compared by Hausdorff distance
+    of their simplified geometries.
+    """
+    # Routes saved before their cells or geometries were filled are skipped
+    if not route.cells or SIMILAR_DETAIL not in route.geometries:
+        return []
+    cells = set(route.cells)
+    candidates = (
+        routes.exclude(pk=route.pk)
+        .filter(cells__overlap=route.cells)
+        .annotate(cell_count=cell_count())
+        .filter(
+            cell_count__gte=len(cells) / SIMILAR_MAX_CELLS_RATIO,
+            cell_count__lte=len(cells) * SIMILAR_MAX_CELLS_RATIO,
+        )
+        .values_list("pk", "cells")
+        .order_by()
+    )
+    overlaps = []
+    for pk, candidate_cells in candidates.iterator(chunk_size=1000):
+        shared = len(cells.intersection(candidate_cells))
+        jaccard = shared / (len(cells) + len(candidate_cells) - shared)
+        if jaccard >= SIMILAR_MIN_JACCARD:
+            overlaps.append((jaccard, pk))
+    overlaps.sort(reverse=True)
+    best = [pk for _, pk in overlaps[:SIMILAR_MAX_CANDIDATES]]
+
+    track = decode_polyline(route.geometries[SIMILAR_DETAIL])
+    similar = []
+    candidates = routes.filter(pk__in=best, geometries__has_key=SIMILAR_DETAIL)
+    for candidate in candidates.defer("route_json"):
+        distance = hausdorff_distance(
+            track, decode_polyline(candidate.geometries[SIMILAR_DETAIL])
+        )
+        if distance <= SIMILAR_MAX_DISTANCE:
+            candidate.distance_to_route = distance
+            similar.append(candidate)
+    similar.sort(key=lambda candidate: candidate.distance_to_route)
+    return similar[:limit]
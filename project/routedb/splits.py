@@ -0,0 +1,99 @@
+import json
+
+import numpy as np
+from django.db import transaction
+
+from project.routedb.models import MapControl, Route, RouteSplits
+from project.utils.route_data import control_passages, route_to_arrays
+
+
+def map_controls(raster_map_id):
+    """[(latitude, longitude, radius)] of the controls of a map, in order"""
+    return list(
+        MapControl.objects.filter(raster_map_id=raster_map_id)
+        .order_by("order")
+        .values_list("latitude", "longitude", "radius")
+    )
+
+
+def route_passages(route_json, controls):
+    return control_passages(
+        route_to_arrays(json.loads(route_json)),
+        [(lat, lon) for lat, lon, _ in controls],
+        [radius for _, _, radius in controls],
+    )
+
+
+def update_route_splits(route_id, raster_map_id, route_json):
+    """Recompute the splits of a route after its track or map changed"""
+    controls = map_controls(raster_map_id) if raster_map_id else []
+    if not controls:
+        RouteSplits.objects.filter(route_id=route_id).delete()
+        return
+    RouteSplits.objects.update_or_create(
+        route_id=route_id,
+        defaults={
+            "raster_map_id": raster_map_id,
+            "passages": route_passages(route_json, controls),
+        },
+    )
+
+
+def update_map_splits(raster_map_id, batch_size=100):
+    """
+    Recompute the splits of all the routes of a map after its controls
+    changed, returns the number of routes
+    """
+    controls = map_controls(raster_map_id)
+    with transaction.atomic():
+        RouteSplits.objects.filter(raster_map_id=raster_map_id).delete()
+        if not controls:
+            return 0
+        routes = (
+            Route.objects.filter(raster_map_id=raster_map_id)
+            .values_list("id", "route_json")
+            .iterator(chunk_size=batch_size)
+        )
+        created = RouteSplits.objects.bulk_create(
+            (
+                RouteSplits(
+                    route_id=route_id,
+                    raster_map_id=raster_map_id,
+                    passages=route_passages(route_json, controls),
+                )
+                for route_id, route_json in routes
+            ),
+            batch_size=batch_size,
+        )
+    return len(created)
+
+
+def rank(values):
+    """Ranks of the values, ties sharing the best rank, NaN for NaN values"""
+    ranks = np.full(values.shape, np.nan)
+    known = ~np.isnan(values)
+    ranks[known] = np.searchsorted(np.sort(values[known]), values[known]) + 1
+    return ranks
+
+
+def leg_comparison(passages, controls_count):
+    """
+    Compare routes on the same course given their lists of passages, returns
+    (leg times, leg ranks, total times, total ranks) where legs are arrays of
+    shape (routes, controls - 1), NaN where a control was missed
+    """
+    passages = np.array(
+        [[np.nan if t is None else t for t in row] for row in passages],
+        dtype=np.float64,
+    ).reshape(len(passages), controls_count)
+    legs = np.diff(passages, axis=1)
+    leg_ranks = np.empty_like(legs)
+    for leg in range(legs.shape[1]):
+        leg_ranks[:, leg] = rank(legs[:, leg])
+    # Routes missing a control are not ranked
+    totals = np.full(len(passages), np.nan)
+    if controls_count:
+        totals = np.where(
+            np.isnan(legs).any(axis=1), np.nan, passages[:, -1] - passages[:, 0]
+        )
+    return legs, leg_ranks, totals, rank(totals)
@@ -0,0 +1,138 @@
+from collections import defaultdict
+from datetime import datetime, time, timedelta, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from project.routedb.models import AthleteStat, Route
+
+STAT_FIELDS = ("athlete_id", "is_private", "start_time", "tz", "distance", "duration")
+# Largest offset of a timezone from UTC, either way
+MAX_UTC_OFFSET = timedelta(hours=14)
+
+
+def local_date(start_time, tz):
+    """Calendar date of a route in its local timezone"""
+    try:
+        zone = ZoneInfo(tz) if tz else timezone.utc
+    except (ZoneInfoNotFoundError, ValueError):
+        zone = timezone.utc
+    return start_time.astimezone(zone).date()
+
+
+def local_days_utc_range(start, end):
+    """
+    UTC datetimes between which routes starting on local dates start to end,
+    inclusive, can start whatever their timezone
+    """
+    return (
+        datetime.combine(start, time.min, timezone.utc) - MAX_UTC_OFFSET,
+        datetime.combine(end + timedelta(days=1), time.min, timezone.utc)
+        + MAX_UTC_OFFSET,
+    )
+
+
+def period_starts(date):
+    return {
+        "day": date,
+        "week": date - timedelta(days=date.weekday()),
+        "month": date.replace(day=1),
+        "year": date.replace(month=1, day=1),
+    }
+
+
+def route_stat_values(route):
+    """STAT_FIELDS of a route instance, as they are saved in the database"""
+    return {
+        field: Route._meta.get_field(field).get_prep_value(getattr(route, field))
+        for field in STAT_FIELDS
+    }
+
+
+def add_route_to_totals(totals, values, sign=1):
+    """
+    Add the route described by values, a dict of STAT_FIELDS, to totals, a
+    dict of [route_count, distance, duration] by AthleteStat key
+    """
+    date = local_date(values["start_time"], values["tz"])
+    for period, period_start in period_starts(date).items():
+        total = totals[
+            (values["athlete_id"], period, period_start, values["is_private"])
+        ]
+        total[0] += sign
+        total[1] += sign * (values["distance"] or 0)
+        total[2] += sign * (values["duration"] or 0)
+
+
+def stat_deltas(previous, current):
+    """Changes of the AthleteStat rows when a route goes from previous to current"""
+    deltas = defaultdict(lambda: [0, 0, 0])
+    if previous:
+        add_route_to_totals(deltas, previous, -1)
+    if current:
+        add_route_to_totals(deltas, current, 1)
+    return {key: delta for key, delta in deltas.items() if any(delta)}
+
+
+def apply_stat_deltas(deltas):
+    with transaction.atomic():
+        for key in sorted(deltas):
+            athlete_id, period, period_start, is_private = key
+            route_count, distance, duration = deltas[key]
+            stat = AthleteStat.objects.filter(
+                athlete_id=athlete_id,
+                period=period,
+                period_start=period_start,
+                is_private=is_private,
+            )
+            updates = {
+                "route_count": F("route_count") + route_count,
+                "distance": F("distance") + distance,
+                "duration": F("duration") + duration,
+            }
+            if route_count < 0:
+                stat.filter(route_count__lte=-route_count).delete()
+            if stat.update(**updates) or route_count <= 0:
+                continue
+            try:
+                with transaction.atomic():
+                    AthleteStat.objects.create(
+                        athlete_id=athlete_id,
+                        period=period,
+                        period_start=period_start,
+                        is_private=is_private,
+                        route_count=route_count,
+                        distance=distance,
+                        duration=duration,
+                    )
+            except IntegrityError:
+                # Created concurrently
+                stat.update(**updates)
+
+
+def rebuild_athlete_stats(athlete_id):
+    """Recompute the stats of an athlete, returns the number of rows"""
+    with transaction.atomic():
+        routes = Route.objects.select_for_update().filter(athlete_id=athlete_id)
+        totals = defaultdict(lambda: [0, 0, 0])
+        for values in routes.values(*STAT_FIELDS):
+            add_route_to_totals(totals, values)
+        AthleteStat.objects.filter(athlete_id=athlete_id).delete()
+        AthleteStat.objects.bulk_create(
+            AthleteStat(
+                athlete_id=athlete_id,
+                period=period,
+                period_start=period_start,
+                is_private=is_private,
+                route_count=route_count,
+                distance=distance,
+                duration=duration,
+            )
+            for (_, period, period_start, is_private), (
+                route_count,
+                distance,
+                duration,
+            ) in totals.items()
+        )
+    return len(totals)
@@ -0,0 +1,423 @@
+import json
+import math
+import os
+import subprocess
+import sys
+import zipfile
+from io import BytesIO
+from unittest import mock
+
+import arrow
+import gpxpy.gpx
+import numpy as np
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db.models.signals import post_save
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from project.routedb.benchmarks import (
+    latest_routes_page,
+    legacy_latest_route_list_serializer,
+    synthetic_fit,
+    synthetic_route,
+)
+from project.routedb.models import MapControl, RasterMap, Route, ThumbUp
+from project.routedb.serializers import (
+    LatestRouteListSerializer,
+    RouteSerializer,
+    url_template,
+)
+from project.routedb.signals import saved_route_json
+from project.routedb.splits import leg_comparison
+from project.utils.gpx import gpx_chunks
+from project.utils.renderers import ORJSONRenderer
+from project.utils.route_data import route_to_arrays
+from project.utils.route_files import parse_route_file
+
+
+def create_raster_map(uploader):
+    raster_map = RasterMap(
+        uploader=uploader, mime_type="image/png", width=10, height=10
+    )
+    raster_map.image.name = "maps/test.png"
+    raster_map.bounds = {
+        "top_left": [61.46, 24.18],
+        "top_right": [61.46, 24.20],
+        "bottom_right": [61.44, 24.20],
+        "bottom_left": [61.44, 24.18],
+    }
+    raster_map._latitude, raster_map._longitude = raster_map.get_center()
+    raster_map.save()
+    return raster_map
+
+
+def create_route(athlete, start=1577836800, **kwargs):
+    route = Route(athlete=athlete, **kwargs)
+    route.route = synthetic_route(50, start=start)
+    route.prefetch_route_extras()
+    route.save()
+    return route
+
+
+SETUP_SCRIPT = """
+import json, sys
+import django
+django.setup()
+print(json.dumps(sorted(sys.modules)))
+"""
+
+
+class StartupTestCase(SimpleTestCase):
+    def cold_setup(self):
+        proc = subprocess.run(
+            [sys.executable, "-c", SETUP_SCRIPT],
+            capture_output=True,
+            text=True,
+            check=True,
+            env=dict(os.environ, DJANGO_SETTINGS_MODULE=settings.SETTINGS_MODULE),
+            cwd=os.path.dirname(settings.BASE_DIR),
+        )
+        return json.loads(proc.stdout.strip().splitlines()[-1])
+
+    def test_heavy_modules_deferred(self):
+        modules = self.cold_setup()
+        for name in ("numpy", "scipy", "PIL"):
+            self.assertNotIn(name, modules)
+
+
+class LegComparisonTestCase(TestCase):
+    def test_ranks(self):
+        legs, leg_ranks, totals, total_ranks = leg_comparison(
+            [[0, 10, 40], [0, 12, 30], [0, None, 50]], 3
+        )
+        self.assertEqual(legs[:2].tolist(), [[10, 30], [12, 18]])
+        self.assertEqual(leg_ranks[:2].tolist(), [[1, 2], [2, 1]])
+        self.assertTrue(math.isnan(legs[2][0]))
+        self.assertEqual(totals[:2].tolist(), [40, 30])
+        self.assertEqual(total_ranks[:2].tolist(), [2, 1])
+        self.assertTrue(math.isnan(total_ranks[2]))
+
+    def test_no_routes(self):
+        for controls_count in (0, 1, 3):
+            legs, leg_ranks, totals, total_ranks = leg_comparison([], controls_count)
+            self.assertEqual(legs.shape, (0, max(controls_count - 1, 0)))
+            self.assertEqual(leg_ranks.shape, legs.shape)
+            self.assertEqual(totals.shape, (0,))
+            self.assertEqual(total_ranks.shape, (0,))
+
+
+class MapSplitsTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("alice", "alice@example.com")
+        self.raster_map = create_raster_map(self.user)
+        self.client = APIClient()
+        self.url = f"/api/v1/maps/{self.raster_map.uid}/splits/"
+
+    def test_no_controls(self):
+        res = self.client.get(self.url)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json(), {"controls": [], "routes": []})
+
+    def test_no_routes(self):
+        MapControl.objects.bulk_create(
+            MapControl(
+                raster_map=self.raster_map, order=order, latitude=lat, longitude=24.19
+            )
+            for order, lat in enumerate([61.445, 61.45, 61.455])
+        )
+        res = self.client.get(self.url)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(res.json()["controls"]), 3)
+        self.assertEqual(res.json()["routes"], [])
+
+
+class FitFileTestCase(SimpleTestCase):
+    def setUp(self):
+        self.route = synthetic_route(300, seed=1)
+        self.route[10]["time"] = None
+
+    def test_variants(self):
+        expected = route_to_arrays(self.route)
+        for options in range(8):
+            variant = dict(
+                big_endian=bool(options & 1),
+                compressed_timestamps=bool(options & 2),
+                developer_fields=bool(options & 4),
+            )
+            with self.subTest(**variant):
+                arrays = parse_route_file(BytesIO(synthetic_fit(self.route, **variant)))
+                for got, want in zip(arrays, expected):
+                    np.testing.assert_array_equal(got, want)
+
+    def test_corrupted(self):
+        rng = np.random.default_rng(0)
+        data = synthetic_fit(self.route, compressed_timestamps=True)
+        for _ in range(1000):
+            corrupted = bytearray(data)
+            if rng.random() < 0.5:
+                corrupted = corrupted[: rng.integers(len(corrupted))]
+            for pos in rng.integers(len(corrupted) or 1, size=rng.integers(1, 8)):
+                if pos < len(corrupted):
+                    corrupted[pos] = rng.integers(256)
+            # Either reads some points or rejects the file, nothing else
+            try:
+                parse_route_file(BytesIO(bytes(corrupted)))
+            except ValueError:
+                pass
+
+
+class URLTemplateTestCase(SimpleTestCase):
+    def setUp(self):
+        self.routes = latest_routes_page()
+        self.factory = APIRequestFactory()
+
+    def serialize(self, serializer_class, path="/api/v1/latest-routes/", **extra):
+        request = Request(self.factory.get(path, **extra))
+        return serializer_class(
+            self.routes, many=True, context={"request": request}
+        ).data
+
+    def test_same_output_as_reverse(self):
+        for extra in ({}, {"secure": True, "HTTP_HOST": "example.com:8443"}):
+            with self.subTest(**extra):
+                renderer = ORJSONRenderer()
+                self.assertEqual(
+                    renderer.render(self.serialize(LatestRouteListSerializer, **extra)),
+                    renderer.render(
+                        self.serialize(legacy_latest_route_list_serializer(), **extra)
+                    ),
+                )
+
+    def test_template(self):
+        request = Request(self.factory.get("/", secure=True))
+        for uid in ("abcdefghijk", "a-b_c-d_e-f"):
+            prefix, suffix = url_template(request, "route_detail")
+            self.assertEqual(
+                f"{prefix}{uid}{suffix}",
+                request.build_absolute_uri(
+                    reverse("route_detail", kwargs={"uid": uid})
+                ),
+            )
+
+    def test_reverse_once_per_view(self):
+        with mock.patch(
+            "project.routedb.serializers.reverse", wraps=reverse
+        ) as patched_reverse:
+            self.serialize(LatestRouteListSerializer)
+        self.assertEqual(
+            sorted(call.args[0] for call in patched_reverse.call_args_list),
+            ["map_image", "map_thumbnail", "route_detail"],
+        )
+
+
+class SparseFieldsTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("alice", "alice@example.com")
+        self.raster_map = create_raster_map(self.user)
+        self.route = create_route(self.user, raster_map=self.raster_map, name="r")
+        self.client = APIClient()
+
+    def test_fields(self):
+        res = self.client.get("/api/v1/latest-routes/?fields=id,name,url")
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(
+            res.json()["results"],
+            [
+                {
+                    "id": self.route.uid,
+                    "name": "r",
+                    "url": f"http://testserver{self.route.api_url}",
+                }
+            ],
+        )
+
+    def test_unknown_field(self):
+        res = self.client.get("/api/v1/latest-routes/?fields=id,nope")
+        self.assertEqual(res.status_code, 400)
+        self.assertIn("nope", res.json()["fields"])
+
+    def test_nested_serializers_left_alone(self):
+        full = self.client.get("/api/v1/maps/").json()
+        res = self.client.get("/api/v1/maps/?fields=id,routes")
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(
+            res.json(), [{"id": full[0]["id"], "routes": full[0]["routes"]}]
+        )
+        self.assertIn("map_thumbnail_url", res.json()[0]["routes"][0])
+
+
+class ExportTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("alice", "alice@example.com")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        # Two routes starting at the same time, to the microsecond
+        for start in (1577836800.123456, 1577836800.123456, 1577840400):
+            create_route(self.user, start=start, name="r")
+
+    def export(self, **params):
+        res = self.client.get("/api/v1/auth/user/export/", params)
+        self.assertEqual(res.status_code, 200)
+        archive = zipfile.ZipFile(BytesIO(b"".join(res.streaming_content)))
+        return [
+            json.loads(archive.read(name))
+            for name in archive.namelist()
+            if name.endswith("/route.json")
+        ]
+
+    def test_resume(self):
+        routes = self.export()
+        self.assertEqual(len(routes), 3)
+        for i, route in enumerate(routes):
+            self.assertEqual(self.export(after=route["export_cursor"]), routes[i + 1 :])
+
+    def test_invalid_cursor(self):
+        res = self.client.get("/api/v1/auth/user/export/", {"after": "yesterday"})
+        self.assertEqual(res.status_code, 400)
+
+
+class SimilarRoutesTestCase(TestCase):
+    def setUp(self):
+        alice = User.objects.create_user("alice", "alice@example.com")
+        bob = User.objects.create_user("bob", "bob@example.com")
+        self.route = create_route(alice, name="r")
+        self.similar = create_route(bob, name="same course")
+        self.client = APIClient()
+        self.url = f"/api/v1/route/{self.route.uid}/similar/"
+
+    def test_similar(self):
+        res = self.client.get(self.url)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([route["id"] for route in res.json()], [self.similar.uid])
+
+    def test_without_geometries(self):
+        # Saved before fill_route_geometries ran
+        Route.objects.filter(pk=self.similar.pk).update(geometries={})
+        res = self.client.get(self.url)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json(), [])
+        Route.objects.filter(pk=self.route.pk).update(geometries={})
+        res = self.client.get(self.url)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json(), [])
+
+
+class RouteCountersTestCase(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user("alice", "alice@example.com")
+        self.bob = User.objects.create_user("bob", "bob@example.com")
+        self.route = create_route(self.alice, name="r")
+
+    def test_save_keeps_counters(self):
+        stale = Route.objects.get(pk=self.route.pk)
+        ThumbUp.objects.create(route=self.route, user=self.bob)
+        request = Request(APIRequestFactory().patch(self.route.api_url))
+        serializer = RouteSerializer(
+            stale, data={"name": "renamed"}, partial=True, context={"request": request}
+        )
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        self.route.refresh_from_db()
+        self.assertEqual(self.route.name, "renamed")
+        self.assertEqual(self.route.like_count, 1)
+
+    def test_update_saves_once(self):
+        saves = []
+
+        def saved(sender, instance, **kwargs):
+            saves.append(kwargs["update_fields"])
+
+        request = Request(APIRequestFactory().patch(self.route.api_url))
+        serializer = RouteSerializer(
+            self.route,
+            data={"comment": "Night #sprint"},
+            partial=True,
+            context={"request": request},
+        )
+        serializer.is_valid(raise_exception=True)
+        post_save.connect(saved, sender=Route)
+        try:
+            serializer.save()
+        finally:
+            post_save.disconnect(saved, sender=Route)
+        self.assertEqual(len(saves), 1)
+        self.route.refresh_from_db()
+        self.assertEqual(self.route.hashtags, ["sprint"])
+
+
+class RouteSignalsTestCase(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user("alice", "alice@example.com")
+        self.route = create_route(self.alice, name="r")
+        self.route_json = self.route.route_json
+
+    def save_route(self, **kwargs):
+        with (
+            mock.patch(
+                "project.routedb.signals.saved_route_json", wraps=saved_route_json
+            ) as read_track,
+            mock.patch("project.routedb.heatmaps.update_route_heatmaps") as update,
+            self.captureOnCommitCallbacks(execute=True),
+        ):
+            self.route.save(**kwargs)
+        return read_track.call_count, update.call_args_list
+
+    def test_track_kept(self):
+        self.route.name = "renamed"
+        self.assertEqual(self.save_route(), (0, []))
+        self.assertEqual(self.save_route(update_fields=["name"]), (0, []))
+
+    def test_track_changed(self):
+        self.route.route = synthetic_route(50, seed=1)
+        self.assertEqual(
+            self.save_route(),
+            (
+                1,
+                [
+                    mock.call(
+                        (self.alice.pk, self.route_json),
+                        (self.alice.pk, self.route.route_json),
+                    )
+                ],
+            ),
+        )
+
+    def test_made_private(self):
+        self.route.is_private = True
+        self.assertEqual(
+            self.save_route(), (1, [mock.call((self.alice.pk, self.route_json), None)])
+        )
+        self.route.is_private = False
+        self.assertEqual(
+            self.save_route(), (0, [mock.call(None, (self.alice.pk, self.route_json))])
+        )
+
+
+class GPXTestCase(SimpleTestCase):
+    def test_same_as_gpxpy(self):
+        route = [
+            {"time": time, "latlon": latlon}
+            for time, latlon in [
+                (None, [0.0, -0.0]),
+                (1.5, [-0.0, 0.0]),
+                (1577836800.25, [1e-7, -1e-5]),
+                (1577836801, [-90, 180.0]),
+                (None, [5, -3]),
+                (1577836802.123456, [61.123456, 24.987654]),
+            ]
+        ]
+        gpx = gpxpy.gpx.GPX()
+        gpx.creator = "Mapdump.com"
+        segment = gpxpy.gpx.GPXTrackSegment()
+        for point in route:
+            gpx_point = gpxpy.gpx.GPXTrackPoint(*point["latlon"])
+            if point["time"]:
+                gpx_point.time = arrow.get(point["time"]).datetime
+            segment.points.append(gpx_point)
+        track = gpxpy.gpx.GPXTrack()
+        track.segments.append(segment)
+        gpx.tracks.append(track)
+        self.assertEqual("".join(gpx_chunks(route, chunk_size=4)), gpx.to_xml())
@@ -6,18 +6,84 @@ urlpatterns = [
     path("routes/new", views.RouteCreate.as_view(), name="route_create"),
     path("latest-routes/", views.LatestRoutesList.as_view(), name="latest_routes_list"),
     path("latest-likes/", views.likes_received_view, name="like_received_view"),
+    path(
+        "latest-comments/",
+        views.comments_received_view,
+        name="comments_received_view",
+    ),
+    path(
+        "notifications/likes/",
+        views.LikesNotificationsList.as_view(),
+        name="likes_notifications_list",
+    ),
+    path(
+        "notifications/comments/",
+        views.CommentsNotificationsList.as_view(),
+        name="comments_notifications_list",
+    ),
+    path(
+        "notifications/unread-count/",
+        views.unread_notifications_count_view,
+        name="unread_notifications_count",
+    ),
     re_path(
         r"^routes-by-tag/(?P<tag>[a-zA-Z0-9_]+)/?$",
         views.RoutesForTagList.as_view(),
         name="routes_by_tag_list",
     ),
+    path("tags/popular/", views.popular_tags_view, name="popular_tags"),
     path("latest-routes/feed/", feeds.latest_routes_feed, name="latest_routes_feed"),
+    path("search/routes/", views.RouteSearchList.as_view(), name="route_search"),
     path("maps/", views.MapsList.as_view(), name="maps_list"),
+    path("maps/clusters/", views.map_clusters_view, name="map_clusters"),
+    path(
+        "maps/suggestions/",
+        views.map_suggestions_view,
+        name="map_suggestions",
+    ),
+    re_path(
+        r"^maps/(?P<uid>[a-zA-Z0-9_-]+)/controls/?$",
+        views.map_controls_view,
+        name="map_controls",
+    ),
+    re_path(
+        r"^maps/(?P<uid>[a-zA-Z0-9_-]+)/splits/?$",
+        views.map_splits_view,
+        name="map_splits",
+    ),
+    path("replay/", views.replay_view, name="replay"),
     re_path(
         r"^user/(?P<username>[a-zA-Z0-9_-]+)/?$",
         views.UserDetail.as_view(),
         name="user_detail",
     ),
+    path(
+        "heatmap/<int:zoom>/<int:x>/<int:y>.png",
+        views.heatmap_tile,
+        name="heatmap_tile",
+    ),
+    re_path(
+        r"^user/(?P<username>[a-zA-Z0-9_-]+)/heatmap/"
+        r"(?P<zoom>[0-9]+)/(?P<x>[0-9]+)/(?P<y>[0-9]+)\.png$",
+        views.user_heatmap_tile,
+        name="user_heatmap_tile",
+    ),
+    re_path(
+        r"^user/(?P<username>[a-zA-Z0-9_-]+)/stats/?$",
+        views.athlete_stats_view,
+        name="athlete_stats",
+    ),
+    re_path(
+        r"^user/(?P<username>[a-zA-Z0-9_-]+)/routes/?$",
+        views.athlete_routes_view,
+        name="athlete_routes",
+    ),
+    re_path(
+        r"^user/(?P<username>[a-zA-Z0-9_-]+)/calendar/"
+        r"(?P<year>[0-9]{4})-(?P<month>[0-9]{2})/?$",
+        views.athlete_calendar_view,
+        name="athlete_calendar",
+    ),
     re_path(
         r"^user/(?P<username>[a-zA-Z0-9_-]+)/feed/?$",
         feeds.athlete_routes_feed,
@@ -28,6 +94,11 @@ urlpatterns = [
         views.RouteDetail.as_view(),
         name="route_detail",
     ),
+    re_path(
+        r"^route/(?P<uid>[a-zA-Z0-9_-]+)/similar/?$",
+        views.similar_routes_view,
+        name="similar_routes",
+    ),
     re_path(
         r"^route/(?P<uid>[a-zA-Z0-9_-]+)/gpx/?$",
         views.gpx_download,
@@ -67,6 +138,7 @@ urlpatterns = [
         name="edit_comment_view",
     ),
     path("auth/user/", view=views.UserEditView.as_view(), name="auth_user_detail"),
+    path("auth/user/export/", views.export_view, name="auth_user_export"),
     path(
         "auth/user/settings/",
         views.UserSettingsDetail.as_view(),
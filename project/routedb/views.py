@@ -1,47 +1,99 @@
+import calendar
 import json
+import math
 import os.path
 import re
 import time
 import urllib
+import zipfile
+from collections import defaultdict
+from datetime import date, timezone
 
-import arrow
-import requests
-from allauth.account import app_settings as allauth_settings
-from allauth.account.adapter import get_adapter
-from allauth.account.forms import default_token_generator
-from allauth.account.utils import user_username
 from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
 from django.contrib.auth.signals import user_logged_in
 from django.contrib.sites.shortcuts import get_current_site
 from django.core.cache import cache
-from django.db.models import Q
-from django.http import Http404, HttpResponse, HttpResponseRedirect
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.db.models import CharField, Count, Exists, F, Func, OuterRef, Q, Sum
+from django.http import (
+    Http404,
+    HttpResponse,
+    HttpResponseRedirect,
+    StreamingHttpResponse,
+)
 from django.shortcuts import get_object_or_404, redirect, render
+from django.utils.cache import patch_vary_headers
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.text import compress_sequence
+from django.utils.timezone import now
 from knox.models import AuthToken
 from rest_framework import generics, parsers, status
 from rest_framework.decorators import api_view
+from rest_framework.exceptions import ValidationError
 from rest_framework.pagination import CursorPagination
 from rest_framework.permissions import SAFE_METHODS, IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
-from stravalib import Client as StravaClient
-from tagging.models import TaggedItem
-from tagging.utils import get_tag
 
-from project.routedb.models import Comment, RasterMap, Route, ThumbUp, UserSettings
+from project.routedb.clusters import (
+    CLUSTER_CELL_ZOOM_OFFSET,
+    CLUSTER_MAX_ZOOM,
+    mercator,
+)
+from project.routedb.models import (
+    AthleteStat,
+    Comment,
+    HeatmapTile,
+    MapCluster,
+    MapControl,
+    RasterMap,
+    Route,
+    RouteSplits,
+    ThumbUp,
+    UserSettings,
+)
+from project.routedb.search import search_routes
 from project.routedb.serializers import (
     AuthTokenSerializer,
+    CommentNotificationSerializer,
     EmailSerializer,
     LatestRouteListSerializer,
+    LikeNotificationSerializer,
+    MapClusterSerializer,
+    MapControlSerializer,
     MapListSerializer,
+    MapSuggestionSerializer,
     ResendVerificationSerializer,
     RouteSerializer,
+    SimilarRouteSerializer,
     UserInfoSerializer,
     UserMainSerializer,
+    UserRouteListSerializer,
     UserSettingsSerializer,
+    validate_route_data,
+)
+from project.routedb.similarity import similar_routes
+from project.routedb.splits import leg_comparison, update_map_splits
+from project.routedb.stats import local_date, local_days_utc_range
+from project.utils.gps_data_encoder import encode_polyline
+from project.utils.gpx import gpx_chunks
+from project.utils.route_data import (
+    bbox_sample_points,
+    quads_coverage,
+    resample,
+    route_to_arrays,
+    sample_indices,
 )
-from project.utils.s3 import s3_object_url
+from project.utils.s3 import iter_s3_object, s3_object_url
+from project.utils.spatial import (
+    bbox_area,
+    bbox_overlap_area,
+    filter_by_bbox,
+    parse_bbox,
+)
+from project.utils.zipstream import zip_stream
 
 
 def encode_filename(filename):
@@ -187,15 +239,29 @@ class ListRoutesPagination(CursorPagination):
     ordering = "-start_time"
 
 
-class LatestRoutesList(generics.ListAPIView):
+class BoundingBoxFilterMixin:
+    """Filter the queryset with the ?bbox=west,south,east,north parameter"""
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if bbox := self.request.query_params.get("bbox"):
+            queryset = filter_by_bbox(queryset, parse_bbox(bbox))
+        return queryset
+
+
+class LatestRoutesList(BoundingBoxFilterMixin, generics.ListAPIView):
     serializer_class = LatestRouteListSerializer
     pagination_class = ListRoutesPagination
 
     def get_queryset(self):
-        return Route.objects.filter(
-            Q(athlete_id=self.request.user.id)
-            | Q(is_private=False)  # mine or public ones
-        ).select_related("athlete")
+        return (
+            Route.objects.filter(
+                Q(athlete_id=self.request.user.id)
+                | Q(is_private=False)  # mine or public ones
+            )
+            .select_related("athlete")
+            .defer("route_json")
+        )
 
 
 class RoutesForTagList(generics.ListAPIView):
@@ -203,27 +269,349 @@ class RoutesForTagList(generics.ListAPIView):
     pagination_class = ListRoutesPagination
 
     def get_queryset(self):
-        qs = Route.objects.filter(
-            Q(athlete_id=self.request.user.id) | Q(is_private=False)
-        ).select_related("athlete")
         tag = self.kwargs["tag"].lower()
-        tag_instance = get_tag(tag)
-        if tag_instance is None:
+        qs = (
+            Route.objects.filter(
+                Q(athlete_id=self.request.user.id) | Q(is_private=False),
+                hashtags__contains=[tag],
+            )
+            .select_related("athlete")
+            .defer("route_json")
+        )
+        if not qs.exists():
             raise Http404(f'No Tag found matching "{tag}".')
-        return TaggedItem.objects.get_by_model(qs, tag_instance)
+        return qs
+
+
+POPULAR_TAGS_LIMIT = 100
+
+
+@api_view(["GET"])
+def popular_tags_view(request):
+    """Hashtags used by the most public routes, as [{"tag", "count"}]"""
+    limit = request.query_params.get("limit", "25")
+    if not limit.isdigit() or not 0 < int(limit) <= POPULAR_TAGS_LIMIT:
+        return Response(
+            {"limit": f"Expecting an integer between 1 and {POPULAR_TAGS_LIMIT}"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    # Cached for the top POPULAR_TAGS_LIMIT, smaller limits are slices of it
+    cache_key = "popular_tags"
+    tags = cache.get(cache_key)
+    if tags is None:
+        tags = list(
+            Route.objects.filter(is_private=False)
+            .annotate(
+                tag=Func(F("hashtags"), function="unnest", output_field=CharField())
+            )
+            .values("tag")
+            .annotate(count=Count("id"))
+            .order_by("-count", "tag")[:POPULAR_TAGS_LIMIT]
+        )
+        cache.set(cache_key, tags, 10 * 60)
+    return Response(tags[: int(limit)])
+
+
+SEARCH_MIN_LENGTH = 2
+
+
+class SearchRoutesPagination(CursorPagination):
+    page_size = 25
+    ordering = ("-rank", "-start_time")
 
 
-class MapsList(generics.ListAPIView):
+class RouteSearchList(generics.ListAPIView):
+    """Routes matching ?q= in their name, athlete name or comment"""
+
+    serializer_class = LatestRouteListSerializer
+    pagination_class = SearchRoutesPagination
+
+    def get_queryset(self):
+        text = self.request.query_params.get("q", "").strip()
+        if len(text) < SEARCH_MIN_LENGTH:
+            raise ValidationError(
+                {"q": f"Expecting at least {SEARCH_MIN_LENGTH} characters"}
+            )
+        routes = Route.objects.filter(
+            Q(athlete_id=self.request.user.id) | Q(is_private=False)
+        ).select_related("athlete")
+        return search_routes(routes, text)
+
+
+class MapsList(BoundingBoxFilterMixin, generics.ListAPIView):
     serializer_class = MapListSerializer
 
     def get_queryset(self):
-        public_routes = Route.objects.filter(is_private=False)
-        maps_id = set(public_routes.values_list("raster_map_id", flat=True))
-        return RasterMap.objects.filter(pk__in=maps_id).prefetch_related(
+        public_routes = Route.objects.filter(
+            raster_map_id=OuterRef("pk"), is_private=False
+        )
+        return RasterMap.objects.filter(Exists(public_routes)).prefetch_related(
             "route_set", "route_set__athlete"
         )
 
 
+MAP_CLUSTERS_LIMIT = 2000
+
+
+@api_view(["GET"])
+def map_clusters_view(request):
+    """
+    Clusters of the public maps centres for a map displayed at ?zoom=,
+    optionally restricted to ?bbox=west,south,east,north
+    """
+    max_zoom = CLUSTER_MAX_ZOOM - CLUSTER_CELL_ZOOM_OFFSET
+    zoom = request.query_params.get("zoom", "0")
+    if not zoom.isdigit() or int(zoom) > max_zoom:
+        return Response(
+            {"zoom": f"Expecting an integer between 0 and {max_zoom}"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    cell_zoom = int(zoom) + CLUSTER_CELL_ZOOM_OFFSET
+    clusters = MapCluster.objects.filter(zoom=cell_zoom)
+    if bbox := request.query_params.get("bbox"):
+        west, south, east, north = parse_bbox(bbox)
+        top_left = mercator.latlon_to_tile({"lat": north, "lng": west}, cell_zoom)
+        bottom_right = mercator.latlon_to_tile({"lat": south, "lng": east}, cell_zoom)
+        clusters = clusters.filter(
+            tile_x__gte=top_left["x"],
+            tile_x__lte=bottom_right["x"],
+            tile_y__gte=top_left["y"],
+            tile_y__lte=bottom_right["y"],
+        )
+    return Response(MapClusterSerializer(clusters[:MAP_CLUSTERS_LIMIT], many=True).data)
+
+
+MAP_SUGGESTIONS_LIMIT = 10
+MAP_SUGGESTIONS_MAX_CANDIDATES = 500
+MAP_SUGGESTIONS_MAX_POINTS = 500
+# Added around the track bounding box when ranking the candidates, in
+# degrees, so that a track along a meridian or a parallel still has an area
+MAP_SUGGESTIONS_BBOX_PADDING = 0.001
+
+
+@api_view(["GET", "POST"])
+def map_suggestions_view(request):
+    """
+    Existing maps that could be reused for a new route, ranked by the fraction
+    of the track they cover. The track is given as route_data in a POST or as
+    a ?bbox=west,south,east,north parameter.
+    """
+    if request.method == "POST":
+        arrays = validate_route_data(request.data.get("route_data"))
+        sampled = sample_indices(len(arrays.lats), MAP_SUGGESTIONS_MAX_POINTS)
+        lats, lons = arrays.lats[sampled], arrays.lons[sampled]
+        bbox = (lons.min(), lats.min(), lons.max(), lats.max())
+    else:
+        bbox = parse_bbox(request.query_params.get("bbox", ""))
+        lats, lons = bbox_sample_points(*bbox)
+    try:
+        min_coverage = float(request.query_params.get("min_coverage", 0.8))
+    except ValueError:
+        return Response(
+            {"min_coverage": "Expecting a float"}, status=status.HTTP_400_BAD_REQUEST
+        )
+
+    public_routes = Route.objects.filter(raster_map_id=OuterRef("pk"), is_private=False)
+    west, south, east, north = bbox
+    padding = MAP_SUGGESTIONS_BBOX_PADDING
+    # The candidates overlapping most of the track first, then the smallest
+    # maps, before keeping MAP_SUGGESTIONS_MAX_CANDIDATES of them
+    candidates = list(
+        filter_by_bbox(
+            RasterMap.objects.filter(
+                Q(uploader_id=request.user.id) | Exists(public_routes)
+            ),
+            bbox,
+        )
+        .alias(
+            overlap=bbox_overlap_area(
+                (west - padding, south - padding, east + padding, north + padding)
+            ),
+            area=bbox_area(),
+        )
+        .order_by("-overlap", "area")[:MAP_SUGGESTIONS_MAX_CANDIDATES]
+    )
+    if not candidates:
+        return Response([])
+    quads = [
+        [float(v) for v in raster_map.corners_coordinates.split(",")]
+        for raster_map in candidates
+    ]
+    coverages = quads_coverage(quads, lats, lons)
+    suggestions = []
+    for raster_map, coverage in zip(candidates, coverages.tolist()):
+        if coverage >= min_coverage:
+            raster_map.coverage = coverage
+            suggestions.append(raster_map)
+    suggestions.sort(key=lambda raster_map: -raster_map.coverage)
+    return Response(
+        MapSuggestionSerializer(
+            suggestions[:MAP_SUGGESTIONS_LIMIT],
+            many=True,
+            context={"request": request},
+        ).data
+    )
+
+
+MAP_MAX_CONTROLS = 100
+
+
+@api_view(["GET", "PUT"])
+def map_controls_view(request, uid):
+    """
+    Controls of the course printed on a map, from the start to the finish.
+    A PUT replaces them and recomputes the splits of the routes of the map.
+    """
+    if request.method == "GET":
+        raster_map = get_object_or_404(RasterMap, uid=uid)
+        return Response(MapControlSerializer(raster_map.controls.all(), many=True).data)
+    raster_map = get_object_or_404(RasterMap, uid=uid, uploader_id=request.user.id)
+    serializer = MapControlSerializer(data=request.data, many=True)
+    serializer.is_valid(raise_exception=True)
+    if len(serializer.validated_data) > MAP_MAX_CONTROLS:
+        raise ValidationError(f"A course has at most {MAP_MAX_CONTROLS} controls")
+    with transaction.atomic():
+        raster_map.controls.all().delete()
+        MapControl.objects.bulk_create(
+            MapControl(raster_map=raster_map, order=order, **control)
+            for order, control in enumerate(serializer.validated_data)
+        )
+        update_map_splits(raster_map.pk)
+    return Response(MapControlSerializer(raster_map.controls.all(), many=True).data)
+
+
+def nan_to_none(values, cast=float):
+    return [None if math.isnan(value) else cast(value) for value in values.tolist()]
+
+
+@api_view(["GET"])
+def map_splits_view(request, uid):
+    """
+    Split times of the visible routes of a map on its course, with their rank
+    on each leg, the fastest overall first
+    """
+    raster_map = get_object_or_404(RasterMap, uid=uid)
+    splits = list(
+        RouteSplits.objects.filter(raster_map=raster_map)
+        .filter(Q(route__athlete_id=request.user.id) | Q(route__is_private=False))
+        .select_related("route", "route__athlete")
+        .defer("route__route_json", "route__search_vector", "route__geometries")
+    )
+    controls = list(raster_map.controls.all())
+    legs, leg_ranks, totals, total_ranks = leg_comparison(
+        [route_splits.passages for route_splits in splits], len(controls)
+    )
+    results = [
+        {
+            "id": route_splits.route.uid,
+            "name": route_splits.route.name,
+            "athlete": UserInfoSerializer(route_splits.route.athlete).data,
+            "passages": route_splits.passages,
+            "legs": [
+                {"time": time, "rank": rank}
+                for time, rank in zip(
+                    nan_to_none(route_legs), nan_to_none(route_leg_ranks, int)
+                )
+            ],
+            "time": time,
+            "rank": rank,
+        }
+        for route_splits, route_legs, route_leg_ranks, time, rank in zip(
+            splits,
+            legs,
+            leg_ranks,
+            nan_to_none(totals),
+            nan_to_none(total_ranks, int),
+        )
+    ]
+    # Routes that missed a control last
+    results.sort(key=lambda result: (result["rank"] is None, result["rank"] or 0))
+    return Response(
+        {
+            "controls": MapControlSerializer(controls, many=True).data,
+            "routes": results,
+        }
+    )
+
+
+REPLAY_MAX_ROUTES = 50
+REPLAY_MAX_STEP = 60
+
+
+def replay_cache_key(uid, modification_date, step, aligned):
+    suffix = "_aligned" if aligned else ""
+    return f"replay_{uid}_{modification_date.timestamp()}_{step}{suffix}"
+
+
+@api_view(["GET"])
+def replay_view(request):
+    """
+    Tracks of the routes of a ?map= uid, or of the comma separated ?routes=
+    uids, resampled every ?step= seconds and encoded as polylines. The n-th
+    point of a track is its position offset + n steps after start_time, or
+    after its own start with ?align=start.
+    """
+    routes = Route.objects.filter(Q(athlete_id=request.user.id) | Q(is_private=False))
+    if map_uid := request.query_params.get("map"):
+        routes = routes.filter(raster_map__uid=map_uid)
+    elif uids := request.query_params.get("routes"):
+        routes = routes.filter(uid__in=uids.split(",")[:REPLAY_MAX_ROUTES])
+    else:
+        raise ValidationError("Expecting a map or a list of routes")
+    step = request.query_params.get("step", "5")
+    if not step.isdigit() or not 1 <= int(step) <= REPLAY_MAX_STEP:
+        raise ValidationError(
+            {"step": f"Expecting an integer between 1 and {REPLAY_MAX_STEP}"}
+        )
+    step = int(step)
+    aligned = request.query_params.get("align") == "start"
+
+    routes = list(
+        routes.select_related("athlete")
+        .defer("route_json")
+        .order_by("start_time")[:REPLAY_MAX_ROUTES]
+    )
+    cache_keys = {
+        route.id: replay_cache_key(route.uid, route.modification_date, step, aligned)
+        for route in routes
+    }
+    tracks = cache.get_many(cache_keys.values())
+    missing = [route.id for route in routes if cache_keys[route.id] not in tracks]
+    if missing:
+        computed = {}
+        for uid, modification_date, route_json in Route.objects.filter(
+            id__in=missing
+        ).values_list("uid", "modification_date", "route_json"):
+            resampled = resample(route_to_arrays(json.loads(route_json)), step, aligned)
+            if resampled is not None:
+                first, lats, lons = resampled
+                resampled = (first, encode_polyline(zip(lats.tolist(), lons.tolist())))
+            computed[replay_cache_key(uid, modification_date, step, aligned)] = (
+                resampled
+            )
+        cache.set_many(computed, 31 * 24 * 3600)
+        tracks.update(computed)
+
+    # Routes without time can not be replayed
+    routes = [route for route in routes if tracks.get(cache_keys[route.id])]
+    start_time = None
+    if routes and not aligned:
+        start_time = min(tracks[cache_keys[route.id]][0] for route in routes)
+    results = []
+    for route in routes:
+        first, geometry = tracks[cache_keys[route.id]]
+        results.append(
+            {
+                "id": route.uid,
+                "name": route.name,
+                "athlete": UserInfoSerializer(route.athlete).data,
+                "offset": 0 if aligned else round((first - start_time) / step),
+                "geometry": geometry,
+            }
+        )
+    return Response({"step": step, "start_time": start_time, "routes": results})
+
+
 class UserDetail(generics.RetrieveAPIView):
     serializer_class = UserMainSerializer
     lookup_field = "username"
@@ -261,6 +649,11 @@ class UserEditView(generics.RetrieveUpdateDestroyAPIView):
         return User.objects.none()
 
     def delete(self, request, *args, **kwargs):
+        from allauth.account import app_settings as allauth_settings
+        from allauth.account.adapter import get_adapter
+        from allauth.account.forms import default_token_generator
+        from allauth.account.utils import user_username
+
         token_generator = default_token_generator
         token_generator.key_salt = "AccountDeletionTokenGenerator"
         user = request.user
@@ -321,6 +714,32 @@ class RouteDetail(generics.RetrieveUpdateDestroyAPIView):
         return super().destroy(request, *args, **kwargs)
 
 
+SIMILAR_ROUTES_LIMIT = 10
+
+
+@api_view(["GET"])
+def similar_routes_view(request, uid):
+    """Public routes of other athletes following the same course as the route"""
+    route = get_object_or_404(
+        Route.objects.filter(Q(athlete_id=request.user.id) | Q(is_private=False)).defer(
+            "route_json"
+        ),
+        uid=uid,
+    )
+    routes = (
+        Route.objects.filter(is_private=False)
+        .exclude(athlete_id=route.athlete_id)
+        .select_related("athlete")
+    )
+    return Response(
+        SimilarRouteSerializer(
+            similar_routes(route, routes, SIMILAR_ROUTES_LIMIT),
+            many=True,
+            context={"request": request},
+        ).data
+    )
+
+
 @api_view(["GET"])
 def raster_map_download(request, uid, *args, **kwargs):
     rmap = get_object_or_404(
@@ -402,14 +821,64 @@ def map_og_thumbnail(request, uid, *args, **kwargs):
     return HttpResponse(image, content_type="image/jpeg")
 
 
+def heatmap_tile_response(athlete_id, zoom, x, y):
+    from project.utils.heatmap import (
+        HEATMAP_MAX_ZOOM,
+        HEATMAP_MIN_ZOOM,
+        decode_grid,
+        empty_png,
+        render_png,
+    )
+
+    if not (HEATMAP_MIN_ZOOM <= zoom <= HEATMAP_MAX_ZOOM) or max(x, y) >= 2**zoom:
+        raise Http404()
+    tile = (
+        HeatmapTile.objects.filter(athlete_id=athlete_id, zoom=zoom, tile_x=x, tile_y=y)
+        .only("id", "modification_date")
+        .first()
+    )
+    if tile is None:
+        image = empty_png()
+    else:
+        cache_key = f"heatmap_{tile.id}_{tile.modification_date.timestamp()}"
+        image = cache.get(cache_key)
+        if image is None:
+            image = render_png(decode_grid(tile.data))
+            cache.set(cache_key, image, 3600 * 24)
+    response = HttpResponse(image, content_type="image/png")
+    response["Cache-Control"] = "public, max-age=600"
+    return response
+
+
+@api_view(["GET"])
+def heatmap_tile(request, zoom, x, y):
+    return heatmap_tile_response(None, zoom, x, y)
+
+
+@api_view(["GET"])
+def user_heatmap_tile(request, username, zoom, x, y):
+    user = get_object_or_404(User, username__iexact=username)
+    return heatmap_tile_response(user.id, int(zoom), int(x), int(y))
+
+
+ACCEPTS_GZIP_RE = re.compile(r"\bgzip\b")
+
+
 @api_view(["GET"])
 def gpx_download(request, uid, *args, **kwargs):
     route = get_object_or_404(
         Route.objects.filter(Q(athlete_id=request.user.id) | Q(is_private=False)),
         uid=uid,
     )
-    gpx_data = route.gpx
-    response = HttpResponse(gpx_data, content_type="application/gpx+xml")
+    chunks = (chunk.encode() for chunk in gpx_chunks(route.route))
+    if ACCEPTS_GZIP_RE.search(request.META.get("HTTP_ACCEPT_ENCODING", "")):
+        response = StreamingHttpResponse(
+            compress_sequence(chunks), content_type="application/gpx+xml"
+        )
+        response["Content-Encoding"] = "gzip"
+    else:
+        response = StreamingHttpResponse(chunks, content_type="application/gpx+xml")
+    patch_vary_headers(response, ("Accept-Encoding",))
     filename = f"{route.name}.gpx"
     response["Content-Disposition"] = (
         f"attachment; filename*=UTF-8''{encode_filename(filename)}"
@@ -417,9 +886,240 @@ def gpx_download(request, uid, *args, **kwargs):
     return response
 
 
+def date_query_param(request, name):
+    value = request.query_params.get(name)
+    if not value:
+        return None
+    try:
+        date = parse_date(value)
+    except ValueError:
+        date = None
+    if date is None:
+        raise ValidationError({name: "Expecting a YYYY-MM-DD date"})
+    return date
+
+
+@api_view(["GET"])
+def athlete_stats_view(request, username):
+    """
+    Route count, distance and duration of an athlete per ?period= (day, week,
+    month or year) starting between ?start= and ?end=, private routes are
+    only counted for the athlete themselves.
+    """
+    athlete = get_object_or_404(User, username__iexact=username)
+    period = request.query_params.get("period", "month")
+    if period not in AthleteStat.PERIODS:
+        raise ValidationError(
+            {"period": f"Expecting one of {', '.join(AthleteStat.PERIODS)}"}
+        )
+    stats = AthleteStat.objects.filter(athlete=athlete, period=period)
+    if athlete.id != request.user.id:
+        stats = stats.filter(is_private=False)
+    if start := date_query_param(request, "start"):
+        stats = stats.filter(period_start__gte=start)
+    if end := date_query_param(request, "end"):
+        stats = stats.filter(period_start__lte=end)
+    rows = (
+        stats.values("period_start")
+        .annotate(
+            total_route_count=Sum("route_count"),
+            total_distance=Sum("distance"),
+            total_duration=Sum("duration"),
+        )
+        .order_by("period_start")
+    )
+    return Response(
+        [
+            {
+                "period_start": row["period_start"],
+                "route_count": row["total_route_count"],
+                "distance": row["total_distance"],
+                "duration": row["total_duration"],
+            }
+            for row in rows
+        ]
+    )
+
+
+ATHLETE_ROUTES_MAX_DAYS = 366
+
+
+@api_view(["GET"])
+def athlete_routes_view(request, username):
+    """
+    Routes of an athlete grouped by local calendar day, from ?start= to ?end=
+    (inclusive, defaults to ?start=)
+    """
+    athlete = get_object_or_404(User, username__iexact=username)
+    start = date_query_param(request, "start")
+    if start is None:
+        raise ValidationError({"start": "This parameter is required"})
+    end = date_query_param(request, "end") or start
+    if end < start:
+        raise ValidationError({"end": "Must not be before start"})
+    if (end - start).days >= ATHLETE_ROUTES_MAX_DAYS:
+        raise ValidationError(
+            {"end": f"At most {ATHLETE_ROUTES_MAX_DAYS} days can be requested"}
+        )
+    routes = Route.objects.filter(
+        athlete=athlete, start_time__range=local_days_utc_range(start, end)
+    ).defer("route_json", "search_vector")
+    if athlete.id != request.user.id:
+        routes = routes.filter(is_private=False)
+    days = defaultdict(list)
+    for route in routes.order_by("start_time"):
+        day = local_date(route.start_time, route.tz)
+        if start <= day <= end:
+            days[day].append(route)
+    return Response(
+        [
+            {
+                "date": day,
+                "routes": UserRouteListSerializer(
+                    days[day], many=True, context={"request": request}
+                ).data,
+            }
+            for day in sorted(days)
+        ]
+    )
+
+
+@api_view(["GET"])
+def athlete_calendar_view(request, username, year, month):
+    """Route count, distance and duration of each local day of a month"""
+    athlete = get_object_or_404(User, username__iexact=username)
+    try:
+        first_day = date(int(year), int(month), 1)
+    except ValueError:
+        raise Http404("No such month")
+    last_day = first_day.replace(
+        day=calendar.monthrange(first_day.year, first_day.month)[1]
+    )
+    stats = AthleteStat.objects.filter(
+        athlete=athlete,
+        period="day",
+        period_start__range=(first_day, last_day),
+    )
+    if athlete.id != request.user.id:
+        stats = stats.filter(is_private=False)
+    totals = {
+        row["period_start"]: row
+        for row in stats.values("period_start").annotate(
+            total_route_count=Sum("route_count"),
+            total_distance=Sum("distance"),
+            total_duration=Sum("duration"),
+        )
+    }
+    days = []
+    for day in range(1, last_day.day + 1):
+        row = totals.get(first_day.replace(day=day), {})
+        days.append(
+            {
+                "date": first_day.replace(day=day),
+                "route_count": row.get("total_route_count", 0),
+                "distance": row.get("total_distance", 0),
+                "duration": row.get("total_duration", 0),
+            }
+        )
+    return Response(days)
+
+
+def export_cursor(route):
+    """Value of ?after= resuming an export after this route"""
+    start_time = route.start_time.astimezone(timezone.utc)
+    return f"{start_time:%Y-%m-%dT%H:%M:%S.%fZ},{route.uid}"
+
+
+def route_export_entries(routes):
+    """ZIP entries of the GPX, metadata and map of each route"""
+    exported_maps = set()
+    for route in routes:
+        folder = f"routes/{route.start_time:%Y-%m-%d_%H%M%S}_{route.uid}"
+        date_time = route.start_time.timetuple()[:6]
+        raster_map = route.raster_map
+        map_file = None
+        if raster_map:
+            map_file = f"maps/{raster_map.uid}.{raster_map.mime_type[6:]}"
+        metadata = {
+            "id": route.uid,
+            "name": route.name,
+            "start_time": route.start_time,
+            "tz": route.tz,
+            "country": route.country,
+            "distance": route.distance,
+            "duration": route.duration,
+            "comment": route.comment,
+            "is_private": route.is_private,
+            "map_file": map_file,
+            "map_bounds": raster_map.bounds if raster_map else None,
+            "export_cursor": export_cursor(route),
+        }
+        yield (
+            f"{folder}/route.gpx",
+            date_time,
+            zipfile.ZIP_DEFLATED,
+            (chunk.encode() for chunk in gpx_chunks(route.route)),
+        )
+        yield (
+            f"{folder}/route.json",
+            date_time,
+            zipfile.ZIP_DEFLATED,
+            [json.dumps(metadata, cls=DjangoJSONEncoder, indent=2).encode()],
+        )
+        if map_file and raster_map.pk not in exported_maps:
+            exported_maps.add(raster_map.pk)
+            # Images are already compressed
+            yield (
+                map_file,
+                raster_map.creation_date.timetuple()[:6],
+                zipfile.ZIP_STORED,
+                iter_s3_object(settings.AWS_S3_BUCKET, raster_map.path),
+            )
+
+
+@api_view(["GET"])
+@login_required
+def export_view(request):
+    """
+    ZIP archive of the routes of the user, with their GPX, metadata and map,
+    streamed as it is built. The routes are exported in the order they
+    started, an interrupted export can be resumed with ?after= set to the
+    export_cursor of the last route.json received.
+    """
+    routes = Route.objects.filter(athlete_id=request.user.id).select_related(
+        "raster_map"
+    )
+    if after := request.query_params.get("after"):
+        after_time, _, after_uid = after.partition(",")
+        try:
+            after_time = parse_datetime(after_time)
+        except ValueError:
+            after_time = None
+        if after_time is None:
+            raise ValidationError(
+                {"after": "Expecting an export cursor or an ISO 8601 date time"}
+            )
+        after_routes = Q(start_time__gt=after_time)
+        if after_uid:
+            # Routes starting at the same time are ordered by uid
+            after_routes |= Q(start_time=after_time, uid__gt=after_uid)
+        routes = routes.filter(after_routes)
+    routes = routes.order_by("start_time", "uid").iterator(chunk_size=50)
+    response = StreamingHttpResponse(
+        zip_stream(route_export_entries(routes)), content_type="application/zip"
+    )
+    filename = f"mapdump-{request.user.username}.zip"
+    response["Content-Disposition"] = (
+        f"attachment; filename*=UTF-8''{encode_filename(filename)}"
+    )
+    return response
+
+
 @api_view(["GET"])
 @login_required
 def strava_authorize(request):
+    from stravalib import Client as StravaClient
+
     code = request.GET.get("code")
     scopes = request.GET.get("scope", "").split(",")
     if not code or "activity:read_all" not in scopes or "activity:write" not in scopes:
@@ -443,6 +1143,8 @@ def strava_authorize(request):
 @api_view(["GET"])
 @login_required
 def strava_access_token(request):
+    from stravalib import Client as StravaClient
+
     user_settings = request.user.settings
     if user_settings.strava_access_token:
         token = json.loads(user_settings.strava_access_token)
@@ -478,6 +1180,8 @@ def strava_access_token(request):
 @api_view(["POST"])
 @login_required
 def strava_deauthorize(request):
+    from stravalib import Client as StravaClient
+
     user_settings = request.user.settings
     if user_settings.strava_access_token:
         token = json.loads(user_settings.strava_access_token)
@@ -495,13 +1199,23 @@ def strava_deauthorize(request):
 @login_required
 def give_like_view(request, uid):
     route = get_object_or_404(Route.objects.exclude(athlete=request.user), uid=uid)
-    like, created = ThumbUp.objects.get_or_create(
-        route_id=route.id,
-        user_id=request.user.id,
-    )
-    if not created:
-        like.delete()
-        return Response({"deleted": True})
+    with transaction.atomic():
+        deleted, _ = ThumbUp.objects.filter(
+            route_id=route.id,
+            user_id=request.user.id,
+        ).delete()
+        if deleted:
+            return Response({"deleted": True})
+        try:
+            with transaction.atomic():
+                ThumbUp.objects.create(
+                    route_id=route.id,
+                    user_id=request.user.id,
+                    recipient_id=route.athlete_id,
+                )
+        except IntegrityError:
+            # A concurrent request already created it
+            pass
     return Response({"created": True})
 
 
@@ -510,11 +1224,13 @@ def give_like_view(request, uid):
 def give_comment_view(request, uid):
     route = get_object_or_404(Route.objects.exclude(athlete=request.user), uid=uid)
     message = request.data.get("message")
-    c = Comment.objects.create(
-        route_id=route.id,
-        user_id=request.user.id,
-        message=message,
-    )
+    with transaction.atomic():
+        c = Comment.objects.create(
+            route_id=route.id,
+            user_id=request.user.id,
+            recipient_id=route.athlete_id,
+            message=message,
+        )
     return Response({"created": True, "id": c.id})
 
 
@@ -524,23 +1240,32 @@ def edit_comment_view(request, route_uid, comment_id):
     comment = get_object_or_404(
         Comment, id=comment_id, user_id=request.user.id, route__uid=route_uid
     )
-    comment.delete()
+    with transaction.atomic():
+        comment.delete()
     return Response({"deleted": True})
 
 
+NOTIFICATIONS_LIMIT = 100
+
+
+def unread_notifications(model, user, since):
+    qs = model.objects.filter(recipient_id=user.id)
+    if since:
+        qs = qs.filter(creation_date__gt=since)
+    return qs
+
+
 @api_view(["GET", "POST"])
 @login_required
 def likes_received_view(request):
     settings, _ = UserSettings.objects.get_or_create(user=request.user)
     if request.method == "POST":
-        settings.date_fetched_likes = arrow.utcnow().datetime
+        settings.date_fetched_likes = now()
         settings.save(update_fields=["date_fetched_likes"])
         return Response({"ok": "ok"})
-    likes = ThumbUp.objects.select_related("user", "route").filter(
-        route__athlete_id=request.user.id
-    )
-    if since := settings.date_fetched_likes:
-        likes = likes.filter(creation_date__gt=since)
+    likes = unread_notifications(
+        ThumbUp, request.user, settings.date_fetched_likes
+    ).select_related("user", "route")[:NOTIFICATIONS_LIMIT]
     return Response(
         [
             {
@@ -557,14 +1282,12 @@ def likes_received_view(request):
 def comments_received_view(request):
     settings, _ = UserSettings.objects.get_or_create(user=request.user)
     if request.method == "POST":
-        settings.date_fetched_likes = arrow.utcnow().datetime
-        settings.save(update_fields=["date_fetched_likes"])
+        settings.date_fetched_comments = now()
+        settings.save(update_fields=["date_fetched_comments"])
         return Response({"ok": "ok"})
-    comments = Comment.objects.select_related("user", "route").filter(
-        route__athlete_id=request.user.id
-    )
-    if since := settings.date_fetched_likes:
-        comments = comments.filter(creation_date__gt=since)
+    comments = unread_notifications(
+        Comment, request.user, settings.date_fetched_comments
+    ).select_related("user", "route")[:NOTIFICATIONS_LIMIT]
     return Response(
         [
             {
@@ -580,6 +1303,69 @@ def comments_received_view(request):
     )
 
 
+class NotificationsPagination(CursorPagination):
+    page_size = 25
+    ordering = "-creation_date"
+
+
+class NotificationsList(generics.ListAPIView):
+    """
+    Cursor paginated notifications received on the user routes, newest first.
+    Only the unread ones with ?unread=1, POST to mark them all as read.
+    """
+
+    permission_classes = (IsAuthenticated,)
+    pagination_class = NotificationsPagination
+    model = None
+    read_marker_field = None
+
+    def get_user_settings(self):
+        s, _ = UserSettings.objects.get_or_create(user=self.request.user)
+        return s
+
+    def get_queryset(self):
+        since = None
+        if self.request.query_params.get("unread"):
+            since = getattr(self.get_user_settings(), self.read_marker_field)
+        return unread_notifications(
+            self.model, self.request.user, since
+        ).select_related("user", "route")
+
+    def post(self, request, *args, **kwargs):
+        user_settings = self.get_user_settings()
+        setattr(user_settings, self.read_marker_field, now())
+        user_settings.save(update_fields=[self.read_marker_field])
+        return Response({"ok": "ok"})
+
+
+class LikesNotificationsList(NotificationsList):
+    serializer_class = LikeNotificationSerializer
+    model = ThumbUp
+    read_marker_field = "date_fetched_likes"
+
+
+class CommentsNotificationsList(NotificationsList):
+    serializer_class = CommentNotificationSerializer
+    model = Comment
+    read_marker_field = "date_fetched_comments"
+
+
+@api_view(["GET"])
+@login_required
+def unread_notifications_count_view(request):
+    settings, _ = UserSettings.objects.get_or_create(user=request.user)
+    return Response(
+        {
+            "likes": unread_notifications(
+                ThumbUp, request.user, settings.date_fetched_likes
+            )[:NOTIFICATIONS_LIMIT].count(),
+            "comments": unread_notifications(
+                Comment, request.user, settings.date_fetched_comments
+            )[:NOTIFICATIONS_LIMIT].count(),
+        }
+    )
+
+
 def index_view(request):
     return render(request, "frontend/index.html")
 
@@ -611,6 +1397,8 @@ def athlete_avatar(request, athlete_username):
 
 
 def athlete_day_view(request, athlete_username, date):
+    import arrow
+
     athlete = get_object_or_404(User, username__iexact=athlete_username)
     date_raw = date
     date = arrow.get(date_raw).format("dddd, MMMM D, YYYY")
@@ -622,6 +1410,8 @@ def athlete_day_view(request, athlete_username, date):
 
 
 def strava_get_gpx(request):
+    import requests
+
     aid = request.GET.get("id")
     auth = request.GET.get("auth")
     if not (aid and auth):
@@ -0,0 +1,136 @@
+import threading
+from collections import OrderedDict
+
+# Coordinates are rounded to this many decimals before being looked up, 3
+# decimals is a ~100m grid which is well below the resolution of both the
+# timezone polygons simplification and the reverse geocoder cities database.
+GRID_PRECISION = 3
+CACHE_SIZE = 65536
+
+
+class _LRUCache:
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+            except KeyError:
+                return default
+            return self._data[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class GeoLookup:
+    """
+    Process wide timezone and country lookups.
+
+    The timezone polygons and the reverse geocoder KD-tree are loaded only once
+    per process, on first use or when calling `warm`, and results are memoized
+    on a grid of `precision` decimals.
+    """
+
+    def __init__(self, precision=GRID_PRECISION, cache_size=CACHE_SIZE):
+        self.precision = precision
+        self._tz_finder = None
+        self._geocoder = None
+        self._load_lock = threading.Lock()
+        self._tz_cache = _LRUCache(cache_size)
+        self._country_cache = _LRUCache(cache_size)
+
+    @property
+    def tz_finder(self):
+        if self._tz_finder is None:
+            with self._load_lock:
+                if self._tz_finder is None:
+                    from timezonefinder import TimezoneFinder
+
+                    self._tz_finder = TimezoneFinder()
+        return self._tz_finder
+
+    @property
+    def geocoder(self):
+        if self._geocoder is None:
+            with self._load_lock:
+                if self._geocoder is None:
+                    from reverse_geocoder import RGeocoder
+
+                    # Single process mode, the multiprocess KD-tree spawns a
+                    # pool on every query which costs more than the query.
+                    self._geocoder = RGeocoder(mode=1, verbose=False)
+        return self._geocoder
+
+    def warm(self):
+        _ = self.tz_finder
+        _ = self.geocoder
+
+    def clear(self):
+        self._tz_cache.clear()
+        self._country_cache.clear()
+
+    def _quantize(self, lats, lngs):
+        import numpy as np
+
+        lats = np.round(np.asarray(lats, dtype=np.float64), self.precision)
+        lngs = np.round(np.asarray(lngs, dtype=np.float64), self.precision)
+        return lats, lngs
+
+    def _unique_cells(self, lats, lngs):
+        import numpy as np
+
+        lats, lngs = self._quantize(lats, lngs)
+        cells, inverse = np.unique(
+            np.column_stack((lats, lngs)).reshape(-1, 2), axis=0, return_inverse=True
+        )
+        return cells, inverse.reshape(-1)
+
+    def timezones_at(self, lats, lngs):
+        """Return the timezone name, or None, for each of the given points"""
+        cells, inverse = self._unique_cells(lats, lngs)
+        results = []
+        for lat, lng in cells.tolist():
+            key = (lat, lng)
+            tz = self._tz_cache.get(key, False)
+            if tz is False:
+                tz = self.tz_finder.timezone_at(lng=lng, lat=lat)
+                self._tz_cache.set(key, tz)
+            results.append(tz)
+        return [results[i] for i in inverse]
+
+    def countries_at(self, lats, lngs):
+        """Return the country code of each of the given points"""
+        cells, inverse = self._unique_cells(lats, lngs)
+        keys = [tuple(cell) for cell in cells.tolist()]
+        results = [self._country_cache.get(key) for key in keys]
+        missing = [i for i, cc in enumerate(results) if cc is None]
+        if missing:
+            locations = self.geocoder.query(cells[missing])
+            for i, location in zip(missing, locations):
+                results[i] = location.get("cc")
+                self._country_cache.set(keys[i], results[i])
+        return [results[i] for i in inverse]
+
+    def timezone_at(self, lat, lng):
+        return self.timezones_at([lat], [lng])[0]
+
+    def country_at(self, lat, lng):
+        return self.countries_at([lat], [lng])[0]
+
+
+geo_lookup = GeoLookup()
@@ -1,8 +1,11 @@
 import math
 
+MAX_LATITUDE = 85.0511287798
+
 
 class GlobalMercator(object):
-    def __init__(self):
+    def __init__(self, tile_size=256):
+        self.tile_size = tile_size
         self.originShift = 2 * math.pi * 6378137 / 2.0
         # 20037508.342789244
 
@@ -37,3 +40,73 @@ class GlobalMercator(object):
             * (2 * math.atan(math.exp(lat * math.pi / 180.0)) - math.pi / 2.0)
         )
         return {"lat": lat, "lng": lon}
+
+    def resolution(self, zoom):
+        """Meters per pixel at the given zoom level"""
+        return 2 * self.originShift / (self.tile_size * 2**zoom)
+
+    def meters_to_pixels(self, mxy, zoom):
+        """
+        Converts EPSG:900913 to pixel coordinates at the given zoom level,
+        origin being the top left corner of the world as in XYZ tiles
+        """
+        res = self.resolution(zoom)
+        px = (mxy["x"] + self.originShift) / res
+        py = (self.originShift - mxy["y"]) / res
+        return {"x": px, "y": py}
+
+    def pixels_to_meters(self, pxy, zoom):
+        res = self.resolution(zoom)
+        mx = pxy["x"] * res - self.originShift
+        my = self.originShift - pxy["y"] * res
+        return {"x": mx, "y": my}
+
+    def latlon_to_pixels(self, latlon, zoom):
+        lat = min(max(latlon["lat"], -MAX_LATITUDE), MAX_LATITUDE)
+        return self.meters_to_pixels(
+            self.latlon_to_meters({"lat": lat, "lng": latlon["lng"]}), zoom
+        )
+
+    def latlons_to_pixels(self, lats, lons, zoom):
+        """Vectorized latlon_to_pixels, returns the px and py arrays"""
+        import numpy as np
+
+        lats = np.clip(np.asarray(lats, dtype=np.float64), -MAX_LATITUDE, MAX_LATITUDE)
+        lons = np.asarray(lons, dtype=np.float64)
+        res = self.resolution(zoom)
+        mx = lons * self.originShift / 180.0
+        my = np.log(np.tan((90 + lats) * math.pi / 360.0)) / (math.pi / 180.0)
+        my = my * self.originShift / 180.0
+        return (mx + self.originShift) / res, (self.originShift - my) / res
+
+    def latlon_to_tile(self, latlon, zoom):
+        """XYZ tile containing the given lat/lon at the given zoom level"""
+        pxy = self.latlon_to_pixels(latlon, zoom)
+        last = 2**zoom - 1
+        tx = min(max(int(pxy["x"] // self.tile_size), 0), last)
+        ty = min(max(int(pxy["y"] // self.tile_size), 0), last)
+        return {"x": tx, "y": ty}
+
+    def tile_bounds(self, txy, zoom):
+        """Lat/lon bounds of the given XYZ tile"""
+        north_west = self.meters_to_latlon(
+            self.pixels_to_meters(
+                {"x": txy["x"] * self.tile_size, "y": txy["y"] * self.tile_size},
+                zoom,
+            )
+        )
+        south_east = self.meters_to_latlon(
+            self.pixels_to_meters(
+                {
+                    "x": (txy["x"] + 1) * self.tile_size,
+                    "y": (txy["y"] + 1) * self.tile_size,
+                },
+                zoom,
+            )
+        )
+        return {
+            "north": north_west["lat"],
+            "south": south_east["lat"],
+            "east": south_east["lng"],
+            "west": north_west["lng"],
+        }
@@ -3,11 +3,9 @@ from __future__ import unicode_literals
 import calendar
 import re
 from bisect import bisect_left, bisect_right
-from datetime import datetime
+from datetime import datetime, timezone
 from decimal import Decimal
 
-from django.utils.timezone import utc
-
 YEAR2010 = 1262304000
 
 
@@ -49,6 +47,35 @@ def decode_signed_number(encoded):
         return result >> 1, encoded_out
 
 
+def encode_polyline(latlons):
+    """Encode [lat, lon] pairs with a precision of 1e-5 degree"""
+    encoded = ""
+    prev_lat = 0
+    prev_lon = 0
+    for lat, lon in latlons:
+        lat = int(round(lat * 1e5))
+        lon = int(round(lon * 1e5))
+        encoded += encode_signed_number(lat - prev_lat) + encode_signed_number(
+            lon - prev_lon
+        )
+        prev_lat = lat
+        prev_lon = lon
+    return encoded
+
+
+def decode_polyline(encoded):
+    latlons = []
+    lat = 0
+    lon = 0
+    while len(encoded) > 0:
+        lat_d, encoded = decode_signed_number(encoded)
+        lon_d, encoded = decode_signed_number(encoded)
+        lat += lat_d
+        lon += lon_d
+        latlons.append([lat / 1e5, lon / 1e5])
+    return latlons
+
+
 class GeoCoordinates(object):
     repr_re = re.compile(
         r"^(?P<latitude>^\-?\d{1,2}(\.\d+)?)," r"(?P<longitude>\-?1?\d{1,2}(\.\d+)?$)"
@@ -137,7 +164,7 @@ class GeoLocation(object):
             )
 
     def get_datetime(self):
-        return datetime.fromtimestamp(self._timestamp, utc)
+        return datetime.fromtimestamp(self._timestamp, timezone.utc)
 
     def get_timestamp(self):
         return self._timestamp
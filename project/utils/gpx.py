@@ -0,0 +1,56 @@
+from datetime import datetime, timezone
+
+# Same output as gpxpy.gpx.GPX.to_xml() for a single track segment
+GPX_HEADER = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<gpx xmlns="http://www.topografix.com/GPX/1/1" '
+    'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+    'xsi:schemaLocation="http://www.topografix.com/GPX/1/1 '
+    'http://www.topografix.com/GPX/1/1/gpx.xsd" '
+    'version="1.1" creator="{creator}">\n'
+    "  <trk>\n"
+    "    <trkseg>"
+)
+GPX_FOOTER = "\n    </trkseg>\n  </trk>\n</gpx>"
+
+
+def format_number(value):
+    """
+    As gpxpy.utils.make_str, scientific notation is not valid in GPX. Zero
+    coordinates are written 0, GPXTrackPoint replaces falsy ones by the int 0
+    """
+    if not value:
+        return "0"
+    result = str(value)
+    if isinstance(value, float) and "e" in result:
+        return format(value, ".10f").rstrip("0").rstrip(".")
+    return result
+
+
+def format_time(timestamp):
+    return (
+        datetime.fromtimestamp(timestamp, timezone.utc)
+        .isoformat()
+        .replace("+00:00", "Z")
+    )
+
+
+def gpx_chunks(route, creator="Mapdump.com", chunk_size=1000):
+    """
+    Yield the GPX document of a list of {"time": ..., "latlon": [lat, lon]}
+    points in chunks of chunk_size points
+    """
+    yield GPX_HEADER.format(creator=creator)
+    for start in range(0, len(route), chunk_size):
+        chunk = []
+        for point in route[start : start + chunk_size]:
+            lat, lon = point["latlon"]
+            chunk.append(
+                f'\n      <trkpt lat="{format_number(lat)}" '
+                f'lon="{format_number(lon)}">'
+            )
+            if point["time"]:
+                chunk.append(f"\n        <time>{format_time(point['time'])}</time>")
+            chunk.append("\n      </trkpt>")
+        yield "".join(chunk)
+    yield GPX_FOOTER
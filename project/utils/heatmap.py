@@ -0,0 +1,104 @@
+import functools
+import zlib
+from io import BytesIO
+
+import numpy as np
+
+from project.utils.globalmaptiles import GlobalMercator
+
+TILE_SIZE = 256
+HEATMAP_MIN_ZOOM = 0
+HEATMAP_MAX_ZOOM = 14
+# Segments longer than this many pixels at the max zoom level (~2.4km at the
+# equator) are gaps in the recording and are not drawn
+MAX_SEGMENT_PIXELS = 256
+# Number of routes through a pixel at which its color saturates
+SATURATION_COUNT = 64
+
+GRID_DTYPE = np.dtype("<u4")
+
+mercator = GlobalMercator(tile_size=TILE_SIZE)
+
+
+def route_pixels(lats, lons, zoom):
+    """
+    Global pixel coordinates, at the given zoom level, of the pixels crossed by
+    the track, each pixel appearing only once.
+    """
+    px, py = mercator.latlons_to_pixels(lats, lons, zoom)
+    if len(px) > 1:
+        dx, dy = np.diff(px), np.diff(py)
+        steps = np.ceil(np.maximum(np.abs(dx), np.abs(dy))).astype(np.int64)
+        max_steps = MAX_SEGMENT_PIXELS >> (HEATMAP_MAX_ZOOM - zoom)
+        steps[steps > max(max_steps, 1)] = 0
+        segments = np.repeat(np.arange(len(steps)), steps)
+        offsets = np.arange(len(segments)) - np.repeat(np.cumsum(steps) - steps, steps)
+        t = offsets / np.repeat(np.maximum(steps, 1), steps)
+        px = np.concatenate((px, px[segments] + t * dx[segments]))
+        py = np.concatenate((py, py[segments] + t * dy[segments]))
+    world_size = TILE_SIZE << zoom
+    x = np.clip(np.floor(px).astype(np.int64), 0, world_size - 1)
+    y = np.clip(np.floor(py).astype(np.int64), 0, world_size - 1)
+    keys = np.unique(y * world_size + x)
+    return keys % world_size, keys // world_size
+
+
+def route_tiles(lats, lons, zoom):
+    """
+    Split the pixels of a track by tile, yields (tile_x, tile_y, pixels) where
+    pixels are indices in the flattened TILE_SIZE x TILE_SIZE grid of the tile
+    """
+    x, y = route_pixels(lats, lons, zoom)
+    tile_keys = (y // TILE_SIZE) * (1 << zoom) + x // TILE_SIZE
+    local = (y % TILE_SIZE) * TILE_SIZE + x % TILE_SIZE
+    order = np.argsort(tile_keys, kind="stable")
+    tile_keys, local = tile_keys[order], local[order]
+    keys, starts = np.unique(tile_keys, return_index=True)
+    for key, pixels in zip(keys.tolist(), np.split(local, starts[1:])):
+        yield key % (1 << zoom), key // (1 << zoom), pixels
+
+
+def empty_grid():
+    return np.zeros(TILE_SIZE * TILE_SIZE, dtype=GRID_DTYPE)
+
+
+def encode_grid(grid):
+    return zlib.compress(np.ascontiguousarray(grid, dtype=GRID_DTYPE).tobytes())
+
+
+def decode_grid(data):
+    if not data:
+        return empty_grid()
+    return np.frombuffer(zlib.decompress(data), dtype=GRID_DTYPE).copy()
+
+
+def _palette():
+    """Transparent, red, yellow, white color ramp with 256 entries"""
+    v = np.linspace(0, 1, 256)
+    red = np.clip(v * 3, 0, 1)
+    green = np.clip(v * 3 - 1, 0, 1)
+    blue = np.clip(v * 3 - 2, 0, 1)
+    alpha = np.clip(v * 4, 0, 1)
+    palette = np.column_stack((red, green, blue, alpha)) * 255
+    palette[0] = 0
+    return palette.round().astype(np.uint8)
+
+
+PALETTE = _palette()
+
+
+@functools.cache
+def empty_png():
+    return render_png(empty_grid())
+
+
+def render_png(grid):
+    from PIL import Image
+
+    counts = np.asarray(grid, dtype=np.float64).reshape(TILE_SIZE, TILE_SIZE)
+    intensity = np.log1p(counts) / np.log1p(SATURATION_COUNT)
+    levels = np.clip(np.ceil(intensity * 255), 0, 255).astype(np.uint8)
+    image = Image.fromarray(PALETTE[levels], "RGBA")
+    out = BytesIO()
+    image.save(out, "PNG", optimize=True)
+    return out.getvalue()
@@ -3,24 +3,21 @@ import secrets
 import struct
 import time
 
-import requests
-import reverse_geocoder
 from django.utils.dateparse import parse_datetime
 from django.utils.timezone import is_aware, make_aware
-from timezonefinder import TimezoneFinder
 
+from project.utils.geo import geo_lookup
 from project.utils.globalmaptiles import GlobalMercator
 from project.utils.random_strings import generate_random_string
 from project.utils.validators import validate_nice_slug
 
 
 def tz_at_coords(lat, lng):
-    tf = TimezoneFinder()
-    return tf.timezone_at(lng=lng, lat=lat)
+    return geo_lookup.timezone_at(lat, lng)
 
 
 def country_at_coords(lat, lng):
-    return reverse_geocoder.search((lat, lng))[0].get("cc")
+    return geo_lookup.country_at(lat, lng)
 
 
 def get_aware_datetime(date_str):
@@ -57,6 +54,8 @@ def short_random_key():
 
 
 def get_country_from_coords(lat, lon):
+    import requests
+
     api_url = "http://api.geonames.org/countryCode"
     values = {"type": "json", "lat": lat, "lng": lon, "username": "rphl", "radius": 1}
     try:
@@ -0,0 +1,388 @@
+from collections import namedtuple
+from itertools import chain
+
+import numpy as np
+
+from project.utils.globalmaptiles import GlobalMercator
+from project.utils.gps_data_encoder import YEAR2010, encode_polyline
+
+EARTH_RADIUS = 6378137
+# Tolerance, in meters, of the simplified geometries of a route by level of
+# detail
+DETAIL_TOLERANCES = {"low": 50, "medium": 10, "high": 2}
+# Zoom level of the web mercator tiles making the signature of a route, about
+# 1.2 km wide at the equator
+SIGNATURE_ZOOM = 15
+# Types of the values of the route data posted by the clients
+ROUTE_TIME_TYPES = {type(None), int, float}
+ROUTE_COORDINATE_TYPES = {int, float}
+# Columnar binary encoding of a route, see encode_route_columns
+ROUTE_COLUMNS_MAGIC = b"MDR1"
+ROUTE_COLUMNS_SCALE = 1e7
+
+# With 1 pixel wide tiles, pixel coordinates are tile coordinates
+tiles_mercator = GlobalMercator(tile_size=1)
+
+RouteArrays = namedtuple("RouteArrays", ("times", "lats", "lons"))
+
+
+def route_to_arrays(route):
+    """
+    Convert a list of {"time": ..., "latlon": [lat, lon]} points into columns,
+    missing times are NaN.
+    """
+    times = np.array(
+        [np.nan if p["time"] is None else p["time"] for p in route], dtype=np.float64
+    )
+    latlons = np.array([p["latlon"] for p in route], dtype=np.float64).reshape(-1, 2)
+    return RouteArrays(times, latlons[:, 0], latlons[:, 1])
+
+
+def route_distance(arrays):
+    """Length in meters of the track, haversine between consecutive points"""
+    lats, lons = np.radians(arrays.lats), np.radians(arrays.lons)
+    a = (
+        np.sin(np.diff(lats) / 2) ** 2
+        + np.cos(lats[1:]) * np.cos(lats[:-1]) * np.sin(np.diff(lons) / 2) ** 2
+    )
+    return float(np.sum(2 * EARTH_RADIUS * np.arctan2(np.sqrt(a), np.sqrt(1 - a))))
+
+
+def route_duration(arrays):
+    """Seconds from the first point to the last timed one"""
+    return np.nanmax(arrays.times).item() - arrays.times[0].item()
+
+
+def arrays_bounds(arrays):
+    return {
+        "north": float(arrays.lats.max()),
+        "south": float(arrays.lats.min()),
+        "east": float(arrays.lons.max()),
+        "west": float(arrays.lons.min()),
+    }
+
+
+def quads_coverage(quads, lats, lons):
+    """
+    Fraction of the points lying inside each of the convex quadrilaterals.
+
+    quads has a shape of (n_quads, 4, 2), corners being [lat, lon] pairs given
+    in clockwise or counterclockwise order.
+    """
+    quads = np.asarray(quads, dtype=np.float64).reshape(-1, 4, 2)
+    points = np.column_stack((lats, lons))
+    start = quads[:, :, np.newaxis, :]
+    edge = np.roll(quads, -1, axis=1)[:, :, np.newaxis, :] - start
+    to_point = points[np.newaxis, np.newaxis, :, :] - start
+    cross = edge[..., 0] * to_point[..., 1] - edge[..., 1] * to_point[..., 0]
+    inside = np.all(cross >= 0, axis=1) | np.all(cross <= 0, axis=1)
+    return inside.mean(axis=1)
+
+
+def sample_indices(n, max_samples):
+    if n <= max_samples:
+        return np.arange(n)
+    return np.linspace(0, n - 1, max_samples).round().astype(np.intp)
+
+
+def bbox_sample_points(west, south, east, north, n=5):
+    """A n by n grid of points covering the bounding box, as lats, lons"""
+    lats, lons = np.meshgrid(np.linspace(south, north, n), np.linspace(west, east, n))
+    return lats.ravel(), lons.ravel()
+
+
+def project_points(lats, lons, ref_lat):
+    """
+    Equirectangular projection in meters around the ref_lat latitude, precise
+    enough at the scale of a route, as an array of (x, y)
+    """
+    return np.column_stack(
+        (
+            np.radians(lons) * EARTH_RADIUS * np.cos(np.radians(ref_lat)),
+            np.radians(lats) * EARTH_RADIUS,
+        )
+    )
+
+
+def simplify(lats, lons, tolerance):
+    """
+    Indices of the points kept by the Douglas-Peucker simplification of the
+    track, tolerance being in meters
+    """
+    n = len(lats)
+    if n < 3:
+        return np.arange(n)
+    x, y = project_points(lats, lons, np.mean(lats)).T
+    keep = np.zeros(n, dtype=bool)
+    keep[[0, -1]] = True
+    segments = [(0, n - 1)]
+    while segments:
+        first, last = segments.pop()
+        if last - first < 2:
+            continue
+        dx, dy = x[last] - x[first], y[last] - y[first]
+        px, py = x[first + 1 : last] - x[first], y[first + 1 : last] - y[first]
+        length2 = dx * dx + dy * dy
+        if length2 > 0:
+            # Distance to the segment rather than to the line, tracks often
+            # end where they started
+            t = np.clip((px * dx + py * dy) / length2, 0, 1)
+            px, py = px - t * dx, py - t * dy
+        distances2 = px * px + py * py
+        farthest = int(np.argmax(distances2))
+        if distances2[farthest] > tolerance * tolerance:
+            index = first + 1 + farthest
+            keep[index] = True
+            segments.append((first, index))
+            segments.append((index, last))
+    return np.flatnonzero(keep)
+
+
+def route_geometries(arrays):
+    """Encoded polylines of the track simplified at each level of detail"""
+    geometries = {}
+    for level, tolerance in DETAIL_TOLERANCES.items():
+        kept = simplify(arrays.lats, arrays.lons, tolerance)
+        geometries[level] = encode_polyline(
+            zip(arrays.lats[kept].tolist(), arrays.lons[kept].tolist())
+        )
+    return geometries
+
+
+def resample(arrays, step, aligned=False):
+    """
+    Positions along the track every step seconds, as (time of the first
+    sample, lats, lons). Samples are taken at multiples of step since the
+    epoch so that tracks resampled separately line up, or from the start of
+    the track when aligned. Points without time are ignored, returns None if
+    none has a time.
+    """
+    timed = ~np.isnan(arrays.times)
+    if not timed.any():
+        return None
+    # Recording glitches can make the time go backwards
+    times = np.maximum.accumulate(arrays.times[timed])
+    first = times[0] if aligned else np.floor(times[0] / step) * step
+    samples = np.arange(first, times[-1] + step, step)
+    return (
+        float(first),
+        np.interp(samples, times, arrays.lats[timed]),
+        np.interp(samples, times, arrays.lons[timed]),
+    )
+
+
+def control_passages(arrays, controls, radii):
+    """
+    Times at which the track passed the controls, [lat, lon] pairs in the
+    order of the course, None for the missed ones.
+
+    A control is passed at the point of the track closest to it during the
+    first visit within its radius, in meters, after the previous control. A
+    visit still going on when the previous control was passed is not counted,
+    so that a finish placed at the start is not passed right after the start.
+    """
+    from scipy.spatial import KDTree
+
+    controls = np.asarray(controls, dtype=np.float64).reshape(-1, 2)
+    timed = ~np.isnan(arrays.times)
+    if not timed.any() or not len(controls):
+        return [None] * len(controls)
+    times = arrays.times[timed]
+    ref_lat = controls[:, 0].mean()
+    points = project_points(arrays.lats[timed], arrays.lons[timed], ref_lat)
+    targets = project_points(controls[:, 0], controls[:, 1], ref_lat)
+    nearby = KDTree(points).query_ball_point(
+        targets, np.asarray(radii, dtype=np.float64), return_sorted=True
+    )
+    passages = []
+    previous = -1
+    for target, near in zip(targets, nearby):
+        near = np.asarray(near, dtype=np.intp)
+        near = near[near > previous]
+        visits = np.split(near, np.flatnonzero(np.diff(near) > 1) + 1)
+        if previous >= 0 and len(near) and near[0] == previous + 1:
+            visits = visits[1:]
+        if not visits or not len(visits[0]):
+            passages.append(None)
+            continue
+        visit = visits[0]
+        distances = np.hypot(*(points[visit] - target).T)
+        previous = int(visit[np.argmin(distances)])
+        passages.append(float(times[previous]))
+    return passages
+
+
+def route_cells(arrays, zoom=SIGNATURE_ZOOM):
+    """Sorted ids of the web mercator tiles crossed by the track"""
+    x, y = tiles_mercator.latlons_to_pixels(arrays.lats, arrays.lons, zoom)
+    cells = np.floor(y).astype(np.int64) * (1 << zoom) + np.floor(x).astype(np.int64)
+    return np.unique(cells)
+
+
+def densify(points, spacing):
+    """Points along the polyline, no more than spacing apart"""
+    if len(points) < 2:
+        return points
+    deltas = np.diff(points, axis=0)
+    steps = np.maximum(np.ceil(np.hypot(*deltas.T) / spacing), 1).astype(np.intp)
+    segments = np.repeat(np.arange(len(steps)), steps)
+    offsets = np.arange(len(segments)) - np.repeat(np.cumsum(steps) - steps, steps)
+    t = (offsets / np.repeat(steps, steps))[:, np.newaxis]
+    return np.concatenate((points[segments] + t * deltas[segments], points[-1:]))
+
+
+def hausdorff_distance(track, other, spacing=10):
+    """
+    Largest distance, in meters, from a point of one of the tracks, given as
+    [lat, lon] pairs, to the other track
+    """
+    from scipy.spatial.distance import directed_hausdorff
+
+    track = np.asarray(track, dtype=np.float64).reshape(-1, 2)
+    other = np.asarray(other, dtype=np.float64).reshape(-1, 2)
+    ref_lat = track[:, 0].mean()
+    track = densify(project_points(track[:, 0], track[:, 1], ref_lat), spacing)
+    other = densify(project_points(other[:, 0], other[:, 1], ref_lat), spacing)
+    return max(directed_hausdorff(track, other)[0], directed_hausdorff(other, track)[0])
+
+
+def validate_route_arrays(arrays):
+    """
+    Raise ValueError, pointing to the first invalid point, unless the track
+    has points with valid coordinates and times that do not go backwards
+    """
+    if not len(arrays.lats):
+        raise ValueError("No points")
+    checks = (
+        (~(np.isfinite(arrays.lats) & np.isfinite(arrays.lons)), "Invalid coordinates"),
+        (np.abs(arrays.lats) > 90, "latitude out of range -90.0 90.0"),
+        (np.abs(arrays.lons) > 180, "longitude out of range -180.0 180.0"),
+        (np.isinf(arrays.times), "Invalid time"),
+    )
+    for invalid, message in checks:
+        if invalid.any():
+            raise ValueError(f"{message} at point {np.argmax(invalid)}")
+    timed = np.flatnonzero(~np.isnan(arrays.times))
+    backwards = np.diff(arrays.times[timed]) < 0
+    if backwards.any():
+        raise ValueError(
+            f"Time going backwards at point {timed[np.argmax(backwards) + 1]}"
+        )
+
+
+def first_invalid(values, is_valid):
+    return next(i for i, value in enumerate(values) if not is_valid(value))
+
+
+def route_data_to_arrays(route):
+    """
+    RouteArrays of the route data posted by the clients, a list of
+    {"time": ..., "latlon": [lat, lon]} points, raises ValueError pointing to
+    the first invalid point. Types are checked on whole lists at once, points
+    are only looked at one by one to find the one to report.
+    """
+    if not isinstance(route, list) or not route:
+        raise ValueError("Invalid route data")
+    try:
+        times = [point["time"] for point in route]
+        latlons = [point["latlon"] for point in route]
+    except (KeyError, TypeError):
+        index = first_invalid(
+            route, lambda p: isinstance(p, dict) and "time" in p and "latlon" in p
+        )
+        raise ValueError(f"Invalid route data at point {index}")
+    if not set(map(type, times)) <= ROUTE_TIME_TYPES:
+        index = first_invalid(times, lambda t: type(t) in ROUTE_TIME_TYPES)
+        raise ValueError(f"Invalid time at point {index}")
+    if set(map(type, latlons)) != {list} or set(map(len, latlons)) != {2}:
+        index = first_invalid(latlons, lambda c: type(c) is list and len(c) == 2)
+        raise ValueError(f"Invalid coordinates at point {index}")
+    if not set(map(type, chain.from_iterable(latlons))) <= ROUTE_COORDINATE_TYPES:
+        index = first_invalid(
+            latlons, lambda c: {type(c[0]), type(c[1])} <= ROUTE_COORDINATE_TYPES
+        )
+        raise ValueError(f"Invalid coordinates at point {index}")
+    # None times become NaN
+    latlons = np.array(latlons, dtype=np.float64)
+    arrays = RouteArrays(
+        np.array(times, dtype=np.float64), latlons[:, 0], latlons[:, 1]
+    )
+    validate_route_arrays(arrays)
+    return arrays
+
+
+def route_json_from_arrays(arrays):
+    """
+    JSON list of {"time": ..., "latlon": [lat, lon]} points as written by
+    json.dumps, without building the points
+    """
+    times = [None if t != t else t for t in arrays.times.tolist()]
+    return (
+        "["
+        + ", ".join(
+            f'{{"time": {"null" if t is None else repr(t)}, '
+            f'"latlon": [{lat!r}, {lon!r}]}}'
+            for t, lat, lon in zip(times, arrays.lats.tolist(), arrays.lons.tolist())
+        )
+        + "]"
+    )
+
+
+def encode_unsigned_numbers(values):
+    """
+    Vectorized encode_unsigned_number of an array of non negative integers
+    below 2**60, concatenated
+    """
+    values = np.asarray(values, dtype=np.int64)
+    if not len(values):
+        return ""
+    chunk_count = max(1, (int(values.max()).bit_length() + 4) // 5)
+    shifts = 5 * np.arange(chunk_count + 1, dtype=np.int64)
+    shifted = values[:, None] >> shifts
+    # A chunk is written if it or a later one is not zero, the first always
+    written = shifted > 0
+    written[:, 0] = True
+    chars = (shifted[:, :-1] & 0x1F) + 63 + np.where(written[:, 1:], 0x20, 0)
+    return chars[written[:, :-1]].astype(np.uint8).tobytes().decode("ascii")
+
+
+def zigzag(values):
+    """Signed integers as encode_signed_number maps them to unsigned ones"""
+    values = np.asarray(values, dtype=np.int64)
+    return np.where(values < 0, ~(values << 1), values << 1)
+
+
+def encode_geolocation_series(arrays):
+    """
+    Track in the string encoding of GeoLocationSeries, None when it can not
+    be encoded, which needs times from 2010 that never go backwards
+    """
+    if np.isnan(arrays.times).any():
+        return None
+    time_deltas = np.diff(np.round(arrays.times).astype(np.int64), prepend=YEAR2010)
+    if (time_deltas < 0).any():
+        return None
+    values = np.empty((len(time_deltas), 3), dtype=np.int64)
+    values[:, 0] = time_deltas
+    for column, coordinates in ((1, arrays.lats), (2, arrays.lons)):
+        values[:, column] = zigzag(
+            np.diff(np.round(coordinates * 1e5).astype(np.int64), prepend=0)
+        )
+    return encode_unsigned_numbers(values.ravel())
+
+
+def encode_route_columns(arrays):
+    """
+    Track as columns a client reads as typed arrays: ROUTE_COLUMNS_MAGIC, the
+    uint32 number of points, float64 times, NaN when missing, then int32
+    latitudes and longitudes in 1e-7 degrees, all little endian
+    """
+    return b"".join(
+        (
+            ROUTE_COLUMNS_MAGIC,
+            np.array(len(arrays.times), dtype="<u4").tobytes(),
+            arrays.times.astype("<f8").tobytes(),
+            np.round(arrays.lats * ROUTE_COLUMNS_SCALE).astype("<i4").tobytes(),
+            np.round(arrays.lons * ROUTE_COLUMNS_SCALE).astype("<i4").tobytes(),
+        )
+    )
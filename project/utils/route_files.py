@@ -0,0 +1,223 @@
+import struct
+import xml.etree.ElementTree as ET
+from datetime import datetime, timezone
+
+import numpy as np
+
+from project.utils.route_data import RouteArrays
+
+# Bytes read at the start of a file to tell its format
+SNIFF_SIZE = 2048
+
+# FIT timestamps are seconds since 1989-12-31T00:00:00Z
+FIT_EPOCH = 631065600
+FIT_HEADER = struct.Struct("<BBHI4s")
+FIT_RECORD = 20
+FIT_TIMESTAMP, FIT_LATITUDE, FIT_LONGITUDE = 253, 0, 1
+FIT_INVALID_UINT32 = 0xFFFFFFFF
+FIT_INVALID_SINT32 = 0x7FFFFFFF
+SEMICIRCLES_TO_DEGREES = 180 / 2**31
+# Semicircles are about 1cm, no need for more decimals
+FIT_DEGREES_DECIMALS = 7
+
+
+def local_name(tag):
+    """Tag name without its namespace, files use several versions of them"""
+    return tag.rpartition("}")[2]
+
+
+def parse_times(values):
+    """Seconds since the epoch of ISO 8601 date times, NaN for missing ones"""
+    times = np.full(len(values), np.nan)
+    # Nearly all files use UTC times, parsed at once by numpy
+    utc = [i for i, value in enumerate(values) if value and value.endswith("Z")]
+    if utc:
+        stamps = np.array([values[i][:-1] for i in utc], dtype="datetime64[us]")
+        times[utc] = stamps.astype(np.int64) / 1e6
+    for i, value in enumerate(values):
+        if value and not value.endswith("Z"):
+            date_time = datetime.fromisoformat(value)
+            if date_time.tzinfo is None:
+                date_time = date_time.replace(tzinfo=timezone.utc)
+            times[i] = date_time.timestamp()
+    return times
+
+
+def to_arrays(times, lats, lons):
+    try:
+        return RouteArrays(
+            parse_times(times),
+            np.array(lats, dtype=np.float64),
+            np.array(lons, dtype=np.float64),
+        )
+    except (TypeError, ValueError):
+        raise ValueError("Invalid point in the file")
+
+
+def parse_gpx(fileobj):
+    """Track points, or route points if there is no track, of a GPX file"""
+    points = {"trkpt": ([], [], []), "rtept": ([], [], [])}
+    for _, elem in ET.iterparse(fileobj):
+        tag = local_name(elem.tag)
+        if tag not in points:
+            continue
+        times, lats, lons = points[tag]
+        time = None
+        for child in elem:
+            if local_name(child.tag) == "time":
+                time = (child.text or "").strip()
+        times.append(time)
+        lats.append(elem.get("lat"))
+        lons.append(elem.get("lon"))
+        elem.clear()
+    return to_arrays(*(points["trkpt"] if points["trkpt"][0] else points["rtept"]))
+
+
+def parse_tcx(fileobj):
+    """Track points of a TCX file, the ones without position are skipped"""
+    times, lats, lons = [], [], []
+    time = lat = lon = None
+    for _, elem in ET.iterparse(fileobj):
+        tag = local_name(elem.tag)
+        if tag == "Time":
+            time = (elem.text or "").strip()
+        elif tag == "LatitudeDegrees":
+            lat = elem.text
+        elif tag == "LongitudeDegrees":
+            lon = elem.text
+        elif tag == "Trackpoint":
+            if lat is not None and lon is not None:
+                times.append(time)
+                lats.append(lat)
+                lons.append(lon)
+            time = lat = lon = None
+            elem.clear()
+    return to_arrays(times, lats, lons)
+
+
+def fit_definition(data, pos, has_developer_fields):
+    """
+    Read the definition message at pos, returns the position after it and
+    (struct, timestamp index, latitude index, longitude index) where the
+    struct unpacks only the fields we need of the matching data messages
+    """
+    architecture = data[pos + 1]
+    if architecture > 1:
+        raise ValueError("Invalid FIT definition message")
+    endian = ">" if architecture else "<"
+    (global_number,) = struct.unpack_from(endian + "H", data, pos + 2)
+    wanted = {FIT_TIMESTAMP: "I"}
+    if global_number == FIT_RECORD:
+        wanted.update({FIT_LATITUDE: "i", FIT_LONGITUDE: "i"})
+    field_count = data[pos + 4]
+    pos += 5
+    fmt = endian
+    numbers = []
+    for _ in range(field_count):
+        number, size = data[pos], data[pos + 1]
+        if number in wanted and size == 4:
+            fmt += wanted.pop(number)
+            numbers.append(number)
+        else:
+            fmt += f"{size}x"
+        pos += 3
+    if has_developer_fields:
+        developer_field_count = data[pos]
+        pos += 1
+        for _ in range(developer_field_count):
+            fmt += f"{data[pos + 1]}x"
+            pos += 3
+    indexes = [
+        numbers.index(number) if number in numbers else None
+        for number in (FIT_TIMESTAMP, FIT_LATITUDE, FIT_LONGITUDE)
+    ]
+    return pos, (struct.Struct(fmt), *indexes)
+
+
+def parse_fit(fileobj):
+    """
+    Positions of the record messages of a FIT file, the ones without
+    position are skipped. The messages are read in one pass, unpacking only
+    the timestamp and position fields. The CRC is not checked.
+    """
+    data = memoryview(fileobj.read())
+    try:
+        header_size, _, _, data_size, signature = FIT_HEADER.unpack_from(data)
+    except struct.error:
+        raise ValueError("Invalid FIT file")
+    if signature != b".FIT" or header_size < FIT_HEADER.size:
+        raise ValueError("Invalid FIT file")
+    end = header_size + data_size
+    if len(data) < end:
+        raise ValueError("Truncated FIT file")
+    definitions = {}
+    times, lats, lons = [], [], []
+    timestamp = None
+    pos = header_size
+    try:
+        while pos < end:
+            header = data[pos]
+            pos += 1
+            time = np.nan
+            if header & 0x80:
+                # Compressed timestamp header, 5 bits offset from the last one
+                if timestamp is None:
+                    raise ValueError("Invalid FIT file")
+                timestamp += ((header & 0x1F) - timestamp) & 0x1F
+                time = timestamp
+                local_type = (header >> 5) & 0x03
+            elif header & 0x40:
+                pos, definitions[header & 0x0F] = fit_definition(
+                    data, pos, header & 0x20
+                )
+                continue
+            else:
+                local_type = header & 0x0F
+            if local_type not in definitions:
+                raise ValueError("FIT data message without definition")
+            message, timestamp_index, lat_index, lon_index = definitions[local_type]
+            values = message.unpack_from(data, pos)
+            pos += message.size
+            if timestamp_index is not None:
+                if values[timestamp_index] != FIT_INVALID_UINT32:
+                    time = timestamp = values[timestamp_index]
+            if lat_index is None or lon_index is None:
+                continue
+            lat, lon = values[lat_index], values[lon_index]
+            if lat != FIT_INVALID_SINT32 and lon != FIT_INVALID_SINT32:
+                times.append(time)
+                lats.append(lat)
+                lons.append(lon)
+    except (IndexError, struct.error):
+        raise ValueError("Truncated FIT file")
+    if pos > end:
+        raise ValueError("Truncated FIT file")
+    return RouteArrays(
+        np.array(times, dtype=np.float64) + FIT_EPOCH,
+        np.round(
+            np.array(lats, dtype=np.float64) * SEMICIRCLES_TO_DEGREES,
+            FIT_DEGREES_DECIMALS,
+        ),
+        np.round(
+            np.array(lons, dtype=np.float64) * SEMICIRCLES_TO_DEGREES,
+            FIT_DEGREES_DECIMALS,
+        ),
+    )
+
+
+def parse_route_file(fileobj):
+    """
+    RouteArrays of the points of a GPX, TCX or FIT file, raises ValueError
+    when the file can not be read
+    """
+    head = fileobj.read(SNIFF_SIZE)
+    fileobj.seek(0)
+    if isinstance(head, str):
+        head = head.encode()
+    if head[8:12] == b".FIT":
+        return parse_fit(fileobj)
+    parser = parse_tcx if b"TrainingCenterDatabase" in head else parse_gpx
+    try:
+        return parser(fileobj)
+    except ET.ParseError:
+        raise ValueError("Invalid GPX, TCX or FIT file")
@@ -1,6 +1,5 @@
 import os.path
 
-import boto3
 from django.conf import settings
 
 
@@ -11,6 +10,8 @@ def bytes_to_str(b):
 
 
 def get_s3_client():
+    import boto3
+
     return boto3.client(
         "s3",
         endpoint_url=settings.AWS_S3_ENDPOINT_URL,
@@ -57,3 +58,13 @@ def s3_rename_object(bucket, src, dest):
 def upload_to_s3(bucket, key, fileobj):
     s3 = get_s3_client()
     s3.upload_fileobj(fileobj, bucket, key)
+
+
+def iter_s3_object(bucket, key, chunk_size=1024 * 1024):
+    """Yield the content of an object in chunks, without loading it whole"""
+    s3 = get_s3_client()
+    body = s3.get_object(Bucket=bucket, Key=key)["Body"]
+    try:
+        yield from body.iter_chunks(chunk_size)
+    finally:
+        body.close()
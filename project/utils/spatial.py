@@ -0,0 +1,79 @@
+from django.db import models
+from django.db.models import F, FloatField, Func, Lookup, Value
+from django.db.models.functions import Greatest, Least
+from rest_framework.exceptions import ValidationError
+
+from project.utils.validators import FLOAT_RE
+
+
+class BoxField(models.Field):
+    """Output field of Postgres box expressions"""
+
+    def db_type(self, connection):
+        return "box"
+
+
+@BoxField.register_lookup
+class Overlaps(Lookup):
+    lookup_name = "overlaps"
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f"{lhs} && {rhs}", (*lhs_params, *rhs_params)
+
+
+class BoundingBox(Func):
+    """
+    box(point(west, south), point(east, north)), indexable with GiST.
+    Bounding boxes crossing the antimeridian are not supported.
+    """
+
+    function = "box"
+
+    def __init__(self, west, south, east, north, **extra):
+        super().__init__(
+            Func(west, south, function="point"),
+            Func(east, north, function="point"),
+            output_field=BoxField(),
+            **extra,
+        )
+
+    @classmethod
+    def from_values(cls, west, south, east, north):
+        return cls(
+            *(Value(v, output_field=FloatField()) for v in (west, south, east, north))
+        )
+
+
+def parse_bbox(value):
+    """Parse a 'west,south,east,north' string"""
+    values = value.split(",")
+    if len(values) != 4 or not all(FLOAT_RE.match(v) for v in values):
+        raise ValidationError({"bbox": "Expecting 'west,south,east,north' floats"})
+    west, south, east, north = (float(v) for v in values)
+    if not (-180 <= west <= east <= 180 and -90 <= south <= north <= 90):
+        raise ValidationError({"bbox": "Invalid bounding box"})
+    return west, south, east, north
+
+
+def filter_by_bbox(queryset, bbox):
+    return queryset.alias(
+        bbox=BoundingBox("west", "south", "east", "north"),
+    ).filter(bbox__overlaps=BoundingBox.from_values(*bbox))
+
+
+def bbox_area():
+    """Area of the bounding box of the rows, in square degrees"""
+    return (F("east") - F("west")) * (F("north") - F("south"))
+
+
+def bbox_overlap_area(bbox):
+    """
+    Area of the intersection of the bounding box of the rows with a bounding
+    box overlapping it, in square degrees
+    """
+    west, south, east, north = (Value(v, output_field=FloatField()) for v in bbox)
+    return (Least("east", east) - Greatest("west", west)) * (
+        Least("north", north) - Greatest("south", south)
+    )
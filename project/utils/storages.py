@@ -1,6 +1,7 @@
 import os
 
-from django.core.files.storage import FileSystemStorage
+from django.core.files.storage import FileSystemStorage, Storage
+from django.utils.deconstruct import deconstructible
 
 
 class OverwriteImageStorage(FileSystemStorage):
@@ -24,3 +25,29 @@ class OverwriteImageStorage(FileSystemStorage):
 
     def url(self, name):
         return "/media/{}".format(name)
+
+
+@deconstructible(path="django_s3_storage.storage.S3Storage")
+class LazyS3Storage(Storage):
+    """S3 storage deferring the import of boto3 until it is first used.
+    Deconstructs to a plain S3Storage so migrations are not affected.
+    """
+
+    _own_attributes = frozenset(
+        ("_kwargs", "_storage", "_constructor_args", "deconstruct", "__class__")
+    )
+
+    def __init__(self, **kwargs):
+        self._kwargs = kwargs
+        self._storage = None
+
+    def __getattribute__(self, name):
+        if name in LazyS3Storage._own_attributes:
+            return super().__getattribute__(name)
+        storage = super().__getattribute__("_storage")
+        if storage is None:
+            from django_s3_storage.storage import S3Storage
+
+            storage = S3Storage(**super().__getattribute__("_kwargs"))
+            self._storage = storage
+        return getattr(storage, name)
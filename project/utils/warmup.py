@@ -0,0 +1,86 @@
+import gc
+import importlib
+import sys
+import time
+
+from project.utils.geo import geo_lookup
+
+
+def _warm_pil():
+    from PIL import Image
+
+    Image.init()
+
+
+def _warm_urls():
+    from django.urls import get_resolver
+
+    _ = get_resolver().url_patterns
+
+
+def _warm_timezonefinder():
+    _ = geo_lookup.tz_finder
+
+
+def _warm_reverse_geocoder():
+    _ = geo_lookup.geocoder
+
+
+# Modules imported lazily by the request handlers, with the function loading
+# their data when it is not done at import time.
+WARMUP_STEPS = (
+    ("numpy", None),
+    ("PIL.Image", _warm_pil),
+    ("arrow", None),
+    ("stravalib", None),
+    ("timezonefinder", _warm_timezonefinder),
+    ("reverse_geocoder", _warm_reverse_geocoder),
+    ("project.routedb.views", _warm_urls),
+)
+
+
+def warm_up(steps=WARMUP_STEPS):
+    """
+    Import heavy modules and load their data in the current process.
+
+    Meant to be called in the app server master process before forking so that
+    workers share the loaded data copy on write. Returns a list of
+    (module name, import seconds, warm up seconds, error) tuples.
+    """
+    report = []
+    for module_name, warm_func in steps:
+        error = None
+        import_time = warm_time = 0
+        t0 = time.perf_counter()
+        try:
+            if module_name not in sys.modules:
+                importlib.import_module(module_name)
+            import_time = time.perf_counter() - t0
+            if warm_func:
+                t0 = time.perf_counter()
+                warm_func()
+                warm_time = time.perf_counter() - t0
+        except Exception as e:
+            error = str(e)
+        report.append((module_name, import_time, warm_time, error))
+    # Objects allocated so far live for the whole life of the process, moving
+    # them out of the collected generations avoids the garbage collector
+    # touching, and thus copying, their pages in every worker.
+    gc.freeze()
+    return report
+
+
+def format_report(report):
+    lines = []
+    total = 0
+    for module_name, import_time, warm_time, error in report:
+        total += import_time + warm_time
+        line = (
+            f"{module_name:<24} import {import_time * 1000:8.1f}ms "
+            f"warm up {warm_time * 1000:8.1f}ms"
+        )
+        if error:
+            line += f" FAILED: {error}"
+        lines.append(line)
+    lines.append(f"{'total':<24} {total * 1000:.1f}ms")
+    return lines
@@ -0,0 +1,51 @@
+import io
+import zipfile
+
+# Earliest date that can be stored in a ZIP archive
+ZIP_MIN_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+
+class StreamBuffer(io.RawIOBase):
+    """Write only, unseekable, file holding what was written until popped"""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def pop(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def zip_stream(entries):
+    """
+    Yield a ZIP archive as it is written. entries is an iterable of (name,
+    date_time, compress_type, chunks) tuples, chunks being an iterable of the
+    bytes of the file. Only the chunk being compressed is held in memory.
+    """
+    buffer = StreamBuffer()
+    # The archive can not seek back, sizes are written after each file
+    with zipfile.ZipFile(buffer, mode="w") as archive:
+        for name, date_time, compress_type, chunks in entries:
+            info = zipfile.ZipInfo(name, date_time=max(date_time, ZIP_MIN_DATE_TIME))
+            info.compress_type = compress_type
+            with archive.open(info, mode="w") as fp:
+                for chunk in chunks:
+                    fp.write(chunk)
+                    if data := buffer.pop():
+                        yield data
+            if data := buffer.pop():
+                yield data
+    yield buffer.pop()